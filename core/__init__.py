@@ -3,6 +3,7 @@ from .downloader import Downloader
 from .gemini import GeminiProvider
 from .http_manager import HttpManager
 from .openai_chat import OpenAIChatProvider
+from .openai_images import OpenAIImagesProvider
 
 __all__ = [
     "HttpManager",
@@ -10,4 +11,5 @@ __all__ = [
     "BaseProvider",
     "GeminiProvider",
     "OpenAIChatProvider",
+    "OpenAIImagesProvider",
 ]
@@ -1,5 +1,8 @@
-import random
+import asyncio
+import time
 from abc import ABC, abstractmethod
+from collections.abc import Callable
+from contextlib import AsyncExitStack
 from typing import ClassVar
 
 from curl_cffi import AsyncSession
@@ -7,9 +10,10 @@ from curl_cffi import AsyncSession
 from astrbot.api import logger
 from astrbot.core.config.astrbot_config import AstrBotConfig
 
-from .data import CommonConfig, PromptConfig, ProviderConfig
+from .data import CommonConfig, ImageData, PromptConfig, ProviderConfig
+from .deadline import Deadline
 from .downloader import Downloader
-from .utils import get_key_index
+from .utils import parse_retry_after
 
 
 class BaseProvider(ABC):
@@ -30,6 +34,10 @@ class BaseProvider(ABC):
     RETRY_STATUS_CODES = frozenset({408, 500, 502, 503, 504})
     # 不可重试状态码
     NO_RETRY_STATUS_CODES = frozenset({401, 402, 403, 422, 429})
+    # 接口能否在一次请求中返回多张候选图片（count 参数）
+    native_count: ClassVar[bool] = False
+    # 任务时间预算耗尽时的错误信息
+    DEADLINE_EXCEEDED_MSG = "图片生成失败：已超出本次任务的时间上限，请稍后再试"
 
     def __init__(
         self,
@@ -38,12 +46,15 @@ class BaseProvider(ABC):
         prompt_config: PromptConfig,
         session: AsyncSession,
         downloader: Downloader,
+        feedback: Callable[[int | None, float], None] | None = None,
     ):
         self.conf = config
         self.def_prompt_config = prompt_config
         self.def_common_config = common_config
         self.session = session
         self.downloader = downloader
+        # 每次请求结束后回报 (状态码, 耗时)，用于自适应并发控制
+        self.feedback = feedback
 
     def __init_subclass__(cls, **kwargs):
         super().__init_subclass__(**kwargs)
@@ -63,63 +74,165 @@ class BaseProvider(ABC):
         self,
         provider_config: ProviderConfig,
         params: dict,
-        image_b64_list: list[tuple[str, str]] | None = None,
-    ) -> tuple[list[tuple[str, str]] | None, str | None]:
-        """图片生成调度方法"""
-        key_list_len = len(provider_config.keys)
-        if key_list_len == 0:
+        image_list: list[ImageData] | None = None,
+        deadline: Deadline | None = None,
+    ) -> tuple[list[ImageData] | None, str | None]:
+        """图片生成调度方法
+
+        Args:
+            params: 生成参数，其中 count 为候选图片数量
+            deadline: 任务的端到端时间预算，每次请求的超时时间都会被裁剪到剩余预算以内
+        """
+        if not provider_config.keys:
             return None, "图片生成失败：未配置 API Key"
-        current_index = random.randrange(key_list_len)
-        # 轮询使用 API Key
+        if deadline is None:
+            deadline = Deadline(None)
+        # 请求体只构建一次，重试、切换 Key 和并发候选请求时复用
+        body = self._build_request_body(provider_config, image_list or [], params)
+        count = params.get("count", 1)
+        if count <= 1 or self.native_count:
+            return await self._generate_with_retry(provider_config, body, deadline)
+
+        # 接口不支持一次返回多张图片时，并发发起 count 次请求
+        results = await asyncio.gather(
+            *(
+                self._generate_with_retry(provider_config, body, deadline)
+                for _ in range(count)
+            )
+        )
+        images = [image for images_result, _ in results for image in images_result or []]
+        if images:
+            if len(images) < count:
+                logger.warning(
+                    f"{provider_config.api_name} 仅生成 {len(images)}/{count} 张候选图片"
+                )
+            return images, None
+        return None, next((err for _, err in results if err), None)
+
+    async def _generate_with_retry(
+        self,
+        provider_config: ProviderConfig,
+        body: bytes,
+        deadline: Deadline,
+    ) -> tuple[list[ImageData] | None, str | None]:
+        """按 Key 健康度依次尝试并重试单次生成请求"""
+        key_pool = provider_config.key_pool
+        breaker = provider_config.circuit_breaker
+        # 按健康度排序 Key，冷却中和隔离中的 Key 不参与
+        key_order = key_pool.select()
+        if not key_order:
+            return None, "图片生成失败：所有 Key 均处于限流冷却或隔离状态"
         err = None
-        for key_ in range(key_list_len):
-            # 获取下一个 Key 索引
-            current_index = get_key_index(current_index, key_list_len)
+        for key_index, api_key in enumerate(key_order):
             # 重试机制
             for i in range(self.def_common_config.max_retry):
-                if provider_config.stream:
-                    images_result, status, err = await self._call_stream_api(
-                        provider_config=provider_config,
-                        api_key=provider_config.keys[current_index],
-                        params=params,
-                        image_b64_list=image_b64_list,
-                    )
-                else:
-                    images_result, status, err = await self._call_api(
-                        provider_config=provider_config,
-                        api_key=provider_config.keys[current_index],
-                        params=params,
-                        image_b64_list=image_b64_list,
-                    )
+                if deadline.expired:
+                    return None, self.DEADLINE_EXCEEDED_MSG
+                # 每次请求单独占用提供商的并发名额，并发候选请求各占一个，重试等待期间不占用
+                async with AsyncExitStack() as stack:
+                    # 只有等待名额超时才按预算耗尽处理，请求内部抛出的 TimeoutError 照常向上传递
+                    try:
+                        await stack.enter_async_context(
+                            provider_config.pool.slot(timeout=deadline.remaining())
+                        )
+                    except TimeoutError:
+                        logger.warning(
+                            f"等待 {provider_config.api_name} 的并发名额超出时间预算"
+                        )
+                        return None, self.DEADLINE_EXCEEDED_MSG
+                    start = time.monotonic()
+                    if provider_config.stream:
+                        images_result, status, err = await self._call_stream_api(
+                            provider_config=provider_config,
+                            api_key=api_key,
+                            body=body,
+                            deadline=deadline,
+                        )
+                    else:
+                        images_result, status, err = await self._call_api(
+                            provider_config=provider_config,
+                            api_key=api_key,
+                            body=body,
+                            deadline=deadline,
+                        )
+                # 因预算耗尽被裁剪的超时不计入 Key 和提供商的健康统计
+                if not images_result and status == 408 and deadline.expired:
+                    return None, self.DEADLINE_EXCEEDED_MSG
+                breaker.record_status(status)
+                if self.feedback is not None:
+                    self.feedback(status, time.monotonic() - start)
                 if images_result:
+                    key_pool.report_success(api_key, time.monotonic() - start)
                     return images_result, None
+                key_pool.report_failure(api_key, status)
+                # 提供商已熔断（或半开试探失败），不再继续消耗重试，交给调度器切换提供商
+                if not breaker.is_closed:
+                    logger.warning(f"{provider_config.api_name} 已熔断，停止重试")
+                    return None, err or "图片生成失败：提供商暂时不可用"
+                # 被限流或判定为无效的 Key 直接切换
+                if not key_pool.is_available(api_key):
+                    break
                 if self.def_common_config.smart_retry and not self.should_retry(status):
                     break
                 logger.warning(
                     f"图片生成失败，正在重试 {provider_config.api_name} 当前Key ({i + 1}/ {self.def_common_config.max_retry})"
                 )
-            else:
-                if key_ < key_list_len - 1:
-                    logger.warning(
-                        f"图片生成失败，切换到 {provider_config.api_name} 下一个Key"
-                    )
+            if key_index < len(key_order) - 1:
+                logger.warning(
+                    f"图片生成失败，切换到 {provider_config.api_name} 下一个Key"
+                )
         return None, err or "图片生成失败：所有 Key 均已用尽或不可用"
 
+    @staticmethod
+    def _note_retry_after(
+        provider_config: ProviderConfig, api_key: str, response
+    ) -> None:
+        """限流响应携带 Retry-After 时，按其设置 Key 的冷却时间"""
+        if response.status_code in provider_config.key_pool.RATE_LIMIT_STATUS_CODES:
+            provider_config.key_pool.set_cooldown(
+                api_key, parse_retry_after(response.headers.get("Retry-After"))
+            )
+
+    @staticmethod
+    def _preview(content: bytes | bytearray, limit: int = 1024) -> str:
+        """截取响应原始字节的前 limit 字节用于日志，避免解码完整响应体"""
+        return content[:limit].decode("utf-8", errors="replace")
+
+    @classmethod
+    async def _read_stream_preview(cls, response, limit: int = 1024) -> str:
+        """读取流式响应开头的 limit 字节用于日志，不读取完整响应体"""
+        preview = bytearray()
+        async for chunk in response.aiter_content(chunk_size=limit):
+            preview.extend(chunk)
+            if len(preview) >= limit:
+                break
+        return cls._preview(preview, limit)
+
     def should_retry(self, status) -> bool:
         if status in self.RETRY_STATUS_CODES:
             return True
         return False
 
+    @abstractmethod
+    def _build_request_body(
+        self,
+        provider_config: ProviderConfig,
+        image_list: list[ImageData],
+        params: dict,
+    ) -> bytes:
+        """构建序列化后的请求体"""
+        pass
+
     @abstractmethod
     async def _call_api(
         self, **kwargs
-    ) -> tuple[list[tuple[str, str]], int | None, str | None]:
+    ) -> tuple[list[ImageData] | None, int | None, str | None]:
         """调用同步 API 方法"""
         pass
 
     @abstractmethod
     async def _call_stream_api(
         self, **kwargs
-    ) -> tuple[list[tuple[str, str]], int | None, str | None]:
+    ) -> tuple[list[ImageData] | None, int | None, str | None]:
         """调用流式 API 方法"""
         pass
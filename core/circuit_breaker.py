@@ -0,0 +1,141 @@
+import time
+from collections import deque
+
+# 熔断器状态
+STATE_CLOSED = "closed"
+"""闭合：正常放行请求"""
+STATE_OPEN = "open"
+"""断开：直接跳过该提供商"""
+STATE_HALF_OPEN = "half_open"
+"""半开：只放行一个试探请求"""
+
+
+class CircuitBreaker:
+    """提供商熔断器
+
+    统计最近 window 次请求的结果，失败率过高、连续失败或连续超时都会使熔断器断开。
+    断开期间调度器直接跳过该提供商；冷却时间结束后进入半开状态，只放行一个试探请求，
+    成功则闭合，失败则再次断开并延长冷却时间。
+    """
+
+    def __init__(
+        self,
+        window: int = 10,
+        min_requests: int = 4,
+        failure_rate: float = 0.5,
+        consecutive_failures: int = 3,
+        consecutive_timeouts: int = 2,
+        open_duration: float = 60,
+        max_open_duration: float = 600,
+    ):
+        self.window = window
+        self.min_requests = min_requests
+        self.failure_rate = failure_rate
+        self.consecutive_failures = consecutive_failures
+        self.consecutive_timeouts = consecutive_timeouts
+        self.open_duration = open_duration
+        self.max_open_duration = max_open_duration
+        self._outcomes: deque[bool] = deque(maxlen=window)
+        self._failures_in_row = 0
+        self._timeouts_in_row = 0
+        self._state = STATE_CLOSED
+        self._opened_at = 0.0
+        self._current_open_duration = open_duration
+        self._trial_deadline = 0.0
+        # 统计
+        self.open_count = 0
+        self.skipped = 0
+
+    @property
+    def state(self) -> str:
+        """当前状态，断开超时后自动转为半开"""
+        if (
+            self._state == STATE_OPEN
+            and time.monotonic() - self._opened_at >= self._current_open_duration
+        ):
+            self._state = STATE_HALF_OPEN
+            self._trial_deadline = 0.0
+        return self._state
+
+    @property
+    def is_closed(self) -> bool:
+        return self.state == STATE_CLOSED
+
+    def allow_request(self) -> bool:
+        """是否放行请求；半开状态下同一时间只放行一个试探请求"""
+        state = self.state
+        if state == STATE_CLOSED:
+            return True
+        now = time.monotonic()
+        if state == STATE_HALF_OPEN and now >= self._trial_deadline:
+            # 试探请求未回报结果（例如被取消）时，超过冷却时间后允许再次试探
+            self._trial_deadline = now + self._current_open_duration
+            return True
+        self.skipped += 1
+        return False
+
+    def _open(self) -> None:
+        if self._state == STATE_HALF_OPEN:
+            # 试探失败，延长冷却时间
+            self._current_open_duration = min(
+                self._current_open_duration * 2, self.max_open_duration
+            )
+        else:
+            self._current_open_duration = self.open_duration
+        self._state = STATE_OPEN
+        self._opened_at = time.monotonic()
+        self.open_count += 1
+
+    def record_success(self) -> None:
+        """记录成功（提供商正常响应）"""
+        self._outcomes.append(True)
+        self._failures_in_row = 0
+        self._timeouts_in_row = 0
+        if self._state != STATE_CLOSED:
+            self._state = STATE_CLOSED
+            self._outcomes.clear()
+            self._current_open_duration = self.open_duration
+
+    def record_failure(self, timeout: bool = False) -> None:
+        """记录失败（服务端错误、限流、网络错误或超时）"""
+        self._outcomes.append(False)
+        self._failures_in_row += 1
+        self._timeouts_in_row = self._timeouts_in_row + 1 if timeout else 0
+        if self.state == STATE_HALF_OPEN:
+            self._open()
+            return
+        if self._state == STATE_OPEN:
+            return
+        failures = self._outcomes.count(False)
+        if (
+            self._failures_in_row >= self.consecutive_failures
+            or self._timeouts_in_row >= self.consecutive_timeouts
+            or (
+                len(self._outcomes) >= self.min_requests
+                and failures / len(self._outcomes) >= self.failure_rate
+            )
+        ):
+            self._open()
+
+    def record_status(self, status: int | None) -> None:
+        """按单次请求的状态码记录结果。
+        200 视为提供商可用（即使内容被审查）；超时、5xx、限流和网络错误视为失败；
+        其余 4xx（Key 无效、参数错误等）与提供商健康无关，不计入。
+        """
+        if status == 200:
+            self.record_success()
+        elif status == 408:
+            self.record_failure(timeout=True)
+        elif status is None or status == 429 or status >= 500:
+            self.record_failure()
+
+    def describe(self) -> str:
+        """可读的状态描述"""
+        state = self.state
+        if state == STATE_OPEN:
+            remaining = self._current_open_duration - (time.monotonic() - self._opened_at)
+            return f"熔断中（{remaining:.0f}s 后试探）"
+        if state == STATE_HALF_OPEN:
+            return "半开（等待试探结果）"
+        failures = self._outcomes.count(False)
+        return f"正常（近 {len(self._outcomes)} 次失败 {failures} 次）"
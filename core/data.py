@@ -1,12 +1,18 @@
-from dataclasses import dataclass
+import base64
+from dataclasses import dataclass, field
 from typing import Literal
 
+from .circuit_breaker import CircuitBreaker
+from .key_pool import KeyPool
+from .provider_pool import ProviderPool
+from .stats import LatencyTracker
+
 # 常数
 DEF_OPENAI_API_URL = "https://api.openai.com/v1/chat/completions"
 DEF_GEMINI_API_URL = "https://generativelanguage.googleapis.com/v1beta/models"
 
 # 类型枚举
-_API_Type = Literal["Gemini", "OpenAI_Chat"]
+_API_Type = Literal["Gemini", "OpenAI_Chat", "OpenAI_Images"]
 
 # 支持的文件格式
 SUPPORTED_FILE_FORMATS = (
@@ -49,6 +55,22 @@ class ProviderConfig:
     """模型名称"""
     stream: bool = False
     """是否启用流式响应"""
+    max_concurrent: int = 0
+    """该提供商的最大并发请求数, 0 表示不限制"""
+    key_pool: KeyPool = field(init=False)
+    """API Key 健康度池（运行时状态）"""
+    circuit_breaker: CircuitBreaker = field(init=False)
+    """提供商熔断器（运行时状态）"""
+    latency: LatencyTracker = field(init=False)
+    """成功请求耗时统计（运行时状态）"""
+    pool: ProviderPool = field(init=False)
+    """提供商并发名额池（运行时状态）"""
+
+    def __post_init__(self):
+        self.key_pool = KeyPool(self.keys)
+        self.circuit_breaker = CircuitBreaker()
+        self.latency = LatencyTracker()
+        self.pool = ProviderPool(self.max_concurrent)
 
 
 @dataclass(repr=False, slots=True)
@@ -85,8 +107,26 @@ class CommonConfig:
     """最大重试次数"""
     timeout: float = 300
     """请求超时时间, 单位: 秒"""
+    job_timeout: float = 600
+    """单次画图任务的总时间预算（含重试、切换 Key 和提供商）, 单位: 秒, 0 表示不限制"""
     proxy: str | None = None
     """代理"""
+    download_concurrency: int = 16
+    """全局图片下载并发上限（所有任务共享）"""
+    download_per_host: int = 4
+    """单个域名的图片下载并发上限"""
+    refer_cache_size_mb: float = 64
+    """预设参考图片缓存容量, 单位: MB"""
+    refer_cache_prewarm: bool = True
+    """是否在插件初始化时预热预设参考图片缓存"""
+    hedge_enabled: bool = False
+    """是否启用对冲请求"""
+    hedge_percentile: float = 90
+    """对冲阈值取提供商历史耗时的百分位"""
+    hedge_min_delay: float = 60
+    """对冲前的最短等待时间, 单位: 秒（历史样本不足时也使用该值）"""
+    coalesce_enabled: bool = False
+    """是否合并完全相同的进行中请求"""
 
 
 @dataclass(repr=False, slots=True)
@@ -99,3 +139,34 @@ class PreferenceConfig:
     """ 跳过第一次引用@ """
     skip_llm_at_first: bool = False
     """ 跳过第一次LLM@ """
+
+
+@dataclass(repr=False, slots=True)
+class ImageData:
+    """图片数据，内部持有原始字节，Base64 仅在序列化时按需编码并缓存"""
+
+    mime: str
+    """图片 MIME 类型"""
+    data: bytes
+    """图片原始字节"""
+    _b64: str | None = field(default=None, init=False)
+    """Base64 编码缓存"""
+
+    @classmethod
+    def from_b64(cls, mime: str, b64: str) -> "ImageData":
+        """从 Base64 字符串构建，原字符串直接作为编码缓存，避免二次编码"""
+        image = cls(mime, base64.b64decode(b64))
+        image._b64 = b64
+        return image
+
+    @property
+    def b64(self) -> str:
+        """Base64 编码字符串（首次访问时编码，之后复用缓存）"""
+        if self._b64 is None:
+            self._b64 = base64.b64encode(self.data).decode("ascii")
+        return self._b64
+
+    @property
+    def size(self) -> int:
+        """原始字节大小，无需编码"""
+        return len(self.data)
@@ -0,0 +1,46 @@
+import time
+
+
+class Deadline:
+    """单个画图任务的端到端时间预算
+
+    从任务开始执行时计时，贯穿重试、切换 Key 和降级提供商的全过程。
+    每次请求的超时时间都会被裁剪到剩余预算以内，预算耗尽后直接失败，尽快释放队列名额。
+    """
+
+    def __init__(self, budget: float | None):
+        """budget 为 None 或不大于 0 时表示不限制"""
+        self.budget = budget if budget and budget > 0 else None
+        self.started_at = time.monotonic()
+        self.expires_at = (
+            self.started_at + self.budget if self.budget is not None else None
+        )
+
+    def remaining(self) -> float | None:
+        """剩余时间, 单位: 秒；不限制时返回 None"""
+        if self.expires_at is None:
+            return None
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    @property
+    def expired(self) -> bool:
+        remaining = self.remaining()
+        return remaining is not None and remaining <= 0
+
+    # 裁剪后超时时间的下限, 单位: 秒
+    MIN_TIMEOUT = 1.0
+
+    def clip(self, timeout: float) -> float:
+        """把单次请求的超时时间裁剪到剩余预算以内
+
+        结果不小于 MIN_TIMEOUT：curl 以整数毫秒设置超时，不足 1 毫秒会变成 0，而 0 表示不限制。
+        预算是否耗尽由调用方在发起请求前检查。
+        """
+        remaining = self.remaining()
+        if remaining is None:
+            return timeout
+        return max(min(timeout, remaining), self.MIN_TIMEOUT)
@@ -1,9 +1,13 @@
 import asyncio
-import base64
 import ipaddress
+import random
 import socket
+import time
+from collections import deque
+from dataclasses import dataclass
 from functools import lru_cache
 from io import BytesIO
+from typing import ClassVar
 from urllib.parse import urlparse
 
 from curl_cffi import AsyncSession
@@ -16,7 +20,16 @@ from PIL import Image
 
 from astrbot.api import logger
 
-from .data import SUPPORTED_FILE_FORMATS, CommonConfig
+from .data import SUPPORTED_FILE_FORMATS, CommonConfig, ImageData
+from .utils import parse_retry_after
+
+# 下载失败类型
+FAILURE_PERMANENT = "permanent"
+"""永久性失败，不再重试"""
+FAILURE_TRANSIENT = "transient"
+"""暂时性失败（超时、连接重置、5xx 等），退避后重试"""
+FAILURE_RATE_LIMITED = "rate_limited"
+"""被限流，按 Retry-After 等待后重试；等待时长超出剩余预算时直接放弃"""
 
 
 @lru_cache(maxsize=1024)
@@ -67,10 +80,144 @@ def is_safe_url(url: str) -> bool:
         return False
 
 
+class DownloadScheduler:
+    """进程级图片下载调度器
+
+    所有任务共享同一个全局并发上限和按域名的并发上限，等待者按到达顺序（FIFO）获得名额，
+    某个域名已满时不会阻塞排在后面的其他域名请求。
+    """
+
+    def __init__(self, max_concurrent: int = 16, max_per_host: int = 4):
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_per_host = max(1, max_per_host)
+        self._active = 0
+        self._active_per_host: dict[str, int] = {}
+        self._waiters: deque[tuple[str, asyncio.Future]] = deque()
+        # 累计统计
+        self.total_fetches = 0
+        self.total_wait = 0.0
+
+    @property
+    def waiting(self) -> int:
+        """当前排队等待的下载数"""
+        return len(self._waiters)
+
+    @property
+    def active(self) -> int:
+        """当前正在进行的下载数"""
+        return self._active
+
+    def _has_capacity(self, host: str) -> bool:
+        return (
+            self._active < self.max_concurrent
+            and self._active_per_host.get(host, 0) < self.max_per_host
+        )
+
+    def _take(self, host: str) -> None:
+        self._active += 1
+        self._active_per_host[host] = self._active_per_host.get(host, 0) + 1
+
+    def _wake_waiters(self) -> None:
+        """按 FIFO 顺序唤醒有空余名额的等待者"""
+        for entry in list(self._waiters):
+            if self._active >= self.max_concurrent:
+                break
+            host, fut = entry
+            if fut.done():
+                self._waiters.remove(entry)
+                continue
+            if self._active_per_host.get(host, 0) < self.max_per_host:
+                self._waiters.remove(entry)
+                self._take(host)
+                fut.set_result(None)
+
+    async def acquire(self, host: str) -> float:
+        """获取下载名额，返回排队等待时间（秒）"""
+        start = time.monotonic()
+        if not self._waiters and self._has_capacity(host):
+            self._take(host)
+            wait = 0.0
+        else:
+            fut = asyncio.get_running_loop().create_future()
+            entry = (host, fut)
+            self._waiters.append(entry)
+            self._wake_waiters()
+            try:
+                await fut
+            except asyncio.CancelledError:
+                if fut.done() and not fut.cancelled():
+                    # 已分配名额但任务被取消，归还名额
+                    self.release(host)
+                elif entry in self._waiters:
+                    self._waiters.remove(entry)
+                raise
+            wait = time.monotonic() - start
+        self.total_fetches += 1
+        self.total_wait += wait
+        return wait
+
+    def release(self, host: str) -> None:
+        """归还下载名额并唤醒后续等待者"""
+        self._active -= 1
+        remaining = self._active_per_host.get(host, 0) - 1
+        if remaining > 0:
+            self._active_per_host[host] = remaining
+        else:
+            self._active_per_host.pop(host, None)
+        self._wake_waiters()
+
+
+@dataclass(slots=True)
+class DownloadRetryPolicy:
+    """图片下载重试策略：失败分类 + 带抖动的指数退避 + 任务总时间预算"""
+
+    max_attempts: int = 3
+    """单张图片最大尝试次数"""
+    base_delay: float = 0.5
+    """首次退避基准时长, 单位: 秒"""
+    max_delay: float = 8.0
+    """单次退避上限, 单位: 秒"""
+    request_timeout: float = 30
+    """单次请求超时, 单位: 秒"""
+    job_budget: float = 60
+    """单个任务下载图片的总时间预算, 单位: 秒"""
+
+    # 永久性失败状态码，重试没有意义
+    PERMANENT_STATUS_CODES: ClassVar[frozenset[int]] = frozenset(
+        {400, 401, 403, 404, 405, 410, 414, 415, 451}
+    )
+    # 限流状态码
+    RATE_LIMIT_STATUS_CODES: ClassVar[frozenset[int]] = frozenset({429})
+
+    def classify(self, status: int) -> str:
+        """按响应状态码划分失败类型"""
+        if status in self.RATE_LIMIT_STATUS_CODES:
+            return FAILURE_RATE_LIMITED
+        if status in self.PERMANENT_STATUS_CODES:
+            return FAILURE_PERMANENT
+        return FAILURE_TRANSIENT
+
+    def backoff(self, attempt: int, retry_after: float | None = None) -> float:
+        """计算第 attempt 次失败后的等待时长（full jitter）
+        服务端给出 Retry-After 时按原值等待，不受 max_delay 限制，是否放弃由剩余预算决定
+        """
+        if retry_after is not None:
+            return max(retry_after, 0.0)
+        cap = min(self.max_delay, self.base_delay * (2**attempt))
+        return random.uniform(0, cap)
+
+
 class Downloader:
     def __init__(self, session: AsyncSession, common_config: CommonConfig):
         self.session = session
         self.def_common_config = common_config
+        # 全局下载调度器，所有任务共享
+        self.scheduler = DownloadScheduler(
+            max_concurrent=common_config.download_concurrency,
+            max_per_host=common_config.download_per_host,
+        )
+        # 下载重试策略
+        self.retry_policy = DownloadRetryPolicy()
 
     def _get_proxy(self) -> str | None:
         """获取格式化的代理 URL（自动补全 http:// 前缀）"""
@@ -82,57 +229,107 @@ class Downloader:
             return f"http://{proxy}"
         return proxy
 
-    async def _fetch_image_with_retry(self, url: str) -> tuple[str, str] | None:
-        """下载单张图片（带重试）"""
-        for _ in range(3):
-            content = await self._download_image(url)
-            if content is not None:
-                return content
-        return None
+    async def _fetch_image_with_retry(
+        self, url: str, deadline: float | None = None
+    ) -> ImageData | None:
+        """下载单张图片（按重试策略退避重试），每次尝试都经过全局下载调度器
+
+        Args:
+            url: 图片地址
+            deadline: 本次任务下载截止时间（time.monotonic 时间戳）
+        """
+        policy = self.retry_policy
+        if deadline is None:
+            deadline = time.monotonic() + policy.job_budget
+        host = urlparse(url).hostname or ""
+        queue_wait = 0.0
+        try:
+            for attempt in range(policy.max_attempts):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    logger.warning(f"[BIG BANANA] 图片下载超出时间预算: {url[:100]}")
+                    return None
+                queue_wait += await self.scheduler.acquire(host)
+                try:
+                    content, kind, retry_after = await self._download_image(
+                        url, timeout=min(policy.request_timeout, remaining)
+                    )
+                finally:
+                    self.scheduler.release(host)
+                if content is not None:
+                    return content
+                # 永久性失败（404、格式不支持等）不再浪费重试
+                if kind == FAILURE_PERMANENT or attempt >= policy.max_attempts - 1:
+                    return None
+                delay = policy.backoff(attempt, retry_after)
+                if time.monotonic() + delay >= deadline:
+                    if kind == FAILURE_RATE_LIMITED:
+                        logger.warning(
+                            f"[BIG BANANA] 图片下载被限流，Retry-After {delay:.1f}s 超出剩余时间预算，放弃: {url[:100]}"
+                        )
+                    else:
+                        logger.warning(
+                            f"[BIG BANANA] 图片下载剩余时间不足以继续重试: {url[:100]}"
+                        )
+                    return None
+                logger.debug(
+                    f"[BIG BANANA] 图片下载失败({kind})，{delay:.2f}s 后重试 ({attempt + 1}/{policy.max_attempts}): {url[:100]}"
+                )
+                await asyncio.sleep(delay)
+            return None
+        finally:
+            logger.debug(
+                f"[BIG BANANA] 图片下载排队耗时 {queue_wait:.3f}s: {url[:100]}"
+            )
 
-    async def fetch_image(self, url: str) -> tuple[str, str] | None:
-        """下载单张图片并转换为 (mime, base64)"""
+    async def fetch_image(self, url: str) -> ImageData | None:
+        """下载单张图片"""
         result = await self._fetch_image_with_retry(url)
         if result is None:
             logger.warning(f"[BIG BANANA] fetch_image 失败: {url}")
             return None
 
-        mime, b64 = result
         logger.debug(
-            f"[BIG BANANA] fetch_image 成功: mime={mime}, b64_type={type(b64).__name__}, b64_len={len(b64)}"
+            f"[BIG BANANA] fetch_image 成功: mime={result.mime}, bytes={result.size}"
         )
         return result
 
-    async def fetch_images(self, image_urls: list[str]) -> list[tuple[str, str]]:
-        """下载多张图片并转换为 (mime, base64) 列表（并发下载，保持输入顺序）"""
+    async def fetch_images(
+        self, image_urls: list[str], budget: float | None = None
+    ) -> list[ImageData]:
+        """下载多张图片（并发下载，保持输入顺序）
+
+        Args:
+            image_urls: 图片地址列表
+            budget: 本次下载的总时间预算（秒），默认使用重试策略的任务预算
+        """
         if not image_urls:
             return []
 
-        max_parallel = min(8, len(image_urls))
-        semaphore = asyncio.Semaphore(max_parallel)
-
-        async def _worker(url: str) -> tuple[str, str] | None:
-            async with semaphore:
-                return await self._fetch_image_with_retry(url)
-
+        deadline = time.monotonic() + (
+            budget if budget is not None else self.retry_policy.job_budget
+        )
+        # 并发上限由全局下载调度器统一控制
         results = await asyncio.gather(
-            *(_worker(url) for url in image_urls),
+            *(self._fetch_image_with_retry(url, deadline) for url in image_urls),
             return_exceptions=True,
         )
 
-        image_b64_list: list[tuple[str, str]] = []
+        image_list: list[ImageData] = []
         for result in results:
             if isinstance(result, Exception):
                 logger.warning(f"[BIG BANANA] 并发下载图片失败: {result}")
                 continue
             if result is not None:
-                image_b64_list.append(result)
+                image_list.append(result)
 
-        return image_b64_list
+        return image_list
 
     @staticmethod
-    def _handle_image(image_bytes: bytes) -> tuple[str, str] | None:
-        """处理图片：验证格式、GIF转PNG、Base64编码（CPU密集，在线程池中执行）"""
+    def _handle_image(image_bytes: bytes) -> ImageData | None:
+        """处理图片：验证格式、GIF转PNG（CPU密集，在线程池中执行）
+        不在此处做 Base64 编码，编码推迟到请求序列化时按需进行
+        """
         if len(image_bytes) > 36 * 1024 * 1024:
             logger.warning("[BIG BANANA] 图片超过 36MB，跳过处理")
             return None
@@ -145,30 +342,34 @@ class Downloader:
                 # 如果不是 GIF，直接返回原图
                 if fmt != "gif":
                     mime = "image/jpeg" if fmt == "jpg" else f"image/{fmt}"
-                    b64 = base64.b64encode(image_bytes).decode("utf-8")
                     logger.debug(
-                        f"[BIG BANANA] 图片处理完成: fmt={fmt}, mime={mime}, bytes={len(image_bytes)}, b64_len={len(b64)}"
+                        f"[BIG BANANA] 图片处理完成: fmt={fmt}, mime={mime}, bytes={len(image_bytes)}"
                     )
-                    return (mime, b64)
+                    return ImageData(mime, image_bytes)
                 # 处理 GIF：取第一帧转PNG
                 buf = BytesIO()
                 img.seek(0)
                 img = img.convert("RGBA")
                 img.save(buf, format="PNG")
-                b64 = base64.b64encode(buf.getvalue()).decode("utf-8")
+                png_bytes = buf.getvalue()
                 logger.debug(
-                    f"[BIG BANANA] GIF转PNG完成: source_bytes={len(image_bytes)}, png_bytes={len(buf.getvalue())}, b64_len={len(b64)}"
+                    f"[BIG BANANA] GIF转PNG完成: source_bytes={len(image_bytes)}, png_bytes={len(png_bytes)}"
                 )
-                return ("image/png", b64)
+                return ImageData("image/png", png_bytes)
         except Exception as e:
             logger.warning(f"[BIG BANANA] 图片处理失败: {e}")
             return None
 
-    async def _download_image(self, url: str) -> tuple[str, str] | None:
+    async def _download_image(
+        self, url: str, timeout: float = 30
+    ) -> tuple[ImageData | None, str | None, float | None]:
+        """发起单次下载
+        返回值: 元组(图片, 失败类型, Retry-After 秒数)
+        """
         # SSRF 防护：验证 URL 安全性
         if not is_safe_url(url):
             logger.warning(f"[BIG BANANA] 拒绝不安全的 URL: {url}")
-            return None
+            return None, FAILURE_PERMANENT, None
 
         # 构造请求头：Referer防盗链 + 压缩 + 连接复用
         parsed = urlparse(url)
@@ -181,42 +382,48 @@ class Downloader:
         }
 
         try:
-            response = await self.session.get(
-                url,
-                proxy=self._get_proxy(),
-                timeout=30,
-                headers=headers,
-            )
+            try:
+                response = await self.session.get(
+                    url,
+                    proxy=self._get_proxy(),
+                    timeout=timeout,
+                    headers=headers,
+                )
+            except (SSLError, CertificateVerifyError):
+                # 仅对本次请求关闭SSL验证重试，不记住该域名
+                logger.warning(
+                    f"[BIG BANANA] {parsed.hostname} 证书校验失败，关闭SSL验证重试"
+                )
+                response = await self.session.get(
+                    url,
+                    proxy=self._get_proxy(),
+                    timeout=timeout,
+                    verify=False,
+                    headers=headers,
+                )
             if response.status_code != 200 or not response.content:
                 logger.warning(
                     f"[BIG BANANA] 图片下载失败，状态码: {response.status_code}"
                 )
-                return None
+                kind = self.retry_policy.classify(response.status_code)
+                retry_after = None
+                if kind == FAILURE_RATE_LIMITED:
+                    retry_after = parse_retry_after(
+                        response.headers.get("Retry-After")
+                    )
+                return None, kind, retry_after
             logger.debug(
                 f"[BIG BANANA] 图片下载成功: status={response.status_code}, content_type={response.headers.get('Content-Type', '')}, bytes={len(response.content)}"
             )
             # 在线程池中处理图片，避免阻塞事件循环
             content = await asyncio.to_thread(Downloader._handle_image, response.content)
-            return content
-        except (SSLError, CertificateVerifyError):
-            # 关闭SSL验证重试
-            response = await self.session.get(
-                url,
-                proxy=self._get_proxy(),
-                timeout=30,
-                verify=False,
-                headers=headers,
-            )
-            if response.status_code != 200 or not response.content:
-                logger.warning(
-                    f"[BIG BANANA] 图片下载失败，状态码: {response.status_code}"
-                )
-                return None
-            content = await asyncio.to_thread(Downloader._handle_image, response.content)
-            return content
+            if content is None:
+                # 图片本身无法处理，重试也不会成功
+                return None, FAILURE_PERMANENT, None
+            return content, None, None
         except Timeout as e:
             logger.error(f"[BIG BANANA] 网络请求超时: {url}，错误信息：{e}")
-            return None
+            return None, FAILURE_TRANSIENT, None
         except Exception as e:
             logger.error(f"[BIG BANANA] 下载图片失败: {url}，错误信息：{e}")
-            return None
+            return None, FAILURE_TRANSIENT, None
@@ -0,0 +1,46 @@
+class DurationModel:
+    """按提供商和分辨率统计的滚动耗时模型
+
+    每个 (提供商, 分辨率) 维护一个 EWMA，用于估算排队任务的开始和完成时间。
+    没有对应样本时依次回退到该提供商的所有分辨率、全局耗时，最后使用默认值。
+    """
+
+    def __init__(self, alpha: float = 0.2, default: float = 60.0):
+        self.alpha = alpha
+        self.default = default
+        self._ewma: dict[tuple[str, str], float] = {}
+        self._provider: dict[str, float] = {}
+        self._global: float | None = None
+        # 统计：估算值与实际耗时的平均绝对误差
+        self.samples = 0
+        self.abs_error = 0.0
+
+    def _update(self, current: float | None, value: float) -> float:
+        return value if current is None else current + self.alpha * (value - current)
+
+    def record(self, provider: str, resolution: str, seconds: float) -> None:
+        """记录一次成功生成的耗时"""
+        key = (provider, str(resolution).upper())
+        # 首个样本之前只有默认值，不计入误差
+        if self._global is not None:
+            self.samples += 1
+            self.abs_error += abs(self.estimate([provider], resolution) - seconds)
+        self._ewma[key] = self._update(self._ewma.get(key), seconds)
+        self._provider[provider] = self._update(self._provider.get(provider), seconds)
+        self._global = self._update(self._global, seconds)
+
+    def estimate(self, providers: list[str], resolution: str) -> float:
+        """估算一次生成的耗时，取第一个有样本的提供商"""
+        resolution = str(resolution).upper()
+        for provider in providers:
+            if (provider, resolution) in self._ewma:
+                return self._ewma[(provider, resolution)]
+        for provider in providers:
+            if provider in self._provider:
+                return self._provider[provider]
+        return self._global if self._global is not None else self.default
+
+    @property
+    def mean_abs_error(self) -> float | None:
+        """历史估算的平均绝对误差, 单位: 秒"""
+        return self.abs_error / self.samples if self.samples else None
@@ -1,3 +1,4 @@
+import asyncio
 import json
 
 from curl_cffi.requests.exceptions import Timeout
@@ -5,7 +6,10 @@ from curl_cffi.requests.exceptions import Timeout
 from astrbot.api import logger
 
 from .base import BaseProvider
-from .data import ProviderConfig
+from .data import ImageData, ProviderConfig
+from .deadline import Deadline
+from .request_body import JsonBodyBuilder
+from .sse import SSEParser
 
 
 class GeminiProvider(BaseProvider):
@@ -17,35 +21,29 @@ class GeminiProvider(BaseProvider):
         self,
         provider_config: ProviderConfig,
         api_key: str,
-        image_b64_list: list[tuple[str, str]],
-        params: dict,
-    ) -> tuple[list[tuple[str, str]] | None, int | None, str | None]:
+        body: bytes,
+        deadline: Deadline,
+    ) -> tuple[list[ImageData] | None, int | None, str | None]:
         """发起 Gemini 图片生成请求
-        返回值: 元组(图片 base64 列表, 状态码, 人类可读的错误信息)
+        返回值: 元组(图片列表, 状态码, 人类可读的错误信息)
         """
         headers = {
             "Content-Type": "application/json",
             "x-goog-api-key": api_key,
         }
         url = f"{provider_config.api_url}/{provider_config.model}:generateContent"
-        # 构建请求上下文
-        gemini_context = self._build_gemini_context(
-            provider_config.model,
-            image_b64_list,
-            params,
-        )
         try:
             response = await self.session.post(
                 url,
                 headers=headers,
-                json=gemini_context,
+                data=body,
                 proxy=self.def_common_config.proxy,
-                timeout=self.def_common_config.timeout,
+                timeout=deadline.clip(self.def_common_config.timeout),
             )
-            # 响应反序列化
-            result = response.json()
+            # 直接从原始字节反序列化，不生成完整的响应文本
+            result = json.loads(response.content)
             if response.status_code == 200:
-                b64_images = []
+                images = []
                 for item in result.get("candidates", []):
                     # 检查 finishReason 状态
                     finishReason = item.get("finishReason", "")
@@ -53,18 +51,18 @@ class GeminiProvider(BaseProvider):
                     # 如果有明确的失败原因（非 STOP 且非空）
                     if finishReason and finishReason != "STOP":
                         logger.warning(
-                            f"[BIG BANANA] 图片生成失败, 响应内容: {response.text[:1024]}"
+                            f"[BIG BANANA] 图片生成失败, 响应内容: {self._preview(response.content)}"
                         )
                         return None, 200, f"图片生成失败，原因: {finishReason}"
                     # 提取图片数据
                     for part in parts:
                         if "inlineData" in part and "data" in part["inlineData"]:
                             data = part["inlineData"]
-                            b64_images.append((data["mimeType"], data["data"]))
+                            images.append(ImageData.from_b64(data["mimeType"], data["data"]))
                 # 最后再检查是否有图片数据
-                if not b64_images:
+                if not images:
                     logger.warning(
-                        f"[BIG BANANA] 请求成功，但未返回图片数据, 响应内容: {response.text[:1024]}"
+                        f"[BIG BANANA] 请求成功，但未返回图片数据, 响应内容: {self._preview(response.content)}"
                     )
                     # 检查 promptFeedback 拦截信息
                     if result.get("promptFeedback", {}):
@@ -83,10 +81,11 @@ class GeminiProvider(BaseProvider):
                             return None, 200, f"生成失败: {finish_msg[:100]}"
                     return None, 200, "图片触碰内容审查，无法生成"
                 # 只返回第一张图片，避免重复
-                return b64_images[:1], 200, None
+                return images[:1], 200, None
             else:
+                self._note_retry_after(provider_config, api_key, response)
                 logger.error(
-                    f"[BIG BANANA] 图片生成失败，状态码: {response.status_code}, 响应内容: {response.text[:1024]}"
+                    f"[BIG BANANA] 图片生成失败，状态码: {response.status_code}, 响应内容: {self._preview(response.content)}"
                 )
                 err_msg = result.get("error", {}).get("message", "未知原因")
                 return None, response.status_code, f"图片生成失败：{err_msg}"
@@ -95,7 +94,7 @@ class GeminiProvider(BaseProvider):
             return None, 408, "图片生成失败：响应超时"
         except json.JSONDecodeError as e:
             logger.error(
-                f"[BIG BANANA] JSON反序列化错误: {e}，状态码：{response.status_code}，响应内容：{response.text[:1024]}"
+                f"[BIG BANANA] JSON反序列化错误: {e}，状态码：{response.status_code}，响应内容：{self._preview(response.content)}"
             )
             return None, response.status_code, "图片生成失败：响应内容错误"
         except Exception as e:
@@ -106,93 +105,124 @@ class GeminiProvider(BaseProvider):
         self,
         provider_config: ProviderConfig,
         api_key: str,
-        image_b64_list: list[tuple[str, str]],
-        params: dict,
-    ) -> tuple[list[tuple[str, str]] | None, int | None, str | None]:
+        body: bytes,
+        deadline: Deadline,
+    ) -> tuple[list[ImageData] | None, int | None, str | None]:
         """发起 Gemini 图片生成流式请求
-        返回值: 元组(图片 base64 列表, 状态码, 人类可读的错误信息)
+        返回值: 元组(图片列表, 状态码, 人类可读的错误信息)
         """
         headers = {
             "Content-Type": "application/json",
             "x-goog-api-key": api_key,
         }
         url = f"{provider_config.api_url}/{provider_config.model}:streamGenerateContent?alt=sse"
-        # 构建请求上下文
-        gemini_context = self._build_gemini_context(
-            model=provider_config.model, image_b64_list=image_b64_list, params=params
-        )
+        response = None
         try:
             response = await self.session.post(
                 url,
                 headers=headers,
-                json=gemini_context,
+                data=body,
                 proxy=self.def_common_config.proxy,
-                timeout=self.def_common_config.timeout,
+                timeout=deadline.clip(self.def_common_config.timeout),
                 stream=True,
             )
-            # 处理流式响应
-            streams = response.aiter_content(chunk_size=1024)
-            # 读取完整内容（使用 bytearray 避免 O(n²) 拼接）
-            data = bytearray()
-            async for chunk in streams:
-                data.extend(chunk)
-            result = data.decode("utf-8")
-            if response.status_code == 200:
-                b64_images = []
-                for line in result.splitlines():
-                    if line.startswith("data: "):
-                        line_data = line[len("data: ") :].strip()
-                        if line_data == "[DONE]":
-                            break
-                        try:
-                            json_data = json.loads(line_data)
-                            # 遍历 candidates，检查是否有图片数据
-                            for item in json_data.get("candidates", []):
-                                parts = item.get("content", {}).get("parts", [])
-                                for part in parts:
-                                    if (
-                                        "inlineData" in part
-                                        and "data" in part["inlineData"]
-                                    ):
-                                        data = part["inlineData"]
-                                        b64_images.append(
-                                            (data["mimeType"], data["data"])
-                                        )
-                        except json.JSONDecodeError:
-                            continue
-                if not b64_images:
-                    logger.warning(
-                        f"[BIG BANANA] 请求成功，但未返回图片数据, 响应内容: {result[:1024]}"
-                    )
-                    return None, 200, "图片触碰内容审查，无法生成"
-                # 只返回第一张图片，避免重复
-                return b64_images[:1], 200, None
-            else:
+            if response.status_code != 200:
+                preview = await self._read_stream_preview(response)
+                self._note_retry_after(provider_config, api_key, response)
                 logger.error(
-                    f"[BIG BANANA] 图片生成失败，状态码: {response.status_code}, 响应内容: {result[:1024]}"
+                    f"[BIG BANANA] 图片生成失败，状态码: {response.status_code}, 响应内容: {preview}"
                 )
                 return None, response.status_code, f"图片生成失败：状态码 {response.status_code}"
-        except Timeout as e:
+            # 增量解析流式响应，边接收边处理事件
+            parser = SSEParser()
+            preview = bytearray()
+            done = False
+            # 流式请求的 timeout 只约束连接和低速阈值，持续返回保活数据的流不会超时，
+            # 这里按任务剩余预算限制整个读取过程
+            async with asyncio.timeout(deadline.remaining()):
+                async for chunk in response.aiter_content(chunk_size=64 * 1024):
+                    if len(preview) < 1024:
+                        preview.extend(chunk[: 1024 - len(preview)])
+                    for payload in parser.feed(chunk):
+                        images = self._parse_stream_payload(payload)
+                        if images is None:
+                            done = True
+                            break
+                        if images:
+                            # 只保留第一张图片，解析到即结束请求，不再等待剩余数据
+                            logger.debug(
+                                f"[BIG BANANA] 流式响应已解析到图片，提前结束 (已接收 {parser.received_bytes} 字节)"
+                            )
+                            return images[:1], 200, None
+                    if done:
+                        break
+            if not done:
+                for payload in parser.flush():
+                    images = self._parse_stream_payload(payload)
+                    if images:
+                        return images[:1], 200, None
+            logger.warning(
+                f"[BIG BANANA] 请求成功，但未返回图片数据, 响应内容: {self._preview(preview)}"
+            )
+            return None, 200, "图片触碰内容审查，无法生成"
+        except (Timeout, TimeoutError) as e:
             logger.error(f"[BIG BANANA] 网络请求超时: {e}")
             return None, 408, "图片生成失败：响应超时"
         except Exception as e:
             logger.error(f"[BIG BANANA] 请求错误: {e}")
             return None, None, "图片生成失败：程序错误"
+        finally:
+            # 提前结束或出错时关闭连接
+            if response is not None:
+                await response.aclose()
+
+    @staticmethod
+    def _parse_stream_payload(payload: bytes) -> list[ImageData] | None:
+        """解析单个流式事件负载，返回其中的图片；收到 [DONE] 时返回 None"""
+        if payload == b"[DONE]":
+            return None
+        try:
+            json_data = json.loads(payload)
+        except json.JSONDecodeError:
+            return []
+        images = []
+        # 遍历 candidates，检查是否有图片数据
+        for item in json_data.get("candidates", []):
+            parts = item.get("content", {}).get("parts", [])
+            for part in parts:
+                if "inlineData" in part and "data" in part["inlineData"]:
+                    data = part["inlineData"]
+                    images.append(ImageData.from_b64(data["mimeType"], data["data"]))
+        return images
+
+    def _build_request_body(
+        self,
+        provider_config: ProviderConfig,
+        image_list: list[ImageData],
+        params: dict,
+    ) -> bytes:
+        """构建 Gemini 请求体，图片 Base64 直接拼接进序列化结果"""
+        builder = JsonBodyBuilder()
+        context = self._build_gemini_context(
+            provider_config.model, image_list, params, builder
+        )
+        return builder.build(context)
 
     def _build_gemini_context(
         self,
         model: str,
-        image_b64_list: list[tuple[str, str]],
+        image_list: list[ImageData],
         params: dict,
+        builder: JsonBodyBuilder,
     ) -> dict:
-        # 处理图片内容部分
+        # 处理图片内容部分，Base64 以占位符代替
         parts = []
-        for mime, b64 in image_b64_list:
+        for image in image_list:
             parts.append(
                 {
                     "inlineData": {
-                        "mimeType": mime,
-                        "data": b64,
+                        "mimeType": image.mime,
+                        "data": builder.image(image),
                     }
                 }
             )
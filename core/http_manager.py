@@ -3,9 +3,11 @@ from curl_cffi.requests import AsyncSession
 
 
 class HttpManager:
-    def __init__(self):
+    def __init__(self, max_clients: int = 10):
         self._aiohttp_session: ClientSession | None = None
         self._curl_session: AsyncSession | None = None
+        # curl 连接池大小，下载与模型请求共享同一个会话以复用 keep-alive 连接
+        self.max_clients = max_clients
 
     def _get_aiohttp_session(self) -> ClientSession:
         """获取 ClientSession 对象
@@ -23,6 +25,7 @@ class HttpManager:
         """
         if self._curl_session is None or getattr(self._curl_session, "_closed", False):
             self._curl_session = AsyncSession(
+                max_clients=self.max_clients,
                 timeout=30,
                 headers={
                     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
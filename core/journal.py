@@ -0,0 +1,96 @@
+import asyncio
+import json
+import os
+import time
+import uuid
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+
+from astrbot.api import logger
+
+# 任务类型
+KIND_DRAW = "draw"
+"""触发词画图，可在重启后恢复"""
+KIND_LINEART = "lineart"
+"""线稿转绘，重启后直接退款"""
+
+
+@dataclass(slots=True)
+class JournalEntry:
+    """已受理任务的持久化记录"""
+
+    origin: str
+    """消息来源（unified_msg_origin），用于重启后发送结果"""
+    sender_id: str
+    """提交者"""
+    group_id: str | None
+    """所在群聊"""
+    message_id: str
+    """原消息 ID，用于引用回复"""
+    params: dict
+    """生成参数（含最终提示词）"""
+    image_urls: list[str] = field(default_factory=list)
+    """参考图片 URL"""
+    user_id: str | None = None
+    """预扣费用的用户，管理员为 None"""
+    draws: int = 1
+    """预扣的张数，退款时使用"""
+    kind: str = KIND_DRAW
+    """任务类型"""
+    accepted_at: float = field(default_factory=time.time)
+    """受理时间 (time.time)"""
+    entry_id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    """记录 ID"""
+
+
+class JobJournal:
+    """已受理任务日志
+
+    任务受理（预扣费用）后写入，结束（成功、失败、取消或退款）后删除。
+    插件重启时仍在日志中的任务即为被中断的任务，由插件恢复执行或退款。
+    写入先写临时文件再原子替换，避免中途退出导致文件损坏。
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._entries: dict[str, JournalEntry] = {}
+        self._lock = asyncio.Lock()
+
+    def load(self) -> list[JournalEntry]:
+        """读取上次运行遗留的任务"""
+        try:
+            if self.path.exists():
+                raw = json.loads(self.path.read_text(encoding="utf-8"))
+                for item in raw.get("jobs", []):
+                    entry = JournalEntry(**item)
+                    self._entries[entry.entry_id] = entry
+        except Exception as e:
+            logger.warning(f"[BananaSign] 读取任务日志失败: {e}")
+        return list(self._entries.values())
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def add(self, entry: JournalEntry) -> JournalEntry:
+        self._entries[entry.entry_id] = entry
+        await self._flush()
+        return entry
+
+    async def remove(self, entry: JournalEntry) -> None:
+        if self._entries.pop(entry.entry_id, None) is not None:
+            await self._flush()
+
+    async def _flush(self) -> None:
+        async with self._lock:
+            # 在锁内生成快照，保证按顺序落盘
+            snapshot = {"jobs": [asdict(entry) for entry in self._entries.values()]}
+            await asyncio.to_thread(self._write, snapshot)
+
+    def _write(self, snapshot: dict) -> None:
+        try:
+            tmp_path = self.path.with_suffix(".tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(snapshot, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.error(f"[BananaSign] 保存任务日志失败: {e}")
@@ -0,0 +1,171 @@
+import random
+import time
+from dataclasses import dataclass
+from typing import ClassVar
+
+
+@dataclass(slots=True)
+class KeyState:
+    """单个 API Key 的健康状态"""
+
+    key: str
+    """API Key"""
+    successes: int = 0
+    """累计成功次数"""
+    failures: int = 0
+    """累计失败次数"""
+    success_rate: float = 1.0
+    """成功率 EWMA"""
+    latency: float | None = None
+    """成功请求耗时 EWMA, 单位: 秒"""
+    cooldown_until: float = 0.0
+    """限流冷却截止时间 (time.monotonic)"""
+    quarantine_until: float = 0.0
+    """硬失败隔离截止时间 (time.monotonic)"""
+    rate_limits: int = 0
+    """连续限流次数"""
+    hard_failures: int = 0
+    """连续硬失败次数"""
+
+
+class KeyPool:
+    """单个提供商的 API Key 池
+
+    记录每个 Key 的成功率、耗时、限流冷却和硬失败隔离状态，按健康度加权随机排序 Key。
+    被隔离的 Key 到期后会被安排一次探测请求，成功即恢复，失败则延长隔离时间。
+    """
+
+    # 限流状态码，按 Retry-After 或指数时长冷却
+    RATE_LIMIT_STATUS_CODES: ClassVar[frozenset[int]] = frozenset({429})
+    # 硬失败状态码（Key 无效、欠费、无权限），隔离后定期探测
+    HARD_FAILURE_STATUS_CODES: ClassVar[frozenset[int]] = frozenset({401, 402, 403})
+
+    def __init__(
+        self,
+        keys: list[str],
+        alpha: float = 0.2,
+        base_cooldown: float = 30,
+        max_cooldown: float = 600,
+        base_quarantine: float = 60,
+        max_quarantine: float = 3600,
+        probe_window: float = 120,
+    ):
+        self.states: dict[str, KeyState] = {key: KeyState(key) for key in dict.fromkeys(keys)}
+        self.alpha = alpha
+        self.base_cooldown = base_cooldown
+        self.max_cooldown = max_cooldown
+        self.base_quarantine = base_quarantine
+        self.max_quarantine = max_quarantine
+        self.probe_window = probe_window
+
+    def _weight(self, state: KeyState, mean_latency: float | None) -> float:
+        """健康度权重：成功率越高、耗时越低，权重越大"""
+        weight = max(state.success_rate, 0.05)
+        if state.latency and mean_latency:
+            weight /= max(state.latency / mean_latency, 0.1)
+        return weight
+
+    def select(self) -> list[str]:
+        """返回本次请求的 Key 尝试顺序，冷却中和隔离中的 Key 不参与"""
+        now = time.monotonic()
+        healthy: list[KeyState] = []
+        probe: KeyState | None = None
+        for state in self.states.values():
+            if state.cooldown_until > now or state.quarantine_until > now:
+                continue
+            if state.hard_failures > 0:
+                # 隔离到期，每次只安排一个探测请求
+                if probe is None:
+                    probe = state
+                continue
+            healthy.append(state)
+
+        latencies = [s.latency for s in healthy if s.latency]
+        mean_latency = sum(latencies) / len(latencies) if latencies else None
+        # 加权随机排序（Efraimidis-Spirakis），健康的 Key 更可能排在前面，同时分散负载
+        healthy.sort(
+            key=lambda s: random.random() ** (1.0 / self._weight(s, mean_latency)),
+            reverse=True,
+        )
+        order = [state.key for state in healthy]
+        if probe is not None:
+            # 探测期间暂不被其他请求选中，若探测结果未回报则窗口过后可再次探测
+            probe.quarantine_until = now + self.probe_window
+            order.insert(0, probe.key)
+        return order
+
+    def is_available(self, key: str) -> bool:
+        """Key 当前是否可用（未冷却、未隔离）"""
+        state = self.states.get(key)
+        if state is None:
+            return False
+        now = time.monotonic()
+        return state.cooldown_until <= now and state.quarantine_until <= now
+
+    def set_cooldown(self, key: str, seconds: float | None) -> None:
+        """按 Retry-After 设置冷却时间"""
+        state = self.states.get(key)
+        if state is None or seconds is None:
+            return
+        state.cooldown_until = max(
+            state.cooldown_until, time.monotonic() + min(seconds, self.max_cooldown)
+        )
+
+    def report_success(self, key: str, latency: float) -> None:
+        """记录成功请求"""
+        state = self.states.get(key)
+        if state is None:
+            return
+        state.successes += 1
+        state.success_rate += self.alpha * (1.0 - state.success_rate)
+        state.latency = (
+            latency
+            if state.latency is None
+            else state.latency + self.alpha * (latency - state.latency)
+        )
+        state.rate_limits = 0
+        state.hard_failures = 0
+        state.quarantine_until = 0.0
+
+    def report_failure(self, key: str, status: int | None) -> None:
+        """记录失败请求，按状态码决定冷却或隔离"""
+        state = self.states.get(key)
+        if state is None:
+            return
+        now = time.monotonic()
+        state.failures += 1
+        state.success_rate -= self.alpha * state.success_rate
+        if status in self.RATE_LIMIT_STATUS_CODES:
+            state.rate_limits += 1
+            cooldown = min(
+                self.base_cooldown * 2 ** (state.rate_limits - 1), self.max_cooldown
+            )
+            state.cooldown_until = max(state.cooldown_until, now + cooldown)
+        elif status in self.HARD_FAILURE_STATUS_CODES:
+            state.hard_failures += 1
+            quarantine = min(
+                self.base_quarantine * 2 ** (state.hard_failures - 1),
+                self.max_quarantine,
+            )
+            state.quarantine_until = now + quarantine
+
+    def snapshot(self) -> list[str]:
+        """返回可读的 Key 状态列表，Key 已脱敏"""
+        now = time.monotonic()
+        lines = []
+        for state in self.states.values():
+            masked = f"{state.key[:4]}***{state.key[-4:]}" if len(state.key) > 10 else "***"
+            if state.quarantine_until > now:
+                status = f"隔离 {state.quarantine_until - now:.0f}s"
+            elif state.cooldown_until > now:
+                status = f"冷却 {state.cooldown_until - now:.0f}s"
+            elif state.hard_failures > 0:
+                status = "待探测"
+            else:
+                status = "正常"
+            latency = f"{state.latency:.1f}s" if state.latency else "-"
+            lines.append(
+                f"{masked} {status} 成功率 {state.success_rate:.0%} 耗时 {latency} "
+                f"(成功 {state.successes}/失败 {state.failures})"
+            )
+        return lines
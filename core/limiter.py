@@ -0,0 +1,77 @@
+import time
+from collections.abc import Callable
+
+
+class AIMDLimiter:
+    """自适应并发上限（加性增、乘性减）
+
+    根据提供商每次请求的结果调整并发上限：请求成功且耗时没有明显变长时，每个成功请求
+    增加 1/limit（约每轮并发 +1）；遇到限流、服务端错误或超时时按比例削减，冷却期内只削减一次，
+    避免同一波失败被重复计算。上限始终限制在 [min_limit, max_limit] 之间。
+    """
+
+    def __init__(
+        self,
+        initial: int,
+        min_limit: int = 1,
+        max_limit: int = 8,
+        backoff: float = 0.5,
+        latency_tolerance: float = 3.0,
+        cooldown: float = 10.0,
+        alpha: float = 0.2,
+        on_change: Callable[[int], None] | None = None,
+    ):
+        self.min_limit = max(min_limit, 1)
+        self.max_limit = max(max_limit, self.min_limit)
+        self.backoff = backoff
+        self.latency_tolerance = latency_tolerance
+        self.cooldown = cooldown
+        self.alpha = alpha
+        self.on_change = on_change
+        self._limit = float(min(max(initial, self.min_limit), self.max_limit))
+        self._latency: float | None = None
+        self._last_decrease = 0.0
+        # 统计
+        self.increases = 0
+        self.decreases = 0
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    @property
+    def latency(self) -> float | None:
+        """成功请求耗时 EWMA, 单位: 秒"""
+        return self._latency
+
+    def record(self, status: int | None, latency: float) -> None:
+        """记录一次提供商请求的结果"""
+        before = self.limit
+        if status == 200:
+            healthy = (
+                self._latency is None
+                or latency <= self._latency * self.latency_tolerance
+            )
+            self._latency = (
+                latency
+                if self._latency is None
+                else self._latency + self.alpha * (latency - self._latency)
+            )
+            if healthy:
+                self._limit = min(self._limit + 1 / self._limit, self.max_limit)
+        elif status is None or status in (408, 429) or status >= 500:
+            now = time.monotonic()
+            if now - self._last_decrease >= self.cooldown:
+                self._last_decrease = now
+                self._limit = max(self._limit * self.backoff, self.min_limit)
+        else:
+            # 其余 4xx（Key 无效、参数错误等）与容量无关
+            return
+
+        after = self.limit
+        if after > before:
+            self.increases += 1
+        elif after < before:
+            self.decreases += 1
+        if after != before and self.on_change is not None:
+            self.on_change(after)
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import asyncio
+import functools
 from typing import TYPE_CHECKING, Any
 
 # from mcp.types import CallToolResult, ContentBlock, ImageContent
@@ -12,10 +13,11 @@ from astrbot.api.star import Context, StarTools
 from astrbot.core.agent.run_context import ContextWrapper
 from astrbot.core.agent.tool import FunctionTool, ToolExecResult
 from astrbot.core.astr_agent_context import AstrAgentContext
-from astrbot.core.message.components import BaseMessageComponent
+from astrbot.core.message.components import BaseMessageComponent, Plain
 from astrbot.core.message.message_event_result import MessageChain
 from astrbot.core.platform.astr_message_event import AstrMessageEvent
 
+from .scheduler import SHED_WAIT_TIMEOUT, SOURCE_LLM_TOOL, Job
 from .utils import clear_cache
 
 TOOLS_NAMESPACE = ["banana_preset_prompt", "banana_image_generation"]
@@ -176,7 +178,8 @@ class BigBananaTool(FunctionTool[AstrAgentContext]):
                 logger.warning(f"[BIG BANANA] 未找到预设提示词：「{preset_name}」")
                 return f"未找到预设提示词：「{preset_name}」，请使用有效的预设名称。"
             else:
-                params = plugin.prompt_dict.get(preset_name, {})
+                # 复制一份，避免写入 prompt、count 时修改共享的预设
+                params = dict(plugin.prompt_dict[preset_name])
         if prompt:
             params["prompt"] = prompt
         if "{{user_text}}" in prompt:
@@ -193,35 +196,47 @@ class BigBananaTool(FunctionTool[AstrAgentContext]):
 
         logger.info(f"[BIG BANANA] 生成图片提示词: {prompt[:128]}")
 
-        # 创建后台任务
-        task = asyncio.create_task(
-            plugin.job(event, params, referer_id=referer_id, is_llm_tool=True)
+        # 排空期间暂停受理新任务
+        if not plugin.worker_pool.accepting:
+            return "画图服务维护中，暂停受理新任务，请稍后再试。"
+
+        # 候选图片数量，与触发词画图一致：并发请求数即占用的名额数
+        count = plugin._normalize_count(params.get("count", 1))
+        params["count"] = count
+
+        # 准入控制：队列过载时直接拒绝
+        is_admin = plugin.is_global_admin(event)
+        shed_reason = plugin.scheduler.admit(
+            str(event.get_sender_id()),
+            event.get_group_id(),
+            priority=is_admin,
+            source=SOURCE_LLM_TOOL,
+            expected=plugin.estimate_duration(params),
+            weight=count,
+        )
+        if shed_reason:
+            logger.info(f"[BIG BANANA] 请求被准入控制拒绝: {shed_reason}")
+            return plugin.shed_message(shed_reason)
+
+        # 与触发词画图共用调度器名额和工作池，生成完成后直接发送给用户，不阻塞本次函数调用
+        job = plugin.scheduler.submit(
+            str(event.get_sender_id()),
+            event.get_group_id(),
+            priority=is_admin,
+            source=SOURCE_LLM_TOOL,
+            expected=plugin.estimate_duration(params),
+            weight=count,
+        )
+        plugin.worker_pool.submit(
+            job,
+            run=functools.partial(_run_generation, plugin, event, job, params, referer_id),
+            abort=functools.partial(_abort_generation, event),
+            timeout=None if is_admin else plugin.scheduler.max_wait or None,
+        )
+        return (
+            f"图片生成任务已提交（任务 #{job.job_id}），完成后会直接发送给用户。"
+            "请直接回复用户消息，禁止重复调用函数工具。"
         )
-        task_id = event.message_obj.message_id
-        plugin.running_tasks[task_id] = task
-        try:
-            results, err_msg = await task
-            if not results or err_msg:
-                return err_msg or "图片生成失败，未返回任何结果。"
-
-            # 组装消息链
-            msg_chain: list[BaseMessageComponent] = plugin.build_message_chain(
-                event, results
-            )
-            await event.send(MessageChain(chain=msg_chain))
-            # 告知模型图片已发送
-            logger.info("[BIG BANANA] 图片生成成功，已直接发送给用户")
-            return (
-                "图片生成完成，已发送给用户。请直接回复用户消息，禁止重复调用函数工具。"
-            )
-        except asyncio.CancelledError:
-            logger.info(f"[BIG BANANA] {task_id} 任务被取消")
-            return "图片生成任务被取消"
-        finally:
-            plugin.running_tasks.pop(task_id, None)
-            # 目前只有 telegram 平台需要清理缓存
-            if event.platform_meta.name == "telegram":
-                clear_cache(plugin.temp_dir)
 
         # 暂时不采用Astr的返回方法，改用手动发送，实现原理是一样的。
         # # 构建返回结果，Agent代码似乎只会取content的第一个元素
@@ -238,6 +253,54 @@ class BigBananaTool(FunctionTool[AstrAgentContext]):
         # return CallToolResult(content=contents)
 
 
+async def _run_generation(
+    plugin: BigBanana,
+    event: AstrMessageEvent,
+    job: Job,
+    params: dict,
+    referer_id: list[str],
+) -> None:
+    """工作协程执行的函数工具画图任务，结果和错误信息直接发送给用户"""
+    try:
+        results, err_msg = await plugin.job(
+            event, params, referer_id=referer_id, is_llm_tool=True, ticket=job
+        )
+        # 生成已结束，发送期间不可再被取消
+        job.sending = True
+        if not results or err_msg:
+            await event.send(
+                MessageChain(
+                    chain=[Plain(f"❌ {err_msg or '图片生成失败，未返回任何结果。'}")]
+                )
+            )
+            return
+
+        # 组装消息链
+        msg_chain: list[BaseMessageComponent] = plugin.build_message_chain(
+            event, results
+        )
+        await event.send(MessageChain(chain=msg_chain))
+        logger.info("[BIG BANANA] 图片生成成功，已直接发送给用户")
+    except asyncio.CancelledError:
+        logger.info(f"[BIG BANANA] 任务 #{job.job_id} 被取消")
+        if not job.cancelled:
+            raise
+        await event.send(MessageChain(chain=[Plain("🛑 图片生成任务已取消")]))
+    finally:
+        # 目前只有 telegram 平台需要清理缓存
+        if event.platform_meta.name == "telegram":
+            clear_cache(plugin.temp_dir)
+
+
+async def _abort_generation(event: AstrMessageEvent, reason: str) -> None:
+    """函数工具任务未执行即离开队列（被取消或排队超时）时通知用户"""
+    if reason == SHED_WAIT_TIMEOUT:
+        text = "🚦 排队时间过长，图片生成任务已取消，请稍后再试"
+    else:
+        text = "🛑 图片生成任务已取消"
+    await event.send(MessageChain(chain=[Plain(text)]))
+
+
 def remove_tools(context: Context):
     func_tool = context.get_llm_tool_manager()
     for name in TOOLS_NAMESPACE:
@@ -1,3 +1,4 @@
+import asyncio
 import json
 import re
 from urllib.parse import urlparse
@@ -7,7 +8,10 @@ from curl_cffi.requests.exceptions import Timeout
 from astrbot.api import logger
 
 from .base import BaseProvider
-from .data import ProviderConfig
+from .data import ImageData, ProviderConfig
+from .deadline import Deadline
+from .request_body import JsonBodyBuilder
+from .sse import SSEParser
 
 
 def is_safe_url(url: str) -> bool:
@@ -47,33 +51,29 @@ class OpenAIChatProvider(BaseProvider):
         self,
         provider_config: ProviderConfig,
         api_key: str,
-        image_b64_list: list[tuple[str, str]],
-        params: dict,
-    ) -> tuple[list[tuple[str, str]] | None, int | None, str | None]:
+        body: bytes,
+        deadline: Deadline,
+    ) -> tuple[list[ImageData] | None, int | None, str | None]:
         """发起 OpenAI 图片生成请求
-        返回值: 元组(图片 base64 列表, 状态码, 人类可读的错误信息)
+        返回值: 元组(图片列表, 状态码, 人类可读的错误信息)
         """
         headers = {
             "Content-Type": "application/json",
             "Authorization": f"Bearer {api_key}",
         }
-        # 构建请求上下文
-        openai_context = self._build_openai_chat_context(
-            provider_config.model, image_b64_list, params
-        )
         try:
             # 发送请求
             response = await self.session.post(
                 url=provider_config.api_url,
                 headers=headers,
-                json=openai_context,
-                timeout=self.def_common_config.timeout,
+                data=body,
+                timeout=deadline.clip(self.def_common_config.timeout),
                 proxy=self.def_common_config.proxy,
             )
-            # 响应反序列化
-            result = response.json()
+            # 直接从原始字节反序列化，不生成完整的响应文本
+            result = json.loads(response.content)
             if response.status_code == 200:
-                b64_images = []
+                images = []
                 images_url = []
                 for item in result.get("choices", []):
                     # 检查 finish_reason 状态
@@ -94,7 +94,7 @@ class OpenAIChatProvider(BaseProvider):
                                 if url.startswith("data:image/"):
                                     header, base64_data = url.split(",", 1)
                                     mime = header.split(";")[0].replace("data:", "")
-                                    b64_images.append((mime, base64_data))
+                                    images.append(ImageData.from_b64(mime, base64_data))
                                 elif url and is_safe_url(url):
                                     images_url.append(url)
                                 else:
@@ -117,7 +117,7 @@ class OpenAIChatProvider(BaseProvider):
                                         if url.startswith("data:image/"):
                                             header, base64_data = url.split(",", 1)
                                             mime = header.split(";")[0].replace("data:", "")
-                                            b64_images.append((mime, base64_data))
+                                            images.append(ImageData.from_b64(mime, base64_data))
                                         elif url:
                                             images_url.append(url)
                             else:
@@ -133,32 +133,35 @@ class OpenAIChatProvider(BaseProvider):
                                 if img_src.startswith("data:image/"):  # base64
                                     header, base64_data = img_src.split(",", 1)
                                     mime = header.split(";")[0].replace("data:", "")
-                                    b64_images.append((mime, base64_data))
+                                    images.append(ImageData.from_b64(mime, base64_data))
                                 elif is_safe_url(img_src):  # URL - 需要安全检查
                                     images_url.append(img_src)
                                 else:
                                     logger.warning(f"[BIG BANANA] 跳过 markdown 中不安全的 URL: {img_src[:100]}")
                     else:
                         logger.warning(
-                            f"[BIG BANANA] 图片生成失败, 响应内容: {response.text[:1024]}"
+                            f"[BIG BANANA] 图片生成失败, 响应内容: {self._preview(response.content)}"
                         )
                         # finish_reason 非 stop 通常是内容审查
                         return None, 200, "图片触碰内容审查，无法生成"
                 # 最后再检查是否有图片数据
-                if not images_url and not b64_images:
+                if not images_url and not images:
                     logger.warning(
-                        f"[BIG BANANA] 请求成功，但未返回图片数据, 响应内容: {response.text[:1024]}"
+                        f"[BIG BANANA] 请求成功，但未返回图片数据, 响应内容: {self._preview(response.content)}"
                     )
                     # 空内容通常表示内容审查拦截
                     return None, 200, "图片触碰内容审查，无法生成"
-                # 下载图片并转换为 base64
-                b64_images += await self.downloader.fetch_images(images_url)
-                if not b64_images:
+                # 下载图片
+                images += await self.downloader.fetch_images(
+                    images_url, budget=deadline.remaining()
+                )
+                if not images:
                     return None, 200, "图片下载失败"
-                return b64_images, 200, None
+                return images, 200, None
             else:
+                self._note_retry_after(provider_config, api_key, response)
                 logger.error(
-                    f"[BIG BANANA] 图片生成失败，状态码: {response.status_code}, 响应内容: {response.text[:1024]}"
+                    f"[BIG BANANA] 图片生成失败，状态码: {response.status_code}, 响应内容: {self._preview(response.content)}"
                 )
                 return (
                     None,
@@ -170,7 +173,7 @@ class OpenAIChatProvider(BaseProvider):
             return None, 408, "图片生成失败：响应超时"
         except json.JSONDecodeError as e:
             logger.error(
-                f"[BIG BANANA] JSON反序列化错误: {e}，状态码：{response.status_code}，响应内容：{response.text[:1024]}"
+                f"[BIG BANANA] JSON反序列化错误: {e}，状态码：{response.status_code}，响应内容：{self._preview(response.content)}"
             )
             return None, response.status_code, "图片生成失败：响应内容格式错误"
         except Exception as e:
@@ -181,141 +184,181 @@ class OpenAIChatProvider(BaseProvider):
         self,
         provider_config: ProviderConfig,
         api_key: str,
-        image_b64_list: list[tuple[str, str]],
-        params: dict,
-    ) -> tuple[list[tuple[str, str]] | None, int | None, str | None]:
+        body: bytes,
+        deadline: Deadline,
+    ) -> tuple[list[ImageData] | None, int | None, str | None]:
         """发起 OpenAI 图片生成流式请求
-        返回值: 元组(图片 base64 列表, 状态码, 人类可读的错误信息)
+        返回值: 元组(图片列表, 状态码, 人类可读的错误信息)
         """
         headers = {
             "Content-Type": "application/json",
             "Authorization": f"Bearer {api_key}",
         }
-        # 构建请求上下文
-        openai_context = self._build_openai_chat_context(
-            provider_config.model, image_b64_list, params
-        )
+        response = None
         try:
             # 发送请求
             response = await self.session.post(
                 url=provider_config.api_url,
                 headers=headers,
-                json=openai_context,
+                data=body,
                 proxy=self.def_common_config.proxy,
+                timeout=deadline.clip(self.def_common_config.timeout),
                 stream=True,
             )
-            # 处理流式响应
-            streams = response.aiter_content(chunk_size=1024)
-            # 读取完整内容（使用 bytearray 避免 O(n²) 拼接）
-            data = bytearray()
-            async for chunk in streams:
-                data.extend(chunk)
-            result = data.decode("utf-8")
-            if response.status_code == 200:
-                b64_images = []
-                images_url = []
-                reasoning_content = ""
-                for line in result.splitlines():
-                    if line.startswith("data: "):
-                        line_data = line[len("data: ") :].strip()
-                        if line_data == "[DONE]":
-                            break
-                        try:
-                            json_data = json.loads(line_data)
-                            # 遍历 json_data，检查是否有图片
-                            for item in json_data.get("choices", []):
-                                delta = item.get("delta", {})
-                                content = delta.get("content", "")
-
-                                # 处理 delta.images 字段（Gemini 图片生成格式）
-                                images_list = delta.get("images", [])
-                                for img_item in images_list:
-                                    if isinstance(img_item, dict) and img_item.get("type") == "image_url":
-                                        img_url = img_item.get("image_url", {})
-                                        if isinstance(img_url, dict):
-                                            url = img_url.get("url", "")
-                                        else:
-                                            url = str(img_url)
-                                        if url.startswith("data:image/"):
-                                            header, base64_data = url.split(",", 1)
-                                            mime = header.split(";")[0].replace("data:", "")
-                                            b64_images.append((mime, base64_data))
-                                        elif url:
-                                            images_url.append(url)
-
-                                # 处理 content 可能是列表的情况
-                                if isinstance(content, list):
-                                    for part in content:
-                                        if isinstance(part, dict):
-                                            if part.get("type") == "text":
-                                                content = part.get("text", "")
-                                                break
-                                            elif part.get("type") == "image_url":
-                                                img_url = part.get("image_url", {})
-                                                if isinstance(img_url, dict):
-                                                    url = img_url.get("url", "")
-                                                else:
-                                                    url = str(img_url)
-                                                if url.startswith("data:image/"):
-                                                    header, base64_data = url.split(",", 1)
-                                                    mime = header.split(";")[0].replace("data:", "")
-                                                    b64_images.append((mime, base64_data))
-                                                elif url:
-                                                    images_url.append(url)
-                                    else:
-                                        content = ""
-                                elif not isinstance(content, str):
-                                    content = str(content) if content else ""
-
-                                # 从 markdown 格式提取图片
-                                if content:
-                                    match = re.search(r"!\[.*?\]\((.*?)\)", content)
-                                    if match:
-                                        img_src = match.group(1)
-                                        if img_src.startswith("data:image/"):  # base64
-                                            header, base64_data = img_src.split(",", 1)
-                                            mime = header.split(";")[0].replace("data:", "")
-                                            b64_images.append((mime, base64_data))
-                                        else:  # URL
-                                            images_url.append(img_src)
-                                    else:  # 尝试查找失败的原因或者纯文本返回结果
-                                        reasoning_content += delta.get(
-                                            "reasoning_content", ""
-                                        )
-                        except json.JSONDecodeError:
-                            continue
-                if not images_url and not b64_images:
-                    logger.warning(
-                        f"[BIG BANANA] 请求成功，但未返回图片数据, 响应内容: {result[:1024]}"
-                    )
-                    return None, 200, reasoning_content or "图片触碰内容审查，无法生成"
-                # 下载图片并转换为 base64（有时会出现连接被重置的错误，不知道什么原因，国外服务器也一样）
-                b64_images += await self.downloader.fetch_images(images_url)
-                if not b64_images:
-                    return None, 200, "图片下载失败"
-                return b64_images, 200, None
-            else:
+            if response.status_code != 200:
+                preview = await self._read_stream_preview(response)
+                self._note_retry_after(provider_config, api_key, response)
                 logger.error(
-                    f"[BIG BANANA] 图片生成失败，状态码: {response.status_code}, 响应内容: {result[:1024]}"
+                    f"[BIG BANANA] 图片生成失败，状态码: {response.status_code}, 响应内容: {preview}"
                 )
                 return None, response.status_code, "响应中未包含图片数据"
-        except Timeout as e:
+            images = []
+            images_url = []
+            reasoning_content = ""
+            # 增量解析流式响应，边接收边处理事件
+            parser = SSEParser()
+            preview = bytearray()
+            done = False
+            # 流式读取不受请求 timeout 约束，按任务剩余预算限制
+            async with asyncio.timeout(deadline.remaining()):
+                async for chunk in response.aiter_content(chunk_size=64 * 1024):
+                    if len(preview) < 1024:
+                        preview.extend(chunk[: 1024 - len(preview)])
+                    for payload in parser.feed(chunk):
+                        if payload == b"[DONE]":
+                            done = True
+                            break
+                        reasoning_content += self._parse_stream_payload(
+                            payload, images, images_url
+                        )
+                    if done:
+                        break
+            if not done:
+                for payload in parser.flush():
+                    if payload != b"[DONE]":
+                        reasoning_content += self._parse_stream_payload(
+                            payload, images, images_url
+                        )
+            if not images_url and not images:
+                logger.warning(
+                    f"[BIG BANANA] 请求成功，但未返回图片数据, 响应内容: {self._preview(preview)}"
+                )
+                return None, 200, reasoning_content or "图片触碰内容审查，无法生成"
+            # 下载图片（有时会出现连接被重置的错误，不知道什么原因，国外服务器也一样）
+            images += await self.downloader.fetch_images(
+                images_url, budget=deadline.remaining()
+            )
+            if not images:
+                return None, 200, "图片下载失败"
+            return images, 200, None
+        except (Timeout, TimeoutError) as e:
             logger.error(f"[BIG BANANA] 网络请求超时: {e}")
             return None, 408, "图片生成失败：响应超时"
         except Exception as e:
             logger.error(f"[BIG BANANA] 请求错误: {e}")
             return None, None, "图片生成失败：程序错误"
+        finally:
+            if response is not None:
+                await response.aclose()
+
+    @staticmethod
+    def _parse_stream_payload(
+        payload: bytes, images: list[ImageData], images_url: list[str]
+    ) -> str:
+        """解析单个流式事件负载，图片追加到 images / images_url，返回其中的推理文本"""
+        try:
+            json_data = json.loads(payload)
+        except json.JSONDecodeError:
+            return ""
+        reasoning_content = ""
+        # 遍历 json_data，检查是否有图片
+        for item in json_data.get("choices", []):
+            delta = item.get("delta", {})
+            content = delta.get("content", "")
+
+            # 处理 delta.images 字段（Gemini 图片生成格式）
+            images_list = delta.get("images", [])
+            for img_item in images_list:
+                if isinstance(img_item, dict) and img_item.get("type") == "image_url":
+                    img_url = img_item.get("image_url", {})
+                    if isinstance(img_url, dict):
+                        url = img_url.get("url", "")
+                    else:
+                        url = str(img_url)
+                    if url.startswith("data:image/"):
+                        header, base64_data = url.split(",", 1)
+                        mime = header.split(";")[0].replace("data:", "")
+                        images.append(ImageData.from_b64(mime, base64_data))
+                    elif url:
+                        images_url.append(url)
+
+            # 处理 content 可能是列表的情况
+            if isinstance(content, list):
+                for part in content:
+                    if isinstance(part, dict):
+                        if part.get("type") == "text":
+                            content = part.get("text", "")
+                            break
+                        elif part.get("type") == "image_url":
+                            img_url = part.get("image_url", {})
+                            if isinstance(img_url, dict):
+                                url = img_url.get("url", "")
+                            else:
+                                url = str(img_url)
+                            if url.startswith("data:image/"):
+                                header, base64_data = url.split(",", 1)
+                                mime = header.split(";")[0].replace("data:", "")
+                                images.append(ImageData.from_b64(mime, base64_data))
+                            elif url:
+                                images_url.append(url)
+                else:
+                    content = ""
+            elif not isinstance(content, str):
+                content = str(content) if content else ""
+
+            # 从 markdown 格式提取图片
+            if content:
+                match = re.search(r"!\[.*?\]\((.*?)\)", content)
+                if match:
+                    img_src = match.group(1)
+                    if img_src.startswith("data:image/"):  # base64
+                        header, base64_data = img_src.split(",", 1)
+                        mime = header.split(";")[0].replace("data:", "")
+                        images.append(ImageData.from_b64(mime, base64_data))
+                    else:  # URL
+                        images_url.append(img_src)
+                else:  # 尝试查找失败的原因或者纯文本返回结果
+                    reasoning_content += delta.get("reasoning_content", "")
+        return reasoning_content
+
+    def _build_request_body(
+        self,
+        provider_config: ProviderConfig,
+        image_list: list[ImageData],
+        params: dict,
+    ) -> bytes:
+        """构建 OpenAI Chat 请求体，图片 Base64 直接拼接进序列化结果"""
+        builder = JsonBodyBuilder()
+        context = self._build_openai_chat_context(
+            provider_config.model, image_list, params, builder
+        )
+        return builder.build(context)
 
     def _build_openai_chat_context(
         self,
         model: str,
-        image_b64_list: list[tuple[str, str]],
+        image_list: list[ImageData],
         params: dict,
+        builder: JsonBodyBuilder,
     ) -> dict:
+        # 图片 Base64 以占位符代替，data URL 前缀保留在骨架中
         images_content = []
-        for mime, b64 in image_b64_list:
+        for image in image_list:
             images_content.append(
-                {"type": "image_url", "image_url": {"url": f"data:{mime};base64,{b64}"}}
+                {
+                    "type": "image_url",
+                    "image_url": {"url": f"data:{image.mime};base64,{builder.image(image)}"},
+                }
             )
         context = {
             "model": model,
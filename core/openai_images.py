@@ -0,0 +1,298 @@
+import asyncio
+import json
+import secrets
+from typing import ClassVar
+
+from curl_cffi.requests.exceptions import Timeout
+
+from astrbot.api import logger
+
+from .base import BaseProvider
+from .data import ImageData, ProviderConfig
+from .deadline import Deadline
+from .request_body import build_multipart_body
+from .sse import SSEParser
+
+
+class OpenAIImagesProvider(BaseProvider):
+    """OpenAI Images 提供商
+
+    调用原生图片接口：无参考图时使用 /images/generations（JSON），
+    有参考图时使用 /images/edits（multipart，图片以原始字节上传）。
+    响应直接返回 b64_json，无需解析 markdown，也无需二次下载图片。
+    多张候选图片通过 n 参数在一次请求中生成。
+    """
+
+    api_type: str = "OpenAI_Images"
+    native_count = True
+    # 各模型系列支持的 (横图, 竖图, 方图) 尺寸，按模型名前缀匹配
+    SIZES_BY_MODEL: ClassVar[dict[str, tuple[str, str, str]]] = {
+        "gpt-image": ("1536x1024", "1024x1536", "1024x1024"),
+        "dall-e-3": ("1792x1024", "1024x1792", "1024x1024"),
+    }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # multipart 分隔符，同时用于区分请求体类型
+        self._boundary = f"BigBanana{secrets.token_hex(16)}"
+
+    def _is_multipart(self, body: bytes) -> bool:
+        return body.startswith(f"--{self._boundary}".encode("ascii"))
+
+    def _headers(self, api_key: str, multipart: bool) -> dict[str, str]:
+        return {
+            "Content-Type": (
+                f"multipart/form-data; boundary={self._boundary}"
+                if multipart
+                else "application/json"
+            ),
+            "Authorization": f"Bearer {api_key}",
+        }
+
+    @staticmethod
+    def _endpoint(api_url: str, edit: bool) -> str:
+        """根据 api_url 推导 generations / edits 接口地址
+
+        api_url 可填写 https://<base_url>/v1/images，也兼容直接填写任一具体接口地址。
+        """
+        base = api_url.rstrip("/")
+        for suffix in ("/generations", "/edits"):
+            if base.endswith(suffix):
+                base = base[: -len(suffix)]
+                break
+        if not base.endswith("/images"):
+            base += "/images"
+        return f"{base}/edits" if edit else f"{base}/generations"
+
+    async def _call_api(
+        self,
+        provider_config: ProviderConfig,
+        api_key: str,
+        body: bytes,
+        deadline: Deadline,
+    ) -> tuple[list[ImageData] | None, int | None, str | None]:
+        """发起 OpenAI Images 图片生成请求
+        返回值: 元组(图片列表, 状态码, 人类可读的错误信息)
+        """
+        multipart = self._is_multipart(body)
+        headers = self._headers(api_key, multipart)
+        try:
+            response = await self.session.post(
+                url=self._endpoint(provider_config.api_url, multipart),
+                headers=headers,
+                data=body,
+                timeout=deadline.clip(self.def_common_config.timeout),
+                proxy=self.def_common_config.proxy,
+            )
+            # 直接从原始字节反序列化，不生成完整的响应文本
+            result = json.loads(response.content)
+            if response.status_code == 200:
+                mime = self._output_mime(result)
+                images = []
+                images_url = []
+                for item in result.get("data", []):
+                    if item.get("b64_json"):
+                        images.append(ImageData.from_b64(mime, item["b64_json"]))
+                    elif item.get("url"):
+                        images_url.append(item["url"])
+                if not images and not images_url:
+                    logger.warning(
+                        f"[BIG BANANA] 请求成功，但未返回图片数据, 响应内容: {self._preview(response.content)}"
+                    )
+                    return None, 200, "图片触碰内容审查，无法生成"
+                # 部分兼容接口忽略 response_format 仍返回 URL，此时回退为下载
+                if images_url:
+                    images += await self.downloader.fetch_images(
+                        images_url, budget=deadline.remaining()
+                    )
+                if not images:
+                    return None, 200, "图片下载失败"
+                return images, 200, None
+            else:
+                self._note_retry_after(provider_config, api_key, response)
+                logger.error(
+                    f"[BIG BANANA] 图片生成失败，状态码: {response.status_code}, 响应内容: {self._preview(response.content)}"
+                )
+                return None, response.status_code, self._error_message(result)
+        except Timeout as e:
+            logger.error(f"[BIG BANANA] 网络请求超时: {e}")
+            return None, 408, "图片生成失败：响应超时"
+        except json.JSONDecodeError as e:
+            logger.error(
+                f"[BIG BANANA] JSON反序列化错误: {e}，状态码：{response.status_code}，响应内容：{self._preview(response.content)}"
+            )
+            return None, response.status_code, "图片生成失败：响应内容格式错误"
+        except Exception as e:
+            logger.error(f"[BIG BANANA] 请求错误: {e}")
+            return None, None, "图片生成失败：程序错误"
+
+    async def _call_stream_api(
+        self,
+        provider_config: ProviderConfig,
+        api_key: str,
+        body: bytes,
+        deadline: Deadline,
+    ) -> tuple[list[ImageData] | None, int | None, str | None]:
+        """发起 OpenAI Images 图片生成流式请求
+        只处理 *.completed 事件中的最终图片，忽略 partial_image 预览图。
+        返回值: 元组(图片列表, 状态码, 人类可读的错误信息)
+        """
+        multipart = self._is_multipart(body)
+        headers = self._headers(api_key, multipart)
+        response = None
+        try:
+            response = await self.session.post(
+                url=self._endpoint(provider_config.api_url, multipart),
+                headers=headers,
+                data=body,
+                proxy=self.def_common_config.proxy,
+                timeout=deadline.clip(self.def_common_config.timeout),
+                stream=True,
+            )
+            if response.status_code != 200:
+                preview = await self._read_stream_preview(response)
+                self._note_retry_after(provider_config, api_key, response)
+                logger.error(
+                    f"[BIG BANANA] 图片生成失败，状态码: {response.status_code}, 响应内容: {preview}"
+                )
+                return None, response.status_code, f"图片生成失败：状态码 {response.status_code}"
+            # 增量解析流式响应，收集每张候选图片的最终结果
+            parser = SSEParser()
+            preview = bytearray()
+            images = []
+            # 流式读取不受请求 timeout 约束，按任务剩余预算限制
+            async with asyncio.timeout(deadline.remaining()):
+                async for chunk in response.aiter_content(chunk_size=64 * 1024):
+                    if len(preview) < 1024:
+                        preview.extend(chunk[: 1024 - len(preview)])
+                    for payload in parser.feed(chunk):
+                        image = self._parse_stream_payload(payload)
+                        if image:
+                            images.append(image)
+            for payload in parser.flush():
+                image = self._parse_stream_payload(payload)
+                if image:
+                    images.append(image)
+            if images:
+                return images, 200, None
+            logger.warning(
+                f"[BIG BANANA] 请求成功，但未返回图片数据, 响应内容: {self._preview(preview)}"
+            )
+            return None, 200, "图片触碰内容审查，无法生成"
+        except (Timeout, TimeoutError) as e:
+            logger.error(f"[BIG BANANA] 网络请求超时: {e}")
+            return None, 408, "图片生成失败：响应超时"
+        except Exception as e:
+            logger.error(f"[BIG BANANA] 请求错误: {e}")
+            return None, None, "图片生成失败：程序错误"
+        finally:
+            if response is not None:
+                await response.aclose()
+
+    @classmethod
+    def _parse_stream_payload(cls, payload: bytes) -> ImageData | None:
+        """解析单个流式事件负载，返回最终图片"""
+        try:
+            json_data = json.loads(payload)
+        except json.JSONDecodeError:
+            return None
+        if not str(json_data.get("type", "")).endswith(".completed"):
+            return None
+        if not json_data.get("b64_json"):
+            return None
+        return ImageData.from_b64(cls._output_mime(json_data), json_data["b64_json"])
+
+    @staticmethod
+    def _output_mime(result: dict) -> str:
+        """根据响应中的 output_format 推断图片 MIME 类型，默认 PNG"""
+        output_format = str(result.get("output_format") or "png").lower()
+        if output_format == "jpg":
+            output_format = "jpeg"
+        return f"image/{output_format}"
+
+    @staticmethod
+    def _error_message(result: dict) -> str:
+        """提取错误信息，内容审查拦截单独提示"""
+        error = result.get("error") or {}
+        if not isinstance(error, dict):
+            return f"图片生成失败：{error}"
+        if error.get("code") in ("moderation_blocked", "content_policy_violation"):
+            return "图片触碰内容审查，无法生成"
+        return f"图片生成失败：{error.get('message') or '未知原因'}"
+
+    def _build_request_body(
+        self,
+        provider_config: ProviderConfig,
+        image_list: list[ImageData],
+        params: dict,
+    ) -> bytes:
+        """构建请求体：无参考图时为 JSON，有参考图时为 multipart"""
+        context = self._build_openai_images_context(provider_config, params)
+        if not image_list:
+            return json.dumps(context, ensure_ascii=False).encode("utf-8")
+        # 表单字段统一转为字符串，布尔值使用 JSON 写法
+        fields = {
+            key: json.dumps(value) if isinstance(value, bool) else str(value)
+            for key, value in context.items()
+        }
+        # 多张参考图使用 image[] 字段上传
+        field_name = "image[]" if len(image_list) > 1 else "image"
+        files = [
+            (field_name, f"image_{i}.{image.mime.split('/')[-1]}", image)
+            for i, image in enumerate(image_list)
+        ]
+        return build_multipart_body(self._boundary, fields, files)
+
+    def _build_openai_images_context(
+        self, provider_config: ProviderConfig, params: dict
+    ) -> dict:
+        model = provider_config.model
+        context = {
+            "model": model,
+            "prompt": params.get("prompt", "anything"),
+            "n": params.get("count", 1),
+        }
+        # gpt-image 系列固定返回 b64_json，不接受 response_format 参数
+        if not model.lower().startswith("gpt-image"):
+            context["response_format"] = "b64_json"
+        if provider_config.stream:
+            context["stream"] = True
+
+        # 处理图片宽高比参数，映射为该模型支持的尺寸
+        # image_size（1K/2K/4K）在该接口中没有对应参数，忽略
+        aspect_ratio = params.get("aspect_ratio", self.def_prompt_config.aspect_ratio)
+        size = self._size_from_aspect_ratio(model, aspect_ratio)
+        if size:
+            context["size"] = size
+        return context
+
+    @classmethod
+    def _size_from_aspect_ratio(cls, model: str, aspect_ratio: str | None) -> str | None:
+        """把 "16:9" 形式的宽高比映射为该模型系列的横图、竖图或方图尺寸
+
+        dall-e-2 只支持方图、其余未知模型的尺寸不确定，均不传 size，由接口使用默认值。
+        无法识别时返回 None。
+        """
+        sizes = next(
+            (
+                sizes
+                for prefix, sizes in cls.SIZES_BY_MODEL.items()
+                if model.lower().startswith(prefix)
+            ),
+            None,
+        )
+        if sizes is None:
+            return None
+        if not isinstance(aspect_ratio, str) or ":" not in aspect_ratio:
+            return None
+        width, _, height = aspect_ratio.strip().partition(":")
+        try:
+            ratio = float(width) / float(height)
+        except (ValueError, ZeroDivisionError):
+            return None
+        landscape, portrait, square = sizes
+        if ratio > 1:
+            return landscape
+        if ratio < 1:
+            return portrait
+        return square
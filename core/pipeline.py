@@ -0,0 +1,138 @@
+import asyncio
+import time
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass, field
+
+from .data import ImageData
+
+
+@dataclass(slots=True)
+class Stage:
+    """流水线中的一个生成阶段"""
+
+    name: str
+    """阶段名称，同时作为后续阶段引用其输出的名称"""
+    params: dict
+    """生成参数"""
+    inputs: list[str]
+    """输入图片，按顺序拼接：参考图片名称或之前阶段的名称"""
+
+
+@dataclass(slots=True)
+class StageTiming:
+    """单个阶段的耗时, 单位: 秒"""
+
+    name: str
+    input_wait: float = 0.0
+    """等待输入图片（参考图下载）"""
+    generate: float = 0.0
+    """调用提供商生成"""
+
+    def describe(self) -> str:
+        return (
+            f"{self.name}: 等待输入 {self.input_wait:.2f}s，生成 {self.generate:.2f}s"
+        )
+
+
+@dataclass(slots=True)
+class PipelineResult:
+    """流水线执行结果"""
+
+    images: list[ImageData] | None = None
+    """最后一个阶段的输出"""
+    err: str | None = None
+    """人类可读的错误信息"""
+    stopped: bool = False
+    """是否被阶段回调中止"""
+    outputs: dict[str, list[ImageData]] = field(default_factory=dict)
+    """各阶段的输出"""
+    timings: list[StageTiming] = field(default_factory=list)
+    """各阶段耗时"""
+
+
+class Pipeline:
+    """多阶段生成流水线
+
+    所有参考图片由调用方在受理时同时发起下载，各阶段只等待自己需要的输入。
+    整条流水线作为一个任务在工作池中执行，调度器名额从第一个阶段保留到最后一个阶段，
+    阶段之间不会重新排队，也就不会在阶段间被其他任务插队而饿死。
+    阶段回调（如发送进度消息）与下一个阶段的生成同时进行，不延长占用名额的时间。
+    线稿转绘之外的多步预设也可以复用。
+    """
+
+    def __init__(self, stages: list[Stage]):
+        self.stages = stages
+
+    async def run(
+        self,
+        references: dict[str, Awaitable[list[ImageData] | None]],
+        dispatch: Callable[
+            [dict, list[ImageData]], Awaitable[tuple[list[ImageData] | None, str | None]]
+        ],
+        on_stage: Callable[[Stage, int], Awaitable[bool | None]] | None = None,
+    ) -> PipelineResult:
+        """执行流水线
+
+        Args:
+            references: 参考图片名称 -> 已发起的下载（任务），同一任务可被多个名称共享
+            dispatch: 调度提供商生成图片，返回 (图片列表, 错误信息)
+            on_stage: 每个阶段成功后的回调，与下一个阶段同时执行，返回 False 时中止后续阶段
+        """
+        result = PipelineResult()
+        notice: asyncio.Task | None = None
+        generate: asyncio.Future | None = None
+        try:
+            for index, stage in enumerate(self.stages):
+                timing = StageTiming(stage.name)
+                result.timings.append(timing)
+
+                # 收集输入：参考图片已在受理时发起下载，这里只等待结果
+                start = time.monotonic()
+                images: list[ImageData] = []
+                for name in stage.inputs:
+                    if name in result.outputs:
+                        images.extend(result.outputs[name])
+                        continue
+                    fetched = await references[name]
+                    if not fetched:
+                        result.err = f"{name}下载失败"
+                        return result
+                    images.extend(fetched)
+                timing.input_wait = time.monotonic() - start
+
+                start = time.monotonic()
+                generate = asyncio.ensure_future(dispatch(stage.params, images))
+                if notice is not None:
+                    # 上一阶段的回调与本阶段的生成同时进行，回调要求中止时取消本阶段
+                    await asyncio.wait({generate, notice}, return_when=asyncio.FIRST_COMPLETED)
+                    if notice.done():
+                        if notice.result() is False:
+                            result.stopped = True
+                            return result
+                        notice = None
+                images_result, err = await generate
+                timing.generate = time.monotonic() - start
+                if not images_result or err:
+                    result.err = f"{stage.name}生成失败: {err or '未知错误'}"
+                    return result
+                result.outputs[stage.name] = images_result
+
+                if on_stage is not None:
+                    # 保证回调按阶段顺序执行
+                    if notice is not None and await notice is False:
+                        result.stopped = True
+                        return result
+                    notice = asyncio.create_task(on_stage(stage, index))
+
+            if notice is not None and await notice is False:
+                result.stopped = True
+                return result
+            notice = None
+            result.images = result.outputs[self.stages[-1].name]
+            return result
+        finally:
+            # 中止、失败或被取消时，停止仍在进行的生成；未完成的回调（进度消息）照常发送
+            if generate is not None and not generate.done():
+                generate.cancel()
+            if notice is not None and not notice.done():
+                await asyncio.shield(notice)
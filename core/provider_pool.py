@@ -0,0 +1,81 @@
+import asyncio
+import time
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+
+
+class ProviderPool:
+    """单个提供商的并发名额池
+
+    只在实际调用提供商接口期间占用名额，参考图下载与结果发送不计入。
+    同时统计名额的占用时间，用于导出各提供商的利用率。
+    """
+
+    def __init__(self, limit: int = 0):
+        self.limit = max(limit, 0)
+        """并发上限，0 表示不限制"""
+        self._semaphore = asyncio.Semaphore(self.limit) if self.limit else None
+        self.in_use = 0
+        """正在占用名额的请求数"""
+        self.waiting = 0
+        """等待名额的请求数"""
+        self._created_at = time.monotonic()
+        self._changed_at = self._created_at
+        self._busy = 0.0
+        # 统计
+        self.acquired = 0
+        self.total_wait = 0.0
+
+    def _settle(self) -> None:
+        """把上次变化以来的占用时间计入累计值"""
+        now = time.monotonic()
+        self._busy += self.in_use * (now - self._changed_at)
+        self._changed_at = now
+
+    @property
+    def busy_seconds(self) -> float:
+        """累计占用的名额时间（名额数 × 秒）"""
+        return self._busy + self.in_use * (time.monotonic() - self._changed_at)
+
+    @property
+    def utilization(self) -> float | None:
+        """自启动以来的平均利用率，不限制并发时返回 None"""
+        if not self.limit:
+            return None
+        uptime = time.monotonic() - self._created_at
+        return self.busy_seconds / (self.limit * uptime) if uptime > 0 else 0.0
+
+    @property
+    def average_wait(self) -> float:
+        return self.total_wait / self.acquired if self.acquired else 0.0
+
+    @asynccontextmanager
+    async def slot(self, timeout: float | None = None) -> AsyncIterator[None]:
+        """占用一个名额，超过 timeout 仍未获得时抛出 TimeoutError"""
+        start = time.monotonic()
+        if self._semaphore is not None:
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout)
+            finally:
+                self.waiting -= 1
+        self.acquired += 1
+        self.total_wait += time.monotonic() - start
+        self._settle()
+        self.in_use += 1
+        try:
+            yield
+        finally:
+            self._settle()
+            self.in_use -= 1
+            if self._semaphore is not None:
+                self._semaphore.release()
+
+    def describe(self) -> str:
+        """人类可读的状态描述"""
+        if not self.limit:
+            return f"进行中 {self.in_use}（不限并发）"
+        return (
+            f"进行中 {self.in_use}/{self.limit}，等待 {self.waiting}，"
+            f"利用率 {self.utilization:.0%}，平均等待 {self.average_wait:.1f}s"
+        )
@@ -0,0 +1,80 @@
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from astrbot.api import logger
+
+from .data import ImageData
+from .utils import read_file
+
+
+class ReferImageCache:
+    """refer_images 预设参考图片的内存缓存
+
+    缓存已读取并完成 Base64 编码的图片，按 (路径, 文件大小, 修改时间) 判断是否失效，
+    超出字节预算时按 LRU 淘汰。读取在线程池中进行，因此内部使用线程锁保护。
+    """
+
+    def __init__(self, base_dir: Path, max_bytes: int = 64 * 1024 * 1024):
+        self.base_dir = Path(base_dir)
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[Path, tuple[int, int, ImageData]] = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        # 命中统计
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _cost(image: ImageData) -> int:
+        """缓存项占用的字节数（原始字节 + Base64 编码）"""
+        return image.size + len(image.b64)
+
+    def load(self, filename: str) -> ImageData | None:
+        """读取参考图片，命中缓存时不再读盘和编码（阻塞方法，应在线程池中调用）"""
+        path = (self.base_dir / filename).resolve()
+        try:
+            stat = path.stat()
+        except OSError as e:
+            logger.error(f"[BIG BANANA] 读取参考图片 {path} 失败: {e}")
+            return None
+
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return entry[2]
+
+        image = read_file(path, allowed_dir=self.base_dir)
+        if image is None:
+            return None
+        # 预先编码，后续请求直接复用编码结果
+        cost = self._cost(image)
+
+        with self._lock:
+            self.misses += 1
+            old = self._entries.pop(path, None)
+            if old:
+                self._total_bytes -= self._cost(old[2])
+            if cost > self.max_bytes:
+                logger.debug(f"[BIG BANANA] 参考图片 {filename} 超出缓存预算，不缓存")
+                return image
+            self._entries[path] = (stat.st_size, stat.st_mtime_ns, image)
+            self._total_bytes += cost
+            # 超出预算时淘汰最久未使用的缓存项
+            while self._total_bytes > self.max_bytes and self._entries:
+                _, (_, _, evicted) = self._entries.popitem(last=False)
+                self._total_bytes -= self._cost(evicted)
+        return image
+
+    def prewarm(self, filenames: list[str]) -> int:
+        """预热缓存，返回成功加载的图片数量（阻塞方法，应在线程池中调用）"""
+        loaded = 0
+        for filename in dict.fromkeys(filenames):
+            if self.load(filename) is not None:
+                loaded += 1
+        logger.info(
+            f"[BIG BANANA] 参考图片缓存预热完成: {loaded}/{len(set(filenames))} 张, 占用 {self._total_bytes / 1024 / 1024:.1f}MB"
+        )
+        return loaded
@@ -0,0 +1,90 @@
+import json
+import re
+import secrets
+from io import BytesIO
+
+from .data import ImageData
+
+
+class JsonBodyBuilder:
+    """低拷贝的 JSON 请求体构建器
+
+    构建请求上下文时用占位符代替图片 Base64，只序列化体积很小的 JSON 骨架，
+    再把骨架片段与图片的 Base64 编码依次写入预分配的缓冲区。图片数据不会进入 json.dumps，
+    也不会生成额外的 data URL 字符串；得到的请求体可在重试和切换 Key 时重复使用。
+    """
+
+    def __init__(self):
+        # 每次构建使用随机标记，避免与提示词中的文本冲突
+        self._marker = secrets.token_hex(8)
+        self._images: list[ImageData] = []
+
+    def image(self, image: ImageData) -> str:
+        """登记一张图片，返回其 Base64 在上下文中的占位符"""
+        self._images.append(image)
+        return f"<{self._marker}:{len(self._images) - 1}>"
+
+    def build(self, context: dict) -> bytes:
+        """序列化上下文，并把占位符替换为对应图片的 Base64"""
+        skeleton = json.dumps(context, ensure_ascii=False, separators=(",", ":"))
+        # 按占位符切分，奇数位置为图片序号
+        pieces = re.split(f"<{self._marker}:(\\d+)>", skeleton)
+        segments: list[str | bytes] = []
+        total = 0
+        for i, piece in enumerate(pieces):
+            if i % 2:
+                # Base64 字符均为 JSON 安全字符，无需转义；ASCII 编码后长度不变
+                b64 = self._images[int(piece)].b64
+                segments.append(b64)
+                total += len(b64)
+            elif piece:
+                data = piece.encode("utf-8")
+                segments.append(data)
+                total += len(data)
+        # 预先分配完整大小的缓冲区再逐段写入，同一时刻只存在一张图片的临时编码；
+        # 缓冲区恰好写满时 getvalue() 直接返回内部对象，不再整体复制一次
+        buf = BytesIO()
+        if total:
+            buf.seek(total - 1)
+            buf.write(b"\0")
+            buf.seek(0)
+        for segment in segments:
+            buf.write(segment.encode("ascii") if isinstance(segment, str) else segment)
+        return buf.getvalue()
+
+
+def build_multipart_body(
+    boundary: str,
+    fields: dict[str, str],
+    files: list[tuple[str, str, ImageData]],
+) -> bytes:
+    """构建 multipart/form-data 请求体
+
+    图片以原始字节直接写入，无需 Base64 编码；得到的请求体同样可在重试时重复使用。
+
+    Args:
+        boundary: 分隔符
+        fields: 普通表单字段
+        files: 文件字段列表，元素为 (字段名, 文件名, 图片)
+    """
+    delimiter = f"--{boundary}\r\n".encode("ascii")
+    segments: list[bytes] = []
+    for name, value in fields.items():
+        segments.append(delimiter)
+        segments.append(
+            f'Content-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode(
+                "utf-8"
+            )
+        )
+    for name, filename, image in files:
+        segments.append(delimiter)
+        segments.append(
+            (
+                f'Content-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                f"Content-Type: {image.mime}\r\n\r\n"
+            ).encode("utf-8")
+        )
+        segments.append(image.data)
+        segments.append(b"\r\n")
+    segments.append(f"--{boundary}--\r\n".encode("ascii"))
+    return b"".join(segments)
@@ -0,0 +1,433 @@
+import asyncio
+import heapq
+import itertools
+import time
+from collections import Counter, OrderedDict, deque
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+
+# 任务来源
+SOURCE_COMMAND = "command"
+"""触发词画图"""
+SOURCE_LINEART = "lineart"
+"""线稿转绘"""
+SOURCE_LLM_TOOL = "llm_tool"
+"""LLM 函数工具"""
+
+# 拒绝（削减负载）原因
+SHED_QUEUE_FULL = "queue_full"
+"""排队任务数已达上限"""
+SHED_USER_LIMIT = "user_limit"
+"""该用户排队中的任务数已达上限"""
+SHED_WAIT_TOO_LONG = "wait_too_long"
+"""预计排队时间超过上限"""
+SHED_WAIT_TIMEOUT = "wait_timeout"
+"""实际排队时间超过上限"""
+
+
+@dataclass(slots=True, eq=False)
+class Job:
+    """调度器中的任务描述"""
+
+    job_id: int
+    """任务序号"""
+    user_id: str
+    """提交者"""
+    group_id: str
+    """所在群聊（私聊为用户自身）"""
+    priority: bool = False
+    """是否走优先通道（管理员）"""
+    source: str = SOURCE_COMMAND
+    """任务来源"""
+    enqueued_at: float = field(default_factory=time.monotonic)
+    """提交时间 (time.monotonic)"""
+    started_at: float | None = None
+    """获得名额的时间 (time.monotonic)"""
+    expected: float = 0.0
+    """预计耗时, 单位: 秒"""
+    weight: int = 1
+    """占用的名额数，等于任务并发发起的生成请求数"""
+    cancelled: bool = False
+    """是否已被用户取消"""
+    sending: bool = False
+    """生成已结束、正在发送结果，此后不可取消"""
+    detached: bool = False
+    """已让出名额（如合并等待其他任务的结果），仍可取消，但不再计入并发"""
+    task: asyncio.Task | None = field(default=None, repr=False)
+    """获得名额后执行的生成任务，取消时一并取消"""
+    _granted: asyncio.Future | None = field(default=None, repr=False)
+    _detached: asyncio.Future | None = field(default=None, repr=False)
+
+    @property
+    def running(self) -> bool:
+        return self.started_at is not None
+
+
+class FairScheduler:
+    """公平画图任务调度器
+
+    取代信号量与等待计数器。管理员任务走优先通道，其余任务按群聊轮转、群内按用户轮转出队，
+    单个用户连续触发也只会按轮次占用名额，无法挤占所有并发。排队位置按实际出队顺序计算。
+    可为某个来源（如 LLM 函数工具）单独设置最多占用的名额，达到份额时该来源的任务继续排队，
+    不影响其他来源出队。
+    准入控制：任务需要排队时，若队列已满、该用户排队任务过多或预计排队时间过长，则直接拒绝，
+    由调用方在扣费之前返回；管理员优先通道不受限制。
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int,
+        source_limits: dict[str, int] | None = None,
+        max_waiting: int = 0,
+        max_per_user: int = 0,
+        max_wait: float = 0,
+    ):
+        self.limit = max_concurrent
+        """并发上限"""
+        self.source_limits: dict[str, int] = {
+            source: limit for source, limit in (source_limits or {}).items() if limit > 0
+        }
+        """各来源最多占用的名额"""
+        self.max_waiting = max_waiting
+        """最多排队任务数，0 表示不限制"""
+        self.max_per_user = max_per_user
+        """单个用户最多排队任务数，0 表示不限制"""
+        self.max_wait = max_wait
+        """最长排队时间, 单位: 秒, 0 表示不限制"""
+        self.shed: Counter[str] = Counter()
+        """按原因统计的拒绝次数"""
+        self.cancelled = 0
+        """被用户取消的任务数"""
+        self._ids = itertools.count(1)
+        self._priority: deque[Job] = deque()
+        # group_id -> user_id -> 该用户的排队任务，字典顺序即轮转顺序
+        self._groups: OrderedDict[str, OrderedDict[str, deque[Job]]] = OrderedDict()
+        self._running: dict[int, Job] = {}
+        # 统计
+        self.total_jobs = 0
+        self.total_wait = 0.0
+
+    @property
+    def running(self) -> int:
+        return len(self._running)
+
+    @property
+    def used(self) -> int:
+        """运行中任务占用的名额数，已让出名额的任务不计入"""
+        return sum(job.weight for job in self._running.values() if not job.detached)
+
+    @property
+    def waiting(self) -> int:
+        return len(self._priority) + sum(
+            len(jobs) for users in self._groups.values() for jobs in users.values()
+        )
+
+    def set_limit(self, limit: int) -> None:
+        """调整并发上限，上调时立即唤醒排队任务；下调时不打断运行中的任务"""
+        self.limit = max(limit, 1)
+        self._dispatch()
+
+    def running_jobs(self) -> list[Job]:
+        return list(self._running.values())
+
+    def running_by_source(self, source: str) -> int:
+        return sum(
+            1
+            for job in self._running.values()
+            if job.source == source and not job.detached
+        )
+
+    def jobs_of(self, user_id: str) -> list[Job]:
+        """该用户运行中和排队中的任务"""
+        user_id = str(user_id)
+        return [
+            job
+            for job in self.running_jobs() + self.ordered()
+            if job.user_id == user_id
+        ]
+
+    def cancel(self, job: Job) -> bool:
+        """取消任务：排队中则移出队列，运行中则取消其生成任务，名额立即转给下一个排队任务
+
+        生成已完成、正在发送结果的任务无法取消，返回 False。
+        """
+        if job.cancelled or job.sending or (job.task is not None and job.task.done()):
+            return False
+        job.cancelled = True
+        self.cancelled += 1
+        if job.task is not None:
+            job.task.cancel()
+        # 排队中的任务会在 wait() 处收到 CancelledError
+        self.release(job)
+        return True
+
+    def queued_by_user(self, user_id: str) -> int:
+        """该用户排队中（未获得名额）的任务数"""
+        user_id = str(user_id)
+        return sum(1 for job in self._priority if job.user_id == user_id) + sum(
+            len(users.get(user_id, ())) for users in self._groups.values()
+        )
+
+    def admit(
+        self,
+        user_id: str,
+        group_id: str | None = None,
+        priority: bool = False,
+        source: str = SOURCE_COMMAND,
+        expected: float = 0.0,
+        weight: int = 1,
+    ) -> str | None:
+        """准入检查，不提交任务。允许时返回 None，拒绝时返回原因并计入统计"""
+        if priority:
+            return None
+        job = self._make_job(0, user_id, group_id, priority, source, expected, weight)
+        # 无需排队的任务直接放行
+        if not self.waiting and self._fits(job) and self._eligible(job):
+            return None
+        reason = None
+        if self.max_waiting and self.waiting >= self.max_waiting:
+            reason = SHED_QUEUE_FULL
+        elif self.max_per_user and self.queued_by_user(job.user_id) >= self.max_per_user:
+            reason = SHED_USER_LIMIT
+        elif self.max_wait and self._projected_start(job) > self.max_wait:
+            reason = SHED_WAIT_TOO_LONG
+        if reason:
+            self.shed[reason] += 1
+        return reason
+
+    def _projected_start(self, job: Job) -> float:
+        """把任务临时放入队列，按出队顺序估算其开始时间"""
+        self._enqueue(job)
+        try:
+            return self.forecast()[job.job_id][0]
+        finally:
+            self._remove(job)
+
+    def _eligible(self, job: Job) -> bool:
+        """任务来源是否还有剩余份额"""
+        limit = self.source_limits.get(job.source)
+        return limit is None or self.running_by_source(job.source) < limit
+
+    def _fits(self, job: Job) -> bool:
+        """剩余名额是否足够；占用名额超过并发上限的任务在没有其他任务运行时单独执行"""
+        used = self.used
+        return not used or used + job.weight <= self.limit
+
+    def submit(
+        self,
+        user_id: str,
+        group_id: str | None = None,
+        priority: bool = False,
+        source: str = SOURCE_COMMAND,
+        expected: float = 0.0,
+        weight: int = 1,
+    ) -> Job:
+        """提交任务，有空闲名额且无人排队时立即获得名额，否则进入队列"""
+        job = self._make_job(
+            next(self._ids), user_id, group_id, priority, source, expected, weight
+        )
+        job._granted = asyncio.get_running_loop().create_future()
+        self._enqueue(job)
+        self._dispatch()
+        return job
+
+    @staticmethod
+    def _make_job(
+        job_id: int,
+        user_id: str,
+        group_id: str | None,
+        priority: bool,
+        source: str,
+        expected: float,
+        weight: int = 1,
+    ) -> Job:
+        return Job(
+            job_id=job_id,
+            user_id=str(user_id),
+            group_id=str(group_id or f"private:{user_id}"),
+            priority=priority,
+            source=source,
+            expected=expected,
+            weight=max(weight, 1),
+        )
+
+    def _enqueue(self, job: Job) -> None:
+        if job.priority:
+            self._priority.append(job)
+        else:
+            users = self._groups.setdefault(job.group_id, OrderedDict())
+            users.setdefault(job.user_id, deque()).append(job)
+
+    async def wait(self, job: Job, timeout: float | None = None) -> None:
+        """等待任务获得名额
+
+        超过 timeout 仍未获得时记为排队超时并抛出 TimeoutError；被取消时抛出 CancelledError。
+        """
+        if job._granted is None:
+            return
+        try:
+            await asyncio.wait_for(asyncio.shield(job._granted), timeout)
+        except TimeoutError:
+            self.shed[SHED_WAIT_TIMEOUT] += 1
+            raise
+        # 获得名额后、恢复执行前被取消
+        if job.cancelled:
+            raise asyncio.CancelledError
+
+    def detach(self, job: Job) -> None:
+        """运行中的任务暂时不需要名额时（如合并等待其他任务的结果）提前归还名额
+
+        任务仍保留在运行列表中，可被查看和取消，结束时照常调用 release。
+        """
+        if job.detached or self._running.get(job.job_id) is not job:
+            return
+        job.detached = True
+        if job._detached is not None and not job._detached.done():
+            job._detached.set_result(None)
+        self._dispatch()
+
+    def release(self, job: Job) -> None:
+        """任务结束或取消：运行中则归还名额，排队中则移出队列"""
+        if self._running.pop(job.job_id, None) is None:
+            self._remove(job)
+        if job._granted is not None and not job._granted.done():
+            job._granted.cancel()
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(
+        self,
+        user_id: str,
+        group_id: str | None = None,
+        priority: bool = False,
+        source: str = SOURCE_COMMAND,
+        expected: float = 0.0,
+        weight: int = 1,
+    ) -> AsyncIterator[Job]:
+        """提交任务并等待名额，退出时自动归还"""
+        job = self.submit(
+            user_id,
+            group_id,
+            priority=priority,
+            source=source,
+            expected=expected,
+            weight=weight,
+        )
+        try:
+            await self.wait(job)
+            yield job
+        finally:
+            self.release(job)
+
+    def position(self, job: Job) -> int:
+        """任务在队列中的实际位置（从 1 开始），已获得名额时返回 0"""
+        if job.running:
+            return 0
+        for index, queued in enumerate(self.ordered(), start=1):
+            if queued is job:
+                return index
+        return 0
+
+    def ordered(self) -> list[Job]:
+        """按出队顺序列出所有排队任务（假设此后没有新任务加入，不考虑来源份额）"""
+        order = list(self._priority)
+        groups = [
+            [deque(jobs) for jobs in users.values()] for users in self._groups.values()
+        ]
+        while groups:
+            for users in groups:
+                jobs = users.pop(0)
+                order.append(jobs.popleft())
+                if jobs:
+                    users.append(jobs)
+            groups = [users for users in groups if users]
+        return order
+
+    def forecast(self) -> dict[int, tuple[float, float]]:
+        """估算每个任务距现在的开始和完成时间（秒），返回 {job_id: (开始, 完成)}
+
+        运行中任务的剩余耗时按预计耗时减去已运行时间计算；排队任务按出队顺序依次
+        占用最早空出的名额（占用多个名额的任务等到足够的名额都空出）。
+        与 ordered() 一样不考虑之后加入的任务和来源份额。
+        """
+        now = time.monotonic()
+        result: dict[int, tuple[float, float]] = {}
+        slots: list[float] = []
+        for job in self._running.values():
+            remaining = max(job.expected - (now - job.started_at), 0.0)
+            result[job.job_id] = (0.0, remaining)
+            if not job.detached:
+                slots.extend([remaining] * job.weight)
+        slots.sort()
+        if len(slots) > self.limit:
+            # 并发上限被下调时，需等多出的任务结束后才会空出名额
+            slots = slots[len(slots) - self.limit :]
+        slots.extend([0.0] * (self.limit - len(slots)))
+        heapq.heapify(slots)
+        for job in self.ordered():
+            weight = min(job.weight, self.limit)
+            start = max(heapq.heappop(slots) for _ in range(weight))
+            finish = start + job.expected
+            result[job.job_id] = (start, finish)
+            for _ in range(weight):
+                heapq.heappush(slots, finish)
+        return result
+
+    def _pop_next(self) -> Job | None:
+        """取出下一个可运行的任务，并轮转群聊和用户顺序；来源份额已满的任务跳过
+
+        轮到的任务剩余名额不足时不再向后查找，避免占用多个名额的任务被后面的任务饿死。
+        """
+        for job in self._priority:
+            if self._eligible(job):
+                if not self._fits(job):
+                    return None
+                self._priority.remove(job)
+                return job
+        for group_id, users in self._groups.items():
+            for user_id, jobs in users.items():
+                job = jobs[0]
+                if not self._eligible(job):
+                    continue
+                if not self._fits(job):
+                    return None
+                jobs.popleft()
+                # 本轮已出队的用户和群聊移到末尾
+                del users[user_id]
+                if jobs:
+                    users[user_id] = jobs
+                del self._groups[group_id]
+                if users:
+                    self._groups[group_id] = users
+                return job
+        return None
+
+    def _remove(self, job: Job) -> None:
+        if job.priority:
+            if job in self._priority:
+                self._priority.remove(job)
+            return
+        users = self._groups.get(job.group_id)
+        if not users or job.user_id not in users:
+            return
+        jobs = users[job.user_id]
+        if job in jobs:
+            jobs.remove(job)
+        if not jobs:
+            del users[job.user_id]
+        if not users:
+            del self._groups[job.group_id]
+
+    def _dispatch(self) -> None:
+        """有空闲名额时按公平顺序唤醒排队任务"""
+        while True:
+            job = self._pop_next()
+            if job is None:
+                return
+            job.started_at = time.monotonic()
+            self._running[job.job_id] = job
+            self.total_jobs += 1
+            self.total_wait += job.started_at - job.enqueued_at
+            if job._granted is not None and not job._granted.done():
+                job._granted.set_result(None)
@@ -0,0 +1,74 @@
+import asyncio
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+from typing import Any
+
+
+@dataclass(slots=True)
+class _Call:
+    """进行中的共享请求"""
+
+    task: asyncio.Future
+    """共享任务"""
+    waiters: int = 1
+    """等待者数量"""
+
+
+class SingleFlight:
+    """合并相同的进行中请求
+
+    相同 key 的请求在第一个请求完成前到达时，不再重复执行，而是等待并共享第一个请求的结果。
+    所有等待者都被取消时，才会取消共享的任务。
+    """
+
+    def __init__(self):
+        self._calls: dict[str, _Call] = {}
+        # 统计
+        self.requests = 0
+        self.coalesced = 0
+
+    @property
+    def coalesce_rate(self) -> float:
+        return self.coalesced / self.requests if self.requests else 0.0
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    async def do(
+        self,
+        key: str,
+        fn: Callable[[], Awaitable[Any]],
+        on_join: Callable[[], None] | None = None,
+    ) -> tuple[Any, bool]:
+        """执行或加入相同 key 的请求，返回 (结果, 是否为合并的请求)
+
+        Args:
+            on_join: 加入已有请求、开始等待其结果前调用，可用于提前归还并发名额
+        """
+        self.requests += 1
+        call = self._calls.get(key)
+        coalesced = call is not None
+        if coalesced:
+            self.coalesced += 1
+            call.waiters += 1
+            if on_join is not None:
+                on_join()
+        else:
+            call = _Call(asyncio.ensure_future(fn()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+        try:
+            # 屏蔽取消，避免单个等待者被取消时影响其他等待者
+            return await asyncio.shield(call.task), coalesced
+        except asyncio.CancelledError:
+            call.waiters -= 1
+            if call.waiters <= 0:
+                # 先移除，避免之后到达的请求加入正在取消的任务
+                self._forget(key, call)
+                call.task.cancel()
+            raise
+
+    def _forget(self, key: str, call: _Call) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
@@ -0,0 +1,54 @@
+class SSEParser:
+    """增量 SSE 解析器
+
+    按网络分块喂入字节，每凑齐一行 `data:` 就立即产出其负载（bytes，可直接交给 json.loads），
+    无需等待整个流结束再统一解码。为兼容部分提供商不以空行分隔事件的写法，每个 data 行单独产出。
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        # 已扫描过、确认不含换行符的位置，避免超长行（如图片数据）被反复从头扫描
+        self._scan_pos = 0
+        self.received_bytes = 0
+        """已接收的字节总数"""
+
+    def feed(self, chunk: bytes) -> list[bytes]:
+        """喂入一个数据块，返回其中已完整的 data 负载列表"""
+        self.received_bytes += len(chunk)
+        self._buffer.extend(chunk)
+        payloads: list[bytes] = []
+        start = 0
+        while True:
+            idx = self._buffer.find(b"\n", max(start, self._scan_pos))
+            if idx < 0:
+                break
+            payload = self._parse_line(memoryview(self._buffer)[start:idx])
+            if payload is not None:
+                payloads.append(payload)
+            start = idx + 1
+        if start:
+            del self._buffer[:start]
+        self._scan_pos = len(self._buffer)
+        return payloads
+
+    def flush(self) -> list[bytes]:
+        """流结束时处理缓冲区中没有换行结尾的最后一行"""
+        if not self._buffer:
+            return []
+        payload = self._parse_line(memoryview(self._buffer))
+        self._buffer.clear()
+        self._scan_pos = 0
+        return [payload] if payload is not None else []
+
+    @staticmethod
+    def _parse_line(line: memoryview) -> bytes | None:
+        """解析单行，非 data 字段、注释和空行返回 None"""
+        if line[-1:] == b"\r":
+            line = line[:-1]
+        if line[:5] != b"data:":
+            return None
+        line = line[5:]
+        if line[:1] == b" ":
+            line = line[1:]
+        payload = bytes(line).strip()
+        return payload or None
@@ -0,0 +1,49 @@
+from collections import deque
+from dataclasses import dataclass
+
+
+class LatencyTracker:
+    """滚动窗口耗时统计，记录最近 window 次成功请求的耗时"""
+
+    def __init__(self, window: int = 100):
+        self._samples: deque[float] = deque(maxlen=window)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def add(self, seconds: float) -> None:
+        """记录一次耗时"""
+        self._samples.append(seconds)
+
+    def percentile(self, p: float) -> float | None:
+        """第 p 百分位耗时（最近邻法），样本为空时返回 None"""
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        index = min(int(len(ordered) * p / 100), len(ordered) - 1)
+        return ordered[index]
+
+    def mean_above(self, threshold: float) -> float | None:
+        """耗时超过 threshold 的样本均值，用于估计慢请求的剩余耗时"""
+        slow = [s for s in self._samples if s > threshold]
+        if not slow:
+            return None
+        return sum(slow) / len(slow)
+
+
+@dataclass(slots=True)
+class HedgeStats:
+    """对冲请求统计"""
+
+    requests: int = 0
+    """经过调度器的请求数"""
+    hedged: int = 0
+    """发出对冲请求的次数"""
+    hedge_wins: int = 0
+    """对冲请求先返回结果的次数"""
+    saved_seconds: float = 0.0
+    """估算节省的总耗时, 单位: 秒"""
+
+    @property
+    def hedge_rate(self) -> float:
+        return self.hedged / self.requests if self.requests else 0.0
@@ -1,44 +1,56 @@
-import base64
 import mimetypes
+import time
 from datetime import datetime
+from email.utils import parsedate_to_datetime
 from pathlib import Path
 
 from astrbot.api import logger
 
+from .data import ImageData
 
-def get_key_index(current_index: int, item_len: int) -> int:
-    """获取key索引"""
-    return (current_index + 1) % item_len
+
+def parse_retry_after(value: str | None) -> float | None:
+    """解析 Retry-After 响应头（秒数或 HTTP 日期），返回需要等待的秒数"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(retry_at.timestamp() - time.time(), 0.0)
 
 
-def save_images(image_result: list[tuple[str, str]], path_dir: Path) -> list[tuple[str, Path]]:
+def save_images(image_result: list[ImageData], path_dir: Path) -> list[tuple[str, Path]]:
     """保存图片到本地文件系统，返回 元组(文件名, 文件路径) 列表"""
     # 假设它支持返回多张图片
     saved_paths: list[tuple[str, Path]] = []
-    for mime, b64 in image_result:
-        if not b64:
+    for image in image_result:
+        if not image.data:
             continue
         # 构建文件名
         now = datetime.now()
         current_time_str = (
             now.strftime("%Y%m%d%H%M%S") + f"{int(now.microsecond / 1000):03d}"
         )
-        ext = mimetypes.guess_extension(mime) or ".jpg"
+        ext = mimetypes.guess_extension(image.mime) or ".jpg"
         file_name = f"banana_{current_time_str}{ext}"
         # 构建文件保存路径
         save_path = path_dir / file_name
-        # 转换成bytes
-        image_bytes = base64.b64decode(b64)
-        # 保存到文件系统
+        # 直接写入原始字节，无需 Base64 解码
         with open(save_path, "wb") as f:
-            f.write(image_bytes)
+            f.write(image.data)
         saved_paths.append((file_name, save_path))
         logger.info(f"[BIG BANANA] 图片已保存到 {save_path}")
     return saved_paths
 
 
-def read_file(path, allowed_dir=None) -> tuple[str | None, str | None]:
-    """读取文件并返回 (mime_type, base64_data)
+def read_file(path, allowed_dir=None) -> ImageData | None:
+    """读取图片文件，失败返回 None
 
     Args:
         path: 文件路径
@@ -51,22 +63,23 @@ def read_file(path, allowed_dir=None) -> tuple[str | None, str | None]:
             allowed_resolved = Path(allowed_dir).resolve()
             if not str(resolved_path).startswith(str(allowed_resolved)):
                 logger.warning(f"[BIG BANANA] 路径穿越尝试被阻止: {path}")
-                return None, None
+                return None
 
         # 检查文件名是否包含危险字符
         filename = resolved_path.name
         if ".." in filename or filename.startswith("/"):
             logger.warning(f"[BIG BANANA] 不安全的文件名: {filename}")
-            return None, None
+            return None
 
+        mime_type, _ = mimetypes.guess_type(str(resolved_path))
+        if not mime_type:
+            logger.warning(f"[BIG BANANA] 无法识别参考图片类型: {filename}")
+            return None
         with open(resolved_path, "rb") as f:
-            file_data = f.read()
-            mime_type, _ = mimetypes.guess_type(str(resolved_path))
-            b64_data = base64.b64encode(file_data).decode("utf-8")
-            return mime_type, b64_data
+            return ImageData(mime_type, f.read())
     except Exception as e:
         logger.error(f"[BIG BANANA] 读取参考图片 {path} 失败: {e}")
-        return None, None
+        return None
 
 
 def clear_cache(temp_dir: Path):
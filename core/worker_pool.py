@@ -0,0 +1,207 @@
+import asyncio
+import time
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass, field
+
+from astrbot.api import logger
+
+from .scheduler import SHED_WAIT_TIMEOUT, FairScheduler, Job
+
+# 任务未执行即离开队列的原因
+DROP_CANCELLED = "cancelled"
+"""被用户取消"""
+DROP_WAIT_TIMEOUT = SHED_WAIT_TIMEOUT
+"""排队超时"""
+
+
+@dataclass(slots=True, eq=False)
+class WorkItem:
+    """交给工作池执行的任务"""
+
+    job: Job
+    """调度器中的任务"""
+    run: Callable[[], Awaitable[None]]
+    """获得名额后由工作协程执行，负责下载、生成、后处理和发送结果"""
+    abort: Callable[[str], Awaitable[None]]
+    """未执行即离开队列时调用（参数为原因），负责退款和通知"""
+    reason: str = DROP_CANCELLED
+    """离开队列的原因"""
+    _timer: asyncio.TimerHandle | None = field(default=None, repr=False)
+
+
+class WorkerPool:
+    """画图任务工作池
+
+    消息处理器只负责受理：提交任务后立即返回，不再在事件处理流程中等待生成完成。
+    调度器按公平顺序分配名额，获得名额的任务进入就绪队列，由 N 个常驻工作协程取出执行，
+    结果通过 event.send 或平台上下文发送。
+    支持平滑排空：停止受理新任务，等待已受理的任务完成；之后可重新启动。
+    """
+
+    def __init__(self, scheduler: FairScheduler, workers: int):
+        self.scheduler = scheduler
+        self.size = max(workers, 1)
+        """工作协程数量，应不小于调度器的最大并发上限"""
+        self.accepting = False
+        """是否受理新任务"""
+        self._ready: asyncio.Queue[WorkItem] = asyncio.Queue()
+        self._items: set[WorkItem] = set()
+        self._workers: list[asyncio.Task] = []
+        self._idle = asyncio.Event()
+        self._idle.set()
+        # 统计
+        self.completed = 0
+        self.dropped = 0
+
+    @property
+    def pending(self) -> int:
+        """已受理、尚未结束的任务数（排队中 + 执行中）"""
+        return len(self._items)
+
+    @property
+    def busy(self) -> int:
+        """正在执行任务的工作协程数，已让出名额的任务不占用工作协程"""
+        return sum(
+            1
+            for item in self._items
+            if item.job.task is not None and not item.job.detached
+        )
+
+    def start(self) -> None:
+        """启动工作协程并开始受理任务"""
+        self._workers = [w for w in self._workers if not w.done()]
+        for index in range(len(self._workers), self.size):
+            self._workers.append(asyncio.create_task(self._worker(index)))
+        self.accepting = True
+
+    def submit(
+        self,
+        job: Job,
+        run: Callable[[], Awaitable[None]],
+        abort: Callable[[str], Awaitable[None]],
+        timeout: float | None = None,
+    ) -> WorkItem:
+        """登记已提交到调度器的任务，超过 timeout 仍未获得名额时移出队列"""
+        item = WorkItem(job, run, abort)
+        self._items.add(item)
+        self._idle.clear()
+        if job._granted is not None:
+            job._granted.add_done_callback(lambda fut: self._on_granted(item, fut))
+        if timeout and not job.running:
+            item._timer = asyncio.get_running_loop().call_later(
+                timeout, self._expire, item
+            )
+        return item
+
+    def _on_granted(self, item: WorkItem, fut: asyncio.Future) -> None:
+        if item._timer is not None:
+            item._timer.cancel()
+        if fut.cancelled() or item.job.cancelled:
+            # 排队中被取消或超时：名额已归还，交给 abort 处理退款
+            asyncio.create_task(self._drop(item))
+        else:
+            self._ready.put_nowait(item)
+
+    def _expire(self, item: WorkItem) -> None:
+        if item.job.running or item.job.cancelled:
+            return
+        item.reason = DROP_WAIT_TIMEOUT
+        self.scheduler.shed[SHED_WAIT_TIMEOUT] += 1
+        self.scheduler.release(item.job)
+
+    async def _drop(self, item: WorkItem) -> None:
+        self.dropped += 1
+        try:
+            await item.abort(item.reason)
+        except Exception as e:
+            logger.error(f"[BananaSign] 处理离队任务失败: {e}", exc_info=True)
+        finally:
+            self._finish(item)
+
+    def _finish(self, item: WorkItem) -> None:
+        self._items.discard(item)
+        if not self._items:
+            self._idle.set()
+
+    def _record(self, item: WorkItem, index: int | str, start: float) -> None:
+        """记录任务执行结果"""
+        job = item.job
+        if not job.task.cancelled() and job.task.exception() is not None:
+            logger.error(
+                f"[BananaSign] 工作协程 {index} 执行任务出错: {job.task.exception()}"
+            )
+        self.completed += 1
+        logger.debug(
+            f"[BananaSign] 工作协程 {index} 完成任务 #{job.job_id}，耗时 {time.monotonic() - start:.2f}s"
+        )
+
+    def _on_detached_done(self, item: WorkItem, start: float) -> None:
+        """已让出名额的任务结束：记录结果、归还名额并移出工作池"""
+        try:
+            self._record(item, "-", start)
+        finally:
+            self.scheduler.release(item.job)
+            self._finish(item)
+
+    async def _worker(self, index: int) -> None:
+        while True:
+            item = await self._ready.get()
+            job = item.job
+            start = time.monotonic()
+            handed_off = False
+            try:
+                # 获得名额后、开始执行前被取消
+                if job.cancelled:
+                    await self._drop(item)
+                    continue
+                job._detached = asyncio.get_running_loop().create_future()
+                job.task = asyncio.create_task(item.run())
+                try:
+                    # asyncio.wait 不会因任务被取消而抛出异常，工作协程自身被取消时才会中断
+                    await asyncio.wait(
+                        [job.task, job._detached], return_when=asyncio.FIRST_COMPLETED
+                    )
+                except asyncio.CancelledError:
+                    job.task.cancel()
+                    raise
+                if not job.task.done():
+                    # 任务已让出名额（合并等待其他任务的结果），由完成回调收尾，
+                    # 工作协程转去执行下一个获得名额的任务
+                    handed_off = True
+                    job.task.add_done_callback(
+                        lambda _, item=item, start=start: self._on_detached_done(
+                            item, start
+                        )
+                    )
+                    continue
+                self._record(item, index, start)
+            finally:
+                if not handed_off:
+                    self.scheduler.release(job)
+                    self._finish(item)
+                self._ready.task_done()
+
+    async def drain(self, timeout: float | None = None) -> bool:
+        """停止受理新任务并等待已受理的任务结束，返回是否在 timeout 内全部完成"""
+        self.accepting = False
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return True
+        except TimeoutError:
+            return False
+
+    async def stop(self) -> None:
+        """停止工作协程，执行中的任务随之取消"""
+        self.accepting = False
+        for worker in self._workers:
+            worker.cancel()
+        # 已让出名额的任务不在工作协程中等待，需单独取消
+        detached = [
+            item.job.task
+            for item in self._items
+            if item.job.detached and item.job.task is not None
+        ]
+        for task in detached:
+            task.cancel()
+        await asyncio.gather(*self._workers, *detached, return_exceptions=True)
+        self._workers.clear()
@@ -1,12 +1,15 @@
 import asyncio
-import base64
-import binascii
+import functools
+import hashlib
 import itertools
 import os
 import json
+import math
 import random
 import re
 import threading
+import time
+from collections.abc import Awaitable, Callable
 from io import BytesIO
 from datetime import datetime, date
 from typing import Dict, Any
@@ -25,12 +28,32 @@ from .core import BaseProvider, Downloader, HttpManager
 from .core.data import (
     SUPPORTED_FILE_FORMATS_WITH_DOT,
     CommonConfig,
+    ImageData,
     PreferenceConfig,
     PromptConfig,
     ProviderConfig,
 )
+from .core.deadline import Deadline
+from .core.eta import DurationModel
+from .core.journal import KIND_DRAW, KIND_LINEART, JobJournal, JournalEntry
+from .core.limiter import AIMDLimiter
 from .core.llm_tools import BigBananaPromptTool, BigBananaTool, remove_tools
-from .core.utils import clear_cache, read_file, save_images
+from .core.pipeline import Pipeline, PipelineResult, Stage
+from .core.refer_cache import ReferImageCache
+from .core.scheduler import (
+    SHED_QUEUE_FULL,
+    SHED_USER_LIMIT,
+    SHED_WAIT_TIMEOUT,
+    SHED_WAIT_TOO_LONG,
+    SOURCE_LINEART,
+    SOURCE_LLM_TOOL,
+    FairScheduler,
+    Job,
+)
+from .core.singleflight import SingleFlight
+from .core.stats import HedgeStats
+from .core.utils import clear_cache, save_images
+from .core.worker_pool import WorkerPool
 
 # 提示词参数列表
 PARAMS_LIST = [
@@ -43,15 +66,20 @@ PARAMS_LIST = [
     "preset_append",
     "gather_mode",
     "providers",
+    "count",
 ]
 
 # 提供商配置键列表
 provider_list = ["main_provider", "back_provider", "back_provider2"]
 
+# 单次请求最多生成的候选图片数量
+MAX_IMAGE_COUNT = 4
+# 排空期间的提示
+DRAINING_MSG = "🚧 画图服务维护中，暂停受理新任务，请稍后再试"
+# /画图队列 最多列出的任务数量
+QUEUE_VIEW_LIMIT = 10
 # 部分平台对单张图片大小有限制，超过限制需要作为文件发送
 MAX_SIZE_BYTES = 10 * 1024 * 1024  # 10MB
-# 预计算 Base64 长度阈值 (向下取整)，base64编码约为原始数据的4/3倍
-MAX_SIZE_B64_LEN = int(MAX_SIZE_BYTES * 4 / 3)
 # 表情网格: 6列×4行 = 24个表情
 EMOJI_GRID_COLS = 6
 EMOJI_GRID_ROWS = 4
@@ -95,12 +123,35 @@ class BananaSign(Star):
         self.max_concurrent = sign_config.get("max_concurrent", 3)
 
         # ========== 队列系统初始化 ==========
-        # 并发控制信号量
-        self._semaphore: asyncio.Semaphore | None = None
-        # 当前队列中等待的任务数
-        self._queue_waiting = 0
-        # 队列锁
-        self._queue_lock = asyncio.Lock()
+        # LLM 函数工具最多占用的并发名额（0 表示与触发词画图共享全部名额）
+        self.llm_tool_max_concurrent = self.conf.get("llm_tool_settings", {}).get(
+            "llm_tool_max_concurrent", 1
+        )
+        # 公平调度器，取代信号量和等待计数
+        self.scheduler = FairScheduler(
+            self.max_concurrent,
+            source_limits={SOURCE_LLM_TOOL: self.llm_tool_max_concurrent},
+            max_waiting=sign_config.get("max_queue_depth", 0),
+            max_per_user=sign_config.get("max_user_queued", 0),
+            max_wait=sign_config.get("max_queue_wait", 0),
+        )
+        # 自适应并发控制：根据提供商反馈在上下限之间调整调度器的并发上限
+        self.limiter: AIMDLimiter | None = None
+        if sign_config.get("adaptive_concurrency", False):
+            self.limiter = AIMDLimiter(
+                initial=self.max_concurrent,
+                min_limit=sign_config.get("min_concurrent", 1),
+                max_limit=sign_config.get("max_concurrent_limit", 8),
+                on_change=self._on_limit_change,
+            )
+            self.scheduler.set_limit(self.limiter.limit)
+        # 工作池：处理器只负责受理，生成由常驻工作协程执行；数量覆盖并发上限的最大值
+        self.worker_pool = WorkerPool(
+            self.scheduler,
+            max(self.max_concurrent, self.limiter.max_limit if self.limiter else 0),
+        )
+        # 卸载插件时等待已受理任务完成的最长时间，未完成的任务保留在任务日志中
+        self.drain_timeout = sign_config.get("drain_timeout", 30)
 
         # ========== 画图功能初始化 ==========
         # 初始化常规配置和图片生成配置
@@ -143,8 +194,18 @@ class BananaSign(Star):
         # 图片持久化
         self.save_images = self.conf.get("save_images", {}).get("local_save", False)
 
-        # 正在运行的任务映射
-        self.running_tasks: dict[str, asyncio.Task] = {}
+        # 对冲请求统计
+        self.hedge_stats = HedgeStats()
+        # 相同请求合并
+        self.singleflight = SingleFlight()
+        # 按提供商和分辨率统计的耗时模型，用于估算排队时间
+        self.durations = DurationModel()
+        # 已受理任务日志，重启后恢复执行或退款
+        self.journal_enabled = sign_config.get("journal_enabled", True)
+        self.journal_resume_window = sign_config.get("journal_resume_window", 1800)
+        self.journal = JobJournal(data_dir / "job_journal.json")
+        # 插件卸载中：此时被取消的任务保留在日志中，留待重启后处理
+        self._terminating = False
 
         # 用户资源锁（防止并发扣费）
         self.user_locks: dict[str, asyncio.Lock] = {}
@@ -219,6 +280,196 @@ class BananaSign(Star):
             return True
         return False
 
+    def _on_limit_change(self, limit: int) -> None:
+        """自适应并发上限变化时同步到调度器"""
+        logger.info(f"[BananaSign] 自适应并发上限调整为 {limit}")
+        self.scheduler.set_limit(limit)
+
+    def estimate_duration(self, params: dict) -> float:
+        """按请求使用的提供商和分辨率估算生成耗时, 单位: 秒"""
+        providers = params.get("providers", self.def_enabled_providers)
+        if isinstance(providers, str):
+            providers = providers.split(",")
+        return self.durations.estimate(
+            providers, params.get("image_size", self.prompt_config.image_size)
+        )
+
+    @staticmethod
+    def _format_eta(seconds: float) -> str:
+        """把秒数格式化为“约 N 秒/分钟”"""
+        if seconds < 60:
+            return f"约 {max(int(seconds), 1)} 秒"
+        return f"约 {math.ceil(seconds / 60)} 分钟"
+
+    def shed_message(self, reason: str) -> str:
+        """准入控制拒绝原因对应的提示"""
+        if reason == SHED_QUEUE_FULL:
+            return f"当前排队人数已满（{self.scheduler.max_waiting} 个任务），请稍后再试"
+        if reason == SHED_USER_LIMIT:
+            return f"您已有 {self.scheduler.max_per_user} 个任务在排队，请等待完成后再提交"
+        if reason == SHED_WAIT_TIMEOUT:
+            return "排队时间过长，任务已取消，预扣费用已退还，请稍后再试"
+        return f"当前队列繁忙，预计需排队{self._format_eta(self.scheduler.max_wait)}以上，请稍后再试"
+
+    async def _on_job_cancelled(
+        self, event: AstrMessageEvent, user_id: str | None, draws: int
+    ) -> list:
+        """任务被用户取消：退还预扣费用，返回回复消息链"""
+        logger.info(f"[BananaSign] 用户 {event.get_sender_id()} 取消了画图任务")
+        if user_id is not None:
+            await self.refund_draws(user_id, draws)
+        return [
+            Comp.Reply(id=event.message_obj.message_id),
+            Comp.Plain(
+                "🛑 画图任务已取消"
+                + ("，预扣费用已退还" if user_id is not None else "")
+            ),
+        ]
+
+    async def _journal_add(
+        self,
+        event: AstrMessageEvent,
+        params: dict,
+        image_urls: list[str],
+        user_id: str | None,
+        draws: int,
+        kind: str = KIND_DRAW,
+    ) -> JournalEntry | None:
+        """把已受理（已预扣）的任务写入任务日志"""
+        if not self.journal_enabled:
+            return None
+        return await self.journal.add(
+            JournalEntry(
+                origin=event.unified_msg_origin,
+                sender_id=str(event.get_sender_id()),
+                group_id=event.get_group_id() or None,
+                message_id=str(event.message_obj.message_id),
+                params=params,
+                image_urls=image_urls,
+                user_id=user_id,
+                draws=draws,
+                kind=kind,
+            )
+        )
+
+    async def _journal_remove(self, entry: JournalEntry | None) -> None:
+        """任务结束后移出任务日志；插件卸载导致的中断保留记录"""
+        if entry is None or self._terminating:
+            return
+        await self.journal.remove(entry)
+
+    async def _recover_journal(self) -> None:
+        """处理上次运行中断的任务：受理时间在恢复窗口内的画图任务重新执行，其余退款"""
+        entries = self.journal.load()
+        if not entries:
+            return
+        logger.info(f"[BananaSign] 任务日志中有 {len(entries)} 个中断的任务")
+        now = time.time()
+        for entry in entries:
+            resumable = (
+                entry.kind == KIND_DRAW
+                and now - entry.accepted_at <= self.journal_resume_window
+            )
+            if resumable:
+                # 与新任务一样经工作池执行，排空和卸载时同样会等待
+                job = self.scheduler.submit(
+                    entry.sender_id,
+                    entry.group_id,
+                    priority=entry.user_id is None,
+                    expected=self.estimate_duration(entry.params),
+                    weight=entry.params.get("count", 1),
+                )
+                self.worker_pool.submit(
+                    job,
+                    run=functools.partial(self._resume_entry, entry, job),
+                    abort=functools.partial(self._abort_entry, entry),
+                )
+            else:
+                await self._refund_entry(entry, "任务因插件重启中断")
+
+    async def _refund_entry(self, entry: JournalEntry, reason: str) -> None:
+        """退还日志任务的预扣费用并通知用户"""
+        if entry.user_id is not None:
+            await self.refund_draws(entry.user_id, entry.draws)
+        refunded = "，预扣费用已退还" if entry.user_id is not None else ""
+        await self._send_to_origin(entry, [Comp.Plain(f"⚠️ {reason}{refunded}，请重新提交")])
+        await self.journal.remove(entry)
+
+    async def _send_to_origin(
+        self, entry: JournalEntry, chain: list[BaseMessageComponent]
+    ) -> None:
+        """向日志任务的原会话发送消息（引用原消息）"""
+        try:
+            await self.context.send_message(
+                entry.origin,
+                MessageChain([Comp.Reply(id=entry.message_id), *chain]),
+            )
+        except Exception as e:
+            logger.warning(f"[BananaSign] 发送消息到 {entry.origin} 失败: {e}")
+
+    async def _abort_entry(self, entry: JournalEntry, reason: str) -> None:
+        """恢复的任务未执行即被取消：退款并通知"""
+        await self._refund_entry(entry, "画图任务已取消")
+
+    async def _resume_entry(self, entry: JournalEntry, job: Job) -> None:
+        """工作协程重新执行重启前已受理的画图任务，结果发送到原会话"""
+        try:
+            logger.info(f"[BananaSign] 恢复用户 {entry.sender_id} 重启前的画图任务")
+            image_list, err, _ = await self._load_references(
+                entry.params, entry.image_urls
+            )
+            results = None
+            if not err:
+                results, err = await self._dispatch(
+                    params=entry.params,
+                    image_list=image_list,
+                    deadline=Deadline(self.common_config.job_timeout),
+                )
+            results = [image for image in (results or []) if image.data]
+            # 生成已结束，此后的退款和发送不可再被 /取消画图 打断
+            job.sending = True
+            if not results:
+                # 与正常流程一致，生成失败不退还
+                await self._send_to_origin(
+                    entry, [Comp.Plain(f"❌ {err or '图片生成失败：响应中未包含图片数据'}")]
+                )
+            else:
+                if self.save_images:
+                    save_images(results, self.save_dir)
+                if entry.user_id is not None and len(results) < entry.draws:
+                    await self.refund_draws(entry.user_id, entry.draws - len(results))
+                await self._send_to_origin(
+                    entry,
+                    [
+                        Comp.Plain("✅ 重启前提交的画图任务已完成"),
+                        *(Comp.Image.fromBase64(image.b64) for image in results),
+                    ],
+                )
+            await self.journal.remove(entry)
+        except asyncio.CancelledError:
+            if not job.cancelled:
+                raise
+            await self._refund_entry(entry, "画图任务已取消")
+        except Exception as e:
+            logger.error(f"[BananaSign] 恢复画图任务失败: {e}", exc_info=True)
+            if job.sending:
+                # 结果已处理，不再重复退款
+                await self.journal.remove(entry)
+            else:
+                await self._refund_entry(entry, "恢复重启前的画图任务失败")
+
+    async def refund_draws(self, user_id: str, draws: int):
+        """退还未交付图片的预扣香蕉和今日次数"""
+        async with self._get_user_lock(user_id):
+            user = self._get_user(user_id)
+            if self.consume_enabled:
+                user["bananas"] += self.cost_per_draw * draws
+                user["total_used"] -= self.cost_per_draw * draws
+            if self.max_daily_draws > 0:
+                user["daily_draws"] = max(user["daily_draws"] - draws, 0)
+            await self._save_sign_data_async()
+        logger.info(f"[BananaSign] 用户 {user_id} 退还 {draws} 张未交付图片的预扣费用")
+
     def add_banana(self, user_id: str, amount: int = 1):
         """添加香蕉积分"""
         user = self._get_user(user_id)
@@ -227,8 +478,6 @@ class BananaSign(Star):
 
     async def initialize(self):
         """可选择实现异步的插件初始化方法，当实例化该插件类之后会自动调用该方法。"""
-        # 初始化并发控制信号量
-        self._semaphore = asyncio.Semaphore(self.max_concurrent)
         logger.info(f"[BananaSign] 队列系统已初始化，最大并发数: {self.max_concurrent}")
 
         # 初始化文件目录
@@ -237,17 +486,46 @@ class BananaSign(Star):
         if self.save_images:
             os.makedirs(self.save_dir, exist_ok=True)
 
+        # 预设参考图片缓存
+        self.refer_cache = ReferImageCache(
+            self.refer_images_dir,
+            max_bytes=int(self.common_config.refer_cache_size_mb * 1024 * 1024),
+        )
+        if self.common_config.refer_cache_prewarm:
+            filenames = self._split_refer_images(self.prompt_config.refer_images)
+            for preset_params in self.prompt_dict.values():
+                filenames += self._split_refer_images(
+                    preset_params.get("refer_images")
+                )
+            if filenames:
+                await asyncio.to_thread(self.refer_cache.prewarm, filenames)
+
         # 实例化类
         self.preference_config = PreferenceConfig(
             **self.conf.get("preference_config", {})
         )
-        self.http_manager = HttpManager()
+        # 连接池需同时容纳模型请求和图片下载，启用自适应并发时按上限预留
+        max_concurrent = (
+            max(self.max_concurrent, self.limiter.max_limit)
+            if self.limiter
+            else self.max_concurrent
+        )
+        self.http_manager = HttpManager(
+            max_clients=max_concurrent + self.common_config.download_concurrency
+        )
         curl_session = self.http_manager._get_curl_session()
         self.downloader = Downloader(curl_session, self.common_config)
 
         # 注册提供商类型实例
         self.init_providers()
 
+        # 启动工作池
+        self.worker_pool.start()
+
+        # 恢复或退还上次运行中断的任务
+        if self.journal_enabled:
+            await self._recover_journal()
+
         # 检查配置是否启用函数调用工具
         if self.conf.get("llm_tool_settings", {}).get("llm_tool_enabled", False):
             self.context.add_llm_tools(BigBananaTool(plugin=self))
@@ -282,6 +560,7 @@ class BananaSign(Star):
                 prompt_config=self.prompt_config,
                 session=self.http_manager._get_curl_session(),
                 downloader=self.downloader,
+                feedback=self.limiter.record if self.limiter else None,
             )
             # 将启用的提供商加入默认提供商列表中
             if provider.get("enabled", False):
@@ -302,7 +581,8 @@ class BananaSign(Star):
         # 预设提示词列表
         self.prompt_list = self.conf.get("prompt", [])
         self.prompt_dict = {}
-        self.params_alias_map = {}
+        # 内置 -n 短参数，可被配置覆盖
+        self.params_alias_map = {"n": "count"}
         # 处理参数别名映射
         for item in self.params_alias:
             alias, _, param = item.partition(":")
@@ -411,6 +691,15 @@ class BananaSign(Star):
         params["prompt"] = prompt
         return cmd_list, params
 
+    @staticmethod
+    def _normalize_count(value) -> int:
+        """规范化候选图片数量参数，限制在 1 ~ MAX_IMAGE_COUNT"""
+        try:
+            count = int(value)
+        except (TypeError, ValueError):
+            return 1
+        return min(max(count, 1), MAX_IMAGE_COUNT)
+
     # === 辅助功能：判断管理员，用于静默跳出 ===
     def is_global_admin(self, event: AstrMessageEvent) -> bool:
         """检查发送者是否为全局管理员"""
@@ -719,10 +1008,63 @@ class BananaSign(Star):
         if cmd not in self.prompt_dict:
             return
 
+        # 获取提示词配置 (使用 .copy() 防止修改污染全局预设)
+        params = self.prompt_dict.get(cmd, {}).copy()
+        # 先从预设提示词参数字典字典中取出提示词
+        preset_prompt = params.get("prompt", "{{user_text}}")
+
+        # 处理预设提示词补充参数preset_append
+        if (
+            params.get("preset_append", self.common_config.preset_append)
+            and "{{user_text}}" not in preset_prompt
+        ):
+            preset_prompt += " {{user_text}}"
+
+        # 检查预设提示词中是否包含动态参数占位符
+        if "{{user_text}}" in preset_prompt:
+            # 存在动态参数，解析用户消息
+            _, user_params = self.parsing_prompt_params(message_str)
+            # 将用户参数差分覆盖预设参数
+            params.update(user_params)
+            # 解析到用户的提示词和配置参数
+            user_prompt = user_params.get("prompt", "anything").strip()
+            # 替换占位符，更新提示词
+            new_prompt = preset_prompt.replace("{{user_text}}", user_prompt)
+            params["prompt"] = new_prompt
+
+        # 候选图片数量，按张计费
+        count = self._normalize_count(params.get("count", 1))
+        params["count"] = count
+        cost = self.cost_per_draw * count
+        # 表情化只使用一张原图切图，多余的候选图片无法交付
+        if cmd == "表情化" and count > 1:
+            yield event.plain_result("🎨 表情化每次只生成一张图片，不支持 -n 参数")
+            return
+
         # ========== 积分检查与预扣（管理员跳过，使用锁保护）==========
         is_admin = self.is_global_admin(event)
         logger.debug(f"[BananaSign] 用户 {event.get_sender_id()} 管理员状态: {is_admin}")
 
+        # 排空期间暂停受理新任务
+        if not self.worker_pool.accepting:
+            yield event.plain_result(DRAINING_MSG)
+            return
+
+        # 准入控制：队列过载时在预扣之前直接拒绝，无需退款
+        shed_reason = self.scheduler.admit(
+            str(event.get_sender_id()),
+            event.get_group_id(),
+            priority=is_admin,
+            expected=self.estimate_duration(params),
+            weight=count,
+        )
+        if shed_reason:
+            logger.info(
+                f"[BananaSign] 用户 {event.get_sender_id()} 的请求被准入控制拒绝: {shed_reason}"
+            )
+            yield event.plain_result(f"🚦 {self.shed_message(shed_reason)}")
+            return
+
         # 非管理员需要预扣费和检查限制
         if not is_admin:
             user_id = str(event.get_sender_id())
@@ -739,19 +1081,19 @@ class BananaSign(Star):
                     user["last_draw_date"] = today
 
                 # 检查香蕉余额
-                if self.consume_enabled and user["bananas"] < self.cost_per_draw:
+                if self.consume_enabled and user["bananas"] < cost:
                     yield event.plain_result(
                         f"🍌 香蕉不足！\n"
                         f"━━━━━━━━━━━━━━━\n"
                         f"当前余额: {user['bananas']} 香蕉\n"
-                        f"画图需要: {self.cost_per_draw} 香蕉\n"
+                        f"画图需要: {cost} 香蕉\n"
                         f"━━━━━━━━━━━━━━━\n"
                         f"💡 使用 /签到 获取香蕉"
                     )
                     return
 
                 # 检查每日生成次数
-                if self.max_daily_draws > 0 and user["daily_draws"] >= self.max_daily_draws:
+                if self.max_daily_draws > 0 and user["daily_draws"] + count > self.max_daily_draws:
                     yield event.plain_result(
                         f"🎨 今日生成次数已达上限！\n"
                         f"━━━━━━━━━━━━━━━\n"
@@ -764,39 +1106,15 @@ class BananaSign(Star):
 
                 # 预扣费用和计数（失败时需要回滚）
                 if self.consume_enabled:
-                    user["bananas"] -= self.cost_per_draw
-                    user["total_used"] += self.cost_per_draw
+                    user["bananas"] -= cost
+                    user["total_used"] += cost
                 if self.max_daily_draws > 0:
-                    user["daily_draws"] += 1
+                    user["daily_draws"] += count
                 await self._save_sign_data_async()
-                logger.info(f"[BananaSign] 用户 {user_id} 预扣 {self.cost_per_draw} 香蕉，今日次数 {user['daily_draws']}/{self.max_daily_draws}")
+                logger.info(f"[BananaSign] 用户 {user_id} 预扣 {cost} 香蕉，今日次数 {user['daily_draws']}/{self.max_daily_draws}")
         else:
             user_id = None  # 管理员不需要用户ID
 
-        # 获取提示词配置 (使用 .copy() 防止修改污染全局预设)
-        params = self.prompt_dict.get(cmd, {}).copy()
-        # 先从预设提示词参数字典字典中取出提示词
-        preset_prompt = params.get("prompt", "{{user_text}}")
-
-        # 处理预设提示词补充参数preset_append
-        if (
-            params.get("preset_append", self.common_config.preset_append)
-            and "{{user_text}}" not in preset_prompt
-        ):
-            preset_prompt += " {{user_text}}"
-
-        # 检查预设提示词中是否包含动态参数占位符
-        if "{{user_text}}" in preset_prompt:
-            # 存在动态参数，解析用户消息
-            _, user_params = self.parsing_prompt_params(message_str)
-            # 将用户参数差分覆盖预设参数
-            params.update(user_params)
-            # 解析到用户的提示词和配置参数
-            user_prompt = user_params.get("prompt", "anything").strip()
-            # 替换占位符，更新提示词
-            new_prompt = preset_prompt.replace("{{user_text}}", user_prompt)
-            params["prompt"] = new_prompt
-
         # 处理收集模式
         image_urls = []
         if params.get("gather_mode", self.prompt_config.gather_mode):
@@ -875,114 +1193,252 @@ class BananaSign(Star):
             f"生成图片应用参数: { {k: v for k, v in params.items() if k != 'prompt'} }"
         )
 
-        # ========== 排队逻辑 ==========
-        # 检查是否需要排队
-        queue_position = 0
-        if self._semaphore and self._semaphore.locked():
-            async with self._queue_lock:
-                self._queue_waiting += 1
-                queue_position = self._queue_waiting
-            yield event.plain_result(f"🎨 当前有其他任务正在生成，您的请求已加入队列（第 {queue_position} 位）...")
-
-        # 获取信号量（等待轮到自己）
-        async with self._semaphore:
-            # 如果之前排队了，现在轮到了，更新等待计数
-            if queue_position > 0:
-                async with self._queue_lock:
-                    self._queue_waiting -= 1
-
-            # 记录开始时间
-            start_time = datetime.now()
-            # 调用作图任务
-            task = asyncio.create_task(self.job(event, params, image_urls=image_urls))
-            task_id = event.message_obj.message_id
-            self.running_tasks[task_id] = task
-
-            try:
-                results, err_msg = await task
-                if not results or err_msg:
-                    # 生成失败，积分不退还（一旦触发即扣除）
-                    logger.info(f"[BananaSign] 用户 {user_id} 生成失败，积分已扣除不退还")
-
-                    # 处理错误消息显示
-                    display_err = err_msg or "图片触碰内容审查，无法生成"
-                    yield event.chain_result(
-                        [
-                            Comp.Reply(id=event.message_obj.message_id),
-                            Comp.Plain(f"❌ {display_err}"),
-                        ]
-                    )
-                    return
+        # 请求已受理，写入任务日志，重启后可恢复或退款
+        image_urls = self._collect_image_urls(event, params, image_urls=image_urls)
+        entry = await self._journal_add(event, params, image_urls, user_id, count)
+        # 排队期间并行准备参考图片（下载、refer_images）
+        accepted_at = time.monotonic()
+        references = asyncio.create_task(self._load_references(params, image_urls))
+
+        # ========== 交给工作池 ==========
+        # 提交到公平调度器（群聊间、用户间轮转，管理员走优先通道），获得名额后由工作协程执行，
+        # 处理器立即返回，不在事件处理流程中等待生成完成
+        ticket = self.scheduler.submit(
+            str(event.get_sender_id()),
+            event.get_group_id(),
+            priority=is_admin,
+            expected=self.estimate_duration(params),
+            # 每张候选图片各占一个名额，并发请求同样受自适应并发上限约束
+            weight=count,
+        )
+        self.worker_pool.submit(
+            ticket,
+            run=functools.partial(
+                self._run_draw,
+                event,
+                ticket,
+                params,
+                cmd,
+                count,
+                user_id,
+                is_admin,
+                references,
+                accepted_at,
+                entry,
+            ),
+            abort=functools.partial(
+                self._abort_draw, event, user_id, count, [references], entry
+            ),
+            # 超过最长排队时间则移出队列并退还预扣费用
+            timeout=None if is_admin else self.scheduler.max_wait or None,
+        )
+        if not ticket.running:
+            queue_position = self.scheduler.position(ticket)
+            start_in, finish_in = self.scheduler.forecast()[ticket.job_id]
+            yield event.plain_result(
+                f"🎨 当前有其他任务正在生成，您的请求已加入队列（第 {queue_position} 位）...\n"
+                f"⏳ 预计{self._format_eta(start_in)}后开始，{self._format_eta(finish_in)}后完成"
+            )
+        event.stop_event()
 
-                # 计算耗时
-                elapsed = datetime.now() - start_time
-                elapsed_str = f"{int(elapsed.total_seconds() // 60):02d}:{int(elapsed.total_seconds() % 60):02d}"
+    async def _abort_draw(
+        self,
+        event: AstrMessageEvent,
+        user_id: str | None,
+        count: int,
+        references: list[asyncio.Task],
+        entry: JournalEntry | None,
+        reason: str,
+    ) -> None:
+        """任务未执行即离开队列（被取消或排队超时）：停止预取、退还预扣费用并通知"""
+        for reference in references:
+            if not reference.done():
+                reference.cancel()
+        try:
+            if reason == SHED_WAIT_TIMEOUT:
+                logger.info(f"[BananaSign] 用户 {event.get_sender_id()} 排队超时")
+                if user_id is not None:
+                    await self.refund_draws(user_id, count)
+                chain = [
+                    Comp.Reply(id=event.message_obj.message_id),
+                    Comp.Plain(f"🚦 {self.shed_message(SHED_WAIT_TIMEOUT)}"),
+                ]
+            else:
+                chain = await self._on_job_cancelled(event, user_id, count)
+            await event.send(event.chain_result(chain))
+        finally:
+            await self._journal_remove(entry)
 
-                # 组装消息链（管理员显示 ∞）
-                if self.consume_enabled:
-                    remaining = "∞" if is_admin else self._get_user(str(event.get_sender_id()))["bananas"]
-                else:
-                    remaining = None
+    async def _run_draw(
+        self,
+        event: AstrMessageEvent,
+        ticket: Job,
+        params: dict,
+        cmd: str,
+        count: int,
+        user_id: str | None,
+        is_admin: bool,
+        references: asyncio.Task,
+        accepted_at: float,
+        entry: JournalEntry | None,
+    ) -> None:
+        """工作协程执行的画图任务：结果通过 event.send 发送"""
+        try:
+            async for result, fallback in self._draw_results(
+                event,
+                ticket,
+                params,
+                cmd,
+                count,
+                user_id,
+                is_admin,
+                references,
+                accepted_at,
+            ):
+                try:
+                    await event.send(result)
+                except Exception as e:
+                    if fallback is None:
+                        raise
+                    # 合并转发失败，降级为普通消息
+                    logger.warning(f"[BananaSign] 合并转发消息发送失败，改为普通消息: {e}")
+                    await event.send(fallback)
+        except asyncio.CancelledError:
+            logger.info(f"[BananaSign] 任务 #{ticket.job_id} 被取消")
+            if not ticket.cancelled:
+                raise
+            # 被 /取消画图 取消
+            await event.send(
+                event.chain_result(await self._on_job_cancelled(event, user_id, count))
+            )
+        finally:
+            if not references.done():
+                references.cancel()
+            await self._journal_remove(entry)
 
-                # === 表情化：发送一张原图 + 切图结果 ===
-                if cmd == "表情化" and results:
-                    try:
-                        # 取第一张图片
-                        _, first_b64 = results[0]
-                        # 只发送第一张原图
-                        msg_chain = self.build_message_chain(event, [results[0]], remaining_bananas=remaining, elapsed_time=elapsed_str)
-                        yield event.chain_result(msg_chain)
-
-                        # 切图并发送
-                        image_bytes = base64.b64decode(first_b64)
-                        tiles = await asyncio.to_thread(self._slice_grid_image, image_bytes)
-                        if tiles and len(tiles) == EMOJI_GRID_TOTAL:
-                            nodes = [
-                                Comp.Node(
-                                    name="✂️ 表情化切图",
-                                    content=[Comp.Plain(f"✅ 表情化切图完成，共 {EMOJI_GRID_TOTAL} 张表情")],
-                                )
-                            ]
-                            for idx, tile in enumerate(tiles, start=1):
-                                tile_b64 = base64.b64encode(tile).decode("utf-8")
-                                nodes.append(
-                                    Comp.Node(
-                                        name=f"表情 {idx:02d}",
-                                        content=[Comp.Image.fromBase64(tile_b64)],
-                                    )
-                                )
-                            try:
-                                yield event.chain_result([Comp.Nodes(nodes)])
-                            except Exception:
-                                # 合并转发失败，降级为逐条发送
-                                for tile in tiles:
-                                    tile_b64 = base64.b64encode(tile).decode("utf-8")
-                                    yield event.chain_result([Comp.Image.fromBase64(tile_b64)])
-                        else:
-                            logger.warning(f"[BananaSign] 表情化切图数量异常: {len(tiles) if tiles else 0}")
-                    except Exception as e:
-                        logger.warning(f"[BananaSign] 表情化自动切图失败: {e}")
-                else:
-                    # 非表情化命令，正常发送所有原图
-                    msg_chain = self.build_message_chain(event, results, remaining_bananas=remaining, elapsed_time=elapsed_str)
-                    yield event.chain_result(msg_chain)
-            except asyncio.CancelledError:
-                logger.info(f"{task_id} 任务被取消")
-                return
-            except Exception as e:
-                # 捕获所有异常，积分不退还（一旦触发即扣除）
-                logger.error(f"[BananaSign] 任务执行异常: {e}", exc_info=True)
+    async def _draw_results(
+        self,
+        event: AstrMessageEvent,
+        ticket: Job,
+        params: dict,
+        cmd: str,
+        count: int,
+        user_id: str | None,
+        is_admin: bool,
+        references: asyncio.Task,
+        accepted_at: float,
+    ):
+        """生成图片并逐条产出要发送的消息及其发送失败时的替代消息 (消息, 替代消息)"""
+        # 记录开始时间
+        start_time = datetime.now()
+        try:
+            results, err_msg = await self.job(
+                event,
+                params,
+                references=references,
+                accepted_at=accepted_at,
+                ticket=ticket,
+            )
+            # 生成已结束，此后的退款和发送不可再被 /取消画图 打断，避免重复退款
+            ticket.sending = True
+            if not results or err_msg:
+                # 生成失败，积分不退还（一旦触发即扣除）
+                logger.info(f"[BananaSign] 用户 {user_id} 生成失败，积分已扣除不退还")
+
+                # 处理错误消息显示
+                display_err = err_msg or "图片触碰内容审查，无法生成"
                 yield event.chain_result(
                     [
                         Comp.Reply(id=event.message_obj.message_id),
-                        Comp.Plain("❌ 图片生成时发生内部错误"),
+                        Comp.Plain(f"❌ {display_err}"),
                     ]
+                ), None
+                return
+
+            # 计算耗时
+            elapsed = datetime.now() - start_time
+            elapsed_str = f"{int(elapsed.total_seconds() // 60):02d}:{int(elapsed.total_seconds() % 60):02d}"
+
+            # 按张计费：退还未交付图片的预扣费用
+            if user_id is not None and len(results) < count:
+                await self.refund_draws(user_id, count - len(results))
+
+            # 组装消息链（管理员显示 ∞）
+            if self.consume_enabled:
+                remaining = "∞" if is_admin else self._get_user(str(event.get_sender_id()))["bananas"]
+            else:
+                remaining = None
+
+            # === 表情化：发送一张原图 + 切图结果 ===
+            if cmd == "表情化" and results:
+                try:
+                    # 只发送第一张原图
+                    msg_chain = self.build_message_chain(event, [results[0]], remaining_bananas=remaining, elapsed_time=elapsed_str)
+                    yield event.chain_result(msg_chain), None
+
+                    # 切图并发送（直接使用原始字节，无需 Base64 解码）
+                    tiles = await asyncio.to_thread(self._slice_grid_image, results[0].data)
+                    if tiles and len(tiles) == EMOJI_GRID_TOTAL:
+                        tile_images = [ImageData("image/png", tile) for tile in tiles]
+                        nodes = [
+                            Comp.Node(
+                                name="✂️ 表情化切图",
+                                content=[Comp.Plain(f"✅ 表情化切图完成，共 {EMOJI_GRID_TOTAL} 张表情")],
+                            )
+                        ]
+                        for idx, tile_image in enumerate(tile_images, start=1):
+                            nodes.append(
+                                Comp.Node(
+                                    name=f"表情 {idx:02d}",
+                                    content=[Comp.Image.fromBase64(tile_image.b64)],
+                                )
+                            )
+                        # 合并转发失败时改为普通消息发送所有切图（复用已缓存的编码）
+                        yield event.chain_result([Comp.Nodes(nodes)]), event.chain_result(
+                            self.build_message_chain(event, tile_images)
+                        )
+                    else:
+                        logger.warning(f"[BananaSign] 表情化切图数量异常: {len(tiles) if tiles else 0}")
+                except Exception as e:
+                    logger.warning(f"[BananaSign] 表情化自动切图失败: {e}")
+            elif len(results) > 1 and event.platform_meta.name != "telegram":
+                # 多张候选图合并为一条转发消息
+                summary = self.build_message_chain(
+                    event,
+                    [],
+                    remaining_bananas=remaining,
+                    elapsed_time=elapsed_str,
+                    prefix_text=f"✅ 共生成 {len(results)} 张图片",
                 )
-            finally:
-                self.running_tasks.pop(task_id, None)
-                # 目前只有 telegram 平台需要清理缓存
-                if event.platform_meta.name == "telegram":
-                    clear_cache(self.temp_dir)
+                # 转发节点中不需要引用原消息
+                nodes = [Comp.Node(name="🎨 画图结果", content=summary[1:])]
+                for idx, image in enumerate(results, start=1):
+                    nodes.append(
+                        Comp.Node(
+                            name=f"候选 {idx}",
+                            content=[Comp.Image.fromBase64(image.b64)],
+                        )
+                    )
+                # 合并转发失败时降级为普通消息
+                msg_chain = self.build_message_chain(event, results, remaining_bananas=remaining, elapsed_time=elapsed_str)
+                yield event.chain_result([Comp.Nodes(nodes)]), event.chain_result(msg_chain)
+            else:
+                # 非表情化命令，正常发送所有原图
+                msg_chain = self.build_message_chain(event, results, remaining_bananas=remaining, elapsed_time=elapsed_str)
+                yield event.chain_result(msg_chain), None
+        except Exception as e:
+            # 捕获所有异常，积分不退还（一旦触发即扣除）
+            logger.error(f"[BananaSign] 任务执行异常: {e}", exc_info=True)
+            yield event.chain_result(
+                [
+                    Comp.Reply(id=event.message_obj.message_id),
+                    Comp.Plain("❌ 图片生成时发生内部错误"),
+                ]
+            ), None
+        finally:
+            # 目前只有 telegram 平台需要清理缓存
+            if event.platform_meta.name == "telegram":
+                clear_cache(self.temp_dir)
 
     async def job(
         self,
@@ -991,11 +1447,133 @@ class BananaSign(Star):
         image_urls: list[str] | None = None,
         referer_id: list[str] | None = None,
         is_llm_tool: bool = False,
-    ) -> tuple[list[tuple[str, str]] | None, str | None]:
-        """负责参数处理、调度提供商、保存图片等逻辑，返回图片b64列表或错误信息"""
-        # 收集图片URL，后面统一处理
-        if image_urls is None:
-            image_urls = []
+        references: asyncio.Task | None = None,
+        accepted_at: float | None = None,
+        ticket: Job | None = None,
+    ) -> tuple[list[ImageData] | None, str | None]:
+        """负责参数处理、调度提供商、保存图片等逻辑，返回图片列表或错误信息
+
+        Args:
+            references: 排队期间已启动的参考图片预取任务，为空时在此处同步准备
+            accepted_at: 请求被受理的时间（time.monotonic），用于统计排队与预取的重叠耗时
+            ticket: 调度器中的任务，合并等待其他请求的结果期间会让出其名额
+        """
+        slot_at = time.monotonic()
+        # 任务的端到端时间预算，从获取名额开始计时
+        deadline = Deadline(self.common_config.job_timeout)
+        if references is None:
+            references = asyncio.ensure_future(
+                self._prepare_references(
+                    event,
+                    params,
+                    image_urls=image_urls,
+                    referer_id=referer_id,
+                    is_llm_tool=is_llm_tool,
+                )
+            )
+        image_list, err, prefetch_elapsed = await references
+        # 统计排队与参考图准备的重叠情况
+        ready_at = time.monotonic()
+        queue_wait = slot_at - accepted_at if accepted_at is not None else 0.0
+        logger.info(
+            f"[BananaSign] 任务耗时统计：排队 {queue_wait:.2f}s，参考图准备 {prefetch_elapsed:.2f}s，"
+            f"获取名额后等待参考图 {ready_at - slot_at:.2f}s，重叠 {max(prefetch_elapsed - (ready_at - slot_at), 0.0):.2f}s"
+        )
+        if err:
+            return None, err
+
+        # 发送绘图中提示（引用原消息）
+        await event.send(
+            MessageChain([
+                Comp.Reply(id=event.message_obj.message_id),
+                Comp.Plain("🎨 在画了，请稍等一会...")
+            ])
+        )
+
+        # 调度提供商生成图片，启用合并时相同的进行中请求共享同一次调用
+        coalesced = False
+        if self.common_config.coalesce_enabled:
+            key = await asyncio.to_thread(self._coalesce_key, params, image_list)
+            (images_result, err), coalesced = await self.singleflight.do(
+                key,
+                lambda: self._dispatch(
+                    params=params, image_list=image_list, deadline=deadline
+                ),
+                # 等待首个请求期间不调用提供商，名额和工作协程让给排队任务
+                on_join=(
+                    functools.partial(self.scheduler.detach, ticket)
+                    if ticket is not None
+                    else None
+                ),
+            )
+            if coalesced:
+                logger.info("[BananaSign] 相同请求正在生成，已合并等待其结果")
+        else:
+            images_result, err = await self._dispatch(
+                params=params, image_list=image_list, deadline=deadline
+            )
+
+        # 再次检查图片结果是否为空
+        valid_results = [image for image in (images_result or []) if image.data]
+
+        if not valid_results:
+            if not err:
+                err = "图片生成失败：响应中未包含图片数据"
+                logger.error(err)
+            return None, err
+
+        # 保存图片到本地（合并的请求已由首个请求保存）
+        if self.save_images and not coalesced:
+            save_images(valid_results, self.save_dir)
+
+        return valid_results, None
+
+    def _coalesce_key(
+        self, params: dict, image_list: list[ImageData] | None
+    ) -> str:
+        """请求合并键：最终提示词、参数、提供商列表和参考图片内容的哈希"""
+        digest = hashlib.sha256()
+        payload = dict(params)
+        payload.setdefault("providers", self.def_enabled_providers)
+        digest.update(
+            json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str).encode()
+        )
+        for image in image_list or []:
+            digest.update(image.mime.encode())
+            digest.update(hashlib.sha256(image.data).digest())
+        return digest.hexdigest()
+
+    async def _prepare_references(
+        self,
+        event: AstrMessageEvent,
+        params: dict,
+        image_urls: list[str] | None = None,
+        referer_id: list[str] | None = None,
+        is_llm_tool: bool = False,
+    ) -> tuple[list[ImageData] | None, str | None, float]:
+        """准备参考图片：收集URL、头像、读取 refer_images 并下载。
+        可以在请求排队期间提前执行，返回 元组(参考图片列表, 错误信息, 耗时秒数)
+        """
+        image_urls = self._collect_image_urls(
+            event,
+            params,
+            image_urls=image_urls,
+            referer_id=referer_id,
+            is_llm_tool=is_llm_tool,
+        )
+        return await self._load_references(params, image_urls)
+
+    def _collect_image_urls(
+        self,
+        event: AstrMessageEvent,
+        params: dict,
+        image_urls: list[str] | None = None,
+        referer_id: list[str] | None = None,
+        is_llm_tool: bool = False,
+    ) -> list[str]:
+        """从消息中收集参考图片 URL（图片、引用、At 头像、referer_id），不发起下载"""
+        # 复制一份，避免修改调用方的列表
+        image_urls = list(image_urls or [])
 
         if referer_id is None:
             referer_id = []
@@ -1062,7 +1640,6 @@ class BananaSign(Star):
                         )
 
         min_required_images = params.get("min_images", self.prompt_config.min_images)
-        max_allowed_images = params.get("max_images", self.prompt_config.max_images)
         # 如果图片数量不满足最小要求，且消息平台是Aiocqhttp，取消息发送者头像作为参考图片
         if (
             len(image_urls) < min_required_images
@@ -1071,127 +1648,282 @@ class BananaSign(Star):
             image_urls.append(
                 f"https://q.qlogo.cn/g?b=qq&s=0&nk={event.get_sender_id()}"
             )
+        return image_urls
 
-        # 图片b64列表
-        image_b64_list: list[tuple[str, str]] = []
-        # 处理 refer_images 参数
+    async def _load_references(
+        self, params: dict, image_urls: list[str]
+    ) -> tuple[list[ImageData] | None, str | None, float]:
+        """读取 refer_images 并下载参考图片 URL，返回 元组(参考图片列表, 错误信息, 耗时秒数)"""
+        start = time.monotonic()
+        min_required_images = params.get("min_images", self.prompt_config.min_images)
+        max_allowed_images = params.get("max_images", self.prompt_config.max_images)
+
+        # 参考图片列表
+        image_list: list[ImageData] = []
+        # 处理 refer_images 参数（命中缓存时不读盘、不重复编码）
         refer_images = params.get("refer_images", self.prompt_config.refer_images)
-        if refer_images:
-            for filename in refer_images.split(","):
-                if len(image_b64_list) >= max_allowed_images:
-                    break
-                filename = filename.strip()
-                # 路径穿越防护：只允许文件名，拒绝路径分隔符
-                if filename and ".." not in filename and "/" not in filename and "\\" not in filename:
-                    path = self.refer_images_dir / filename
-                    mime_type, b64_data = await asyncio.to_thread(
-                        read_file, path, allowed_dir=self.refer_images_dir
-                    )
-                    if mime_type and b64_data:
-                        image_b64_list.append((mime_type, b64_data))
+        for filename in self._split_refer_images(refer_images):
+            if len(image_list) >= max_allowed_images:
+                break
+            image = await asyncio.to_thread(self.refer_cache.load, filename)
+            if image:
+                image_list.append(image)
         # 图片去重
         image_urls = list(dict.fromkeys(image_urls))
         # 判断图片数量是否满足最小要求
-        if len(image_urls) + len(image_b64_list) < min_required_images:
-            warn_msg = f"图片数量不足，最少需要 {min_required_images} 张图片，当前仅 {len(image_urls) + len(image_b64_list)} 张"
+        if len(image_urls) + len(image_list) < min_required_images:
+            warn_msg = f"图片数量不足，最少需要 {min_required_images} 张图片，当前仅 {len(image_urls) + len(image_list)} 张"
             logger.warning(warn_msg)
-            return None, warn_msg
+            return None, warn_msg, time.monotonic() - start
 
         # 检查图片数量是否超过最大允许数量，不超过则可从url中下载图片
-        append_count = max_allowed_images - len(image_b64_list)
+        append_count = max_allowed_images - len(image_list)
         if append_count > 0 and image_urls:
-            # 取前n张图片，下载并转换为Base64，追加到b64图片列表
-            if len(image_b64_list) + len(image_urls) > max_allowed_images:
+            # 取前n张图片，下载后追加到参考图片列表
+            if len(image_list) + len(image_urls) > max_allowed_images:
                 logger.warning(
                     f"参考图片数量超过或等于最大图片数量，将只使用前 {max_allowed_images} 张参考图片"
                 )
             fetched = await self.downloader.fetch_images(image_urls[:append_count])
             if fetched:
-                image_b64_list.extend(fetched)
+                image_list.extend(fetched)
 
             # 如果 min_required_images 为 0，列表为空是允许的
-            if not image_b64_list and min_required_images > 0:
+            if not image_list and min_required_images > 0:
                 logger.error("全部参考图片下载失败")
-                return None, "全部参考图片下载失败"
+                return None, "全部参考图片下载失败", time.monotonic() - start
         elif append_count < 0:
             logger.warning(
                 f"参考图片数量超过最大允许数量 {max_allowed_images}，跳过下载图片步骤"
             )
 
-        # 发送绘图中提示（引用原消息）
-        await event.send(
-            MessageChain([
-                Comp.Reply(id=event.message_obj.message_id),
-                Comp.Plain("🎨 在画了，请稍等一会...")
-            ])
-        )
+        return image_list, None, time.monotonic() - start
 
-        # 调度提供商生成图片
-        images_result, err = await self._dispatch(
-            params=params, image_b64_list=image_b64_list
-        )
-
-        # 再次检查图片结果是否为空
-        valid_results = [(mime, b64) for mime, b64 in (images_result or []) if b64]
-
-        if not valid_results:
-            if not err:
-                err = "图片生成失败：响应中未包含图片数据"
-                logger.error(err)
-            return None, err
-
-        # 保存图片到本地
-        if self.save_images:
-            save_images(valid_results, self.save_dir)
-
-        return valid_results, None
+    @staticmethod
+    def _split_refer_images(refer_images) -> list[str]:
+        """拆分 refer_images 参数为文件名列表，过滤不安全的文件名"""
+        if not refer_images or not isinstance(refer_images, str):
+            return []
+        filenames = []
+        for filename in refer_images.split(","):
+            filename = filename.strip()
+            # 路径穿越防护：只允许文件名，拒绝路径分隔符
+            if filename and ".." not in filename and "/" not in filename and "\\" not in filename:
+                filenames.append(filename)
+        return filenames
 
     async def _dispatch(
         self,
         params: dict,
-        image_b64_list: list[tuple[str, str]] | None = None,
-    ) -> tuple[list[tuple[str, str]] | None, str | None]:
-        """提供商调度器"""
+        image_list: list[ImageData] | None = None,
+        deadline: Deadline | None = None,
+    ) -> tuple[list[ImageData] | None, str | None]:
+        """提供商调度器
+
+        按顺序调用提供商，失败后降级到下一个。启用对冲时，若当前提供商在其历史耗时的
+        指定百分位内仍未返回，则同时向下一个可用提供商发出请求，先成功者胜出，另一个被取消。
+        请求积分在受理时已预扣，对冲不会产生额外扣费。
+        所有请求共享同一个时间预算 deadline，预算耗尽后不再降级。
+        """
         err = None
+        if deadline is None:
+            deadline = Deadline(self.common_config.job_timeout)
 
         # 处理需要启用的提供商列表参数
         active_providers = params.get("providers", self.def_enabled_providers)
         if isinstance(active_providers, str):
             active_providers = active_providers.split(",")
 
-        # 调度提供商
-        for i, api_name in enumerate(active_providers):
-            # 获取提供商配置
+        # 处理错误信息
+        if len(active_providers) == 0:
+            err = "当前无可用提供商，请检查插件配置。"
+            logger.error(err)
+            return None, err
+
+        # 待调度的提供商队列
+        candidates: list[ProviderConfig] = []
+        for api_name in active_providers:
             provider_config = self.providers_config.get(api_name)
             if not provider_config:
                 logger.warning(f"未找到提供商配置：{api_name}，跳过该提供商")
                 continue
-            # 获取提供商实例，并调用生成方法
+            candidates.append(provider_config)
+
+        self.hedge_stats.requests += 1
+        pending: dict[asyncio.Task, tuple[ProviderConfig, float]] = {}
+        try:
+            while True:
+                if not pending:
+                    if deadline.expired:
+                        err = BaseProvider.DEADLINE_EXCEEDED_MSG
+                        logger.warning(
+                            f"任务已耗时 {deadline.elapsed:.0f}s，超出时间预算，停止尝试其余提供商"
+                        )
+                        break
+                    provider_config = self._next_provider(candidates)
+                    if provider_config is None:
+                        # 所有提供商都被熔断跳过
+                        err = err or "当前提供商均暂时不可用，请稍后再试"
+                        break
+                    if err:
+                        logger.warning(f"尝试使用下一个提供商 {provider_config.api_name}...")
+                    pending[
+                        self._start_provider(provider_config, params, image_list, deadline)
+                    ] = (
+                        provider_config,
+                        time.monotonic(),
+                    )
+
+                # 仅有一个请求在途时才考虑对冲，计算对冲等待时间
+                timeout = None
+                if self.common_config.hedge_enabled and len(pending) == 1 and candidates:
+                    (primary_config, started_at), = pending.values()
+                    timeout = max(
+                        self._hedge_delay(primary_config) - (time.monotonic() - started_at),
+                        0,
+                    )
+
+                done, _ = await asyncio.wait(
+                    pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    # 首个提供商超过对冲阈值仍未返回，向下一个可用提供商发出对冲请求
+                    backup_config = self._next_provider(candidates)
+                    if backup_config is None:
+                        # 没有可对冲的提供商，继续等待
+                        candidates.clear()
+                        continue
+                    (primary_config, _), = pending.values()
+                    logger.info(
+                        f"{primary_config.api_name} 超过对冲阈值仍未返回，同时请求 {backup_config.api_name}"
+                    )
+                    self.hedge_stats.hedged += 1
+                    pending[
+                        self._start_provider(backup_config, params, image_list, deadline)
+                    ] = (
+                        backup_config,
+                        time.monotonic(),
+                    )
+                    continue
+
+                for task in done:
+                    provider_config, started_at = pending.pop(task)
+                    images_result, err = task.result()
+                    if images_result:
+                        logger.info(f"{provider_config.api_name} 图片生成成功")
+                        if pending:
+                            self._record_hedge_win(started_at, pending, time.monotonic())
+                        return images_result, None
+                    logger.warning(f"{provider_config.api_name} 生成图片失败")
+        finally:
+            # 取消仍在进行中的请求（对冲失败方或任务被取消）
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+        return None, err
+
+    async def _run_pipeline(
+        self,
+        pipeline: Pipeline,
+        references: dict[str, asyncio.Task],
+        on_stage: Callable[[Stage, int], Awaitable[bool | None]] | None = None,
+    ) -> PipelineResult:
+        """在工作协程中执行多阶段流水线，结束后停止未用到的参考图片下载并记录各阶段耗时
+
+        所有阶段共享同一个时间预算，整条流水线不超过 job_timeout。
+        """
+        deadline = Deadline(self.common_config.job_timeout)
+
+        async def dispatch(params: dict, image_list: list[ImageData]):
+            return await self._dispatch(
+                params=params, image_list=image_list, deadline=deadline
+            )
+
+        try:
+            result = await pipeline.run(references, dispatch, on_stage=on_stage)
+        finally:
+            for reference in references.values():
+                if not reference.done():
+                    reference.cancel()
+        for timing in result.timings:
+            logger.info(f"[BananaSign] 流水线阶段耗时 {timing.describe()}")
+        return result
+
+    @staticmethod
+    def _next_provider(candidates: list[ProviderConfig]) -> ProviderConfig | None:
+        """从候选队列中取出下一个未熔断的提供商"""
+        while candidates:
+            provider_config = candidates.pop(0)
+            # 熔断中的提供商直接跳过，半开状态只放行一个试探请求
+            if provider_config.circuit_breaker.allow_request():
+                return provider_config
+            logger.warning(f"{provider_config.api_name} 处于熔断状态，跳过该提供商")
+        return None
+
+    def _start_provider(
+        self,
+        provider_config: ProviderConfig,
+        params: dict,
+        image_list: list[ImageData] | None,
+        deadline: Deadline,
+    ) -> asyncio.Task:
+        """创建调用提供商的任务，成功时记录耗时
+
+        提供商的并发名额由 generate_images 在每次接口请求时占用。
+        """
+
+        async def _call() -> tuple[list[ImageData] | None, str | None]:
+            start = time.monotonic()
             images_result, err = await self.provider_map[
                 provider_config.api_type
             ].generate_images(
                 provider_config=provider_config,
                 params=params,
-                image_b64_list=image_b64_list,
+                image_list=image_list,
+                deadline=deadline,
             )
             if images_result:
-                logger.info(f"{provider_config.api_name} 图片生成成功")
-                return images_result, None
-            if i < len(active_providers) - 1:
-                logger.warning(
-                    f"{provider_config.api_name} 生成图片失败，尝试使用下一个提供商..."
+                elapsed = time.monotonic() - start
+                provider_config.latency.add(elapsed)
+                self.durations.record(
+                    provider_config.api_name,
+                    params.get("image_size", self.prompt_config.image_size),
+                    elapsed,
                 )
+            return images_result, err
 
-        # 处理错误信息
-        if len(active_providers) == 0:
-            err = "当前无可用提供商，请检查插件配置。"
-            logger.error(err)
-        return None, err
+        return asyncio.create_task(_call())
+
+    def _hedge_delay(self, provider_config: ProviderConfig) -> float:
+        """对冲等待时间：提供商历史耗时的指定百分位，样本不足时使用最小等待时间"""
+        min_delay = self.common_config.hedge_min_delay
+        if len(provider_config.latency) < 10:
+            return min_delay
+        delay = provider_config.latency.percentile(self.common_config.hedge_percentile)
+        return max(delay or min_delay, min_delay)
+
+    def _record_hedge_win(
+        self,
+        winner_started: float,
+        pending: dict[asyncio.Task, tuple[ProviderConfig, float]],
+        finished_at: float,
+    ) -> None:
+        """记录对冲结果，用被取消方慢请求的历史平均耗时估算节省的时间"""
+        (loser, loser_started), = pending.values()
+        # 先发出的请求胜出时，对冲请求没有带来收益
+        if winner_started <= loser_started:
+            return
+        self.hedge_stats.hedge_wins += 1
+        loser_elapsed = finished_at - loser_started
+        expected = loser.latency.mean_above(loser_elapsed)
+        if expected is not None:
+            self.hedge_stats.saved_seconds += expected - loser_elapsed
 
     def build_message_chain(
         self,
         event: AstrMessageEvent,
-        results: list[tuple[str, str]],
+        results: list[ImageData],
         remaining_bananas: int | str = None,
         elapsed_time: str = None,
         prefix_text: str | None = None,
@@ -1206,14 +1938,14 @@ class BananaSign(Star):
 
         # 对Telegram平台特殊处理，超过10MB的图片需要作为文件发送
         if event.platform_meta.name == "telegram" and any(
-            (b64 and len(b64) > MAX_SIZE_B64_LEN) for _, b64 in results
+            image.size > MAX_SIZE_BYTES for image in results
         ):
             save_results = save_images(results, self.temp_dir)
             for name_, path_ in save_results:
                 msg_chain.append(Comp.File(name=name_, file=str(path_)))
         else:
             # 其他平台直接发送图片
-            msg_chain.extend(Comp.Image.fromBase64(b64) for _, b64 in results)
+            msg_chain.extend(Comp.Image.fromBase64(image.b64) for image in results)
 
         # 添加生成耗时和剩余香蕉数
         if elapsed_time is not None and remaining_bananas is not None:
@@ -1227,12 +1959,15 @@ class BananaSign(Star):
 
     async def terminate(self):
         """可选择实现异步的插件销毁方法，当插件被卸载/停用时会调用。"""
-        # 取消所有生成任务
-        for task in list(self.running_tasks.values()):
-            if not task.done():
-                task.cancel()
-        await asyncio.gather(*self.running_tasks.values(), return_exceptions=True)
-        self.running_tasks.clear()
+        # 停止受理新任务，等待已受理的任务完成
+        if not await self.worker_pool.drain(self.drain_timeout):
+            logger.info(
+                f"[BananaSign] 仍有 {self.worker_pool.pending} 个任务未完成，将在重启后恢复或退款"
+            )
+        # 此后被中断的任务保留在任务日志中，重启后恢复或退款
+        self._terminating = True
+        # 停止工作协程，执行中的任务随之取消
+        await self.worker_pool.stop()
         # 清理网络客户端会话
         await self.http_manager.close_session()
         # 卸载函数调用工具
@@ -1562,22 +2297,169 @@ class BananaSign(Star):
             f"━━━━━━━━━━━━━━━"
         )
 
+    @filter.command("取消画图", alias={"lmcancel"})
+    async def cancel_draw(self, event: AstrMessageEvent, job_id: int = 0):
+        """取消自己排队中或生成中的画图任务，预扣费用自动退还
+
+        用法：取消画图 [任务编号]，不填编号时取消自己的全部任务
+        """
+        jobs = self.scheduler.jobs_of(str(event.get_sender_id()))
+        if job_id:
+            jobs = [job for job in jobs if job.job_id == job_id]
+        if not jobs:
+            yield event.plain_result("🛑 没有可以取消的画图任务")
+            return
+
+        # 取消后名额立即转给下一个排队任务，退款由任务所在的处理流程完成
+        cancelled = [job.job_id for job in jobs if self.scheduler.cancel(job)]
+        if not cancelled:
+            yield event.plain_result("🛑 任务已生成完成，正在发送结果，无法取消")
+            return
+        yield event.plain_result(
+            f"🛑 已取消 {len(cancelled)} 个画图任务（"
+            + "、".join(f"#{job_id}" for job_id in cancelled)
+            + "）"
+        )
+
     @filter.command("画图队列", alias={"队列状态", "lmqueue"})
     async def queue_status(self, event: AstrMessageEvent):
         """查看画图队列状态"""
-        running_count = len(self.running_tasks)
-        waiting_count = self._queue_waiting if hasattr(self, '_queue_waiting') else 0
-        max_concurrent = self.max_concurrent if hasattr(self, 'max_concurrent') else 3
+        running_count = self.scheduler.running
+        waiting_count = self.scheduler.waiting
+        max_concurrent = f"{self.scheduler.limit}"
+        if self.limiter:
+            max_concurrent += (
+                f"（自适应 {self.limiter.min_limit}~{self.limiter.max_limit}，"
+                f"上调 {self.limiter.increases} 次/下调 {self.limiter.decreases} 次）"
+            )
+        # 排队中的用户数（公平调度按用户轮转）
+        waiting_users = len({job.user_id for job in self.scheduler.ordered()})
+        llm_limit = self.scheduler.source_limits.get(SOURCE_LLM_TOOL)
+        llm_msg = (
+            f"其中 LLM 工具: {self.scheduler.running_by_source(SOURCE_LLM_TOOL)}"
+            f"{f'/{llm_limit}' if llm_limit else ''} 个任务\n"
+        )
+
+        hedge_msg = ""
+        if self.common_config.hedge_enabled:
+            hedge_msg = (
+                f"对冲比例: {self.hedge_stats.hedge_rate:.1%}"
+                f"（对冲胜出 {self.hedge_stats.hedge_wins} 次，"
+                f"估算节省 {self.hedge_stats.saved_seconds:.0f}s）\n"
+            )
+
+        # 逐个任务的预计开始/完成时间（运行中在前，排队按出队顺序）
+        forecast = self.scheduler.forecast()
+        jobs = self.scheduler.running_jobs() + self.scheduler.ordered()
+        job_lines = []
+        for index, job in enumerate(jobs[:QUEUE_VIEW_LIMIT]):
+            start_in, finish_in = forecast[job.job_id]
+            user_tag = f"用户*{job.user_id[-4:]}"
+            if job.running:
+                state = "合并等待中" if job.detached else "生成中"
+                job_lines.append(
+                    f"#{job.job_id} {user_tag} {state}，预计{self._format_eta(finish_in)}后完成"
+                )
+            else:
+                position = index - self.scheduler.running + 1
+                job_lines.append(
+                    f"#{job.job_id} {user_tag} 排队第 {position} 位，"
+                    f"预计{self._format_eta(start_in)}后开始，{self._format_eta(finish_in)}后完成"
+                )
+        if len(jobs) > QUEUE_VIEW_LIMIT:
+            job_lines.append(f"……另有 {len(jobs) - QUEUE_VIEW_LIMIT} 个任务")
+        job_msg = "".join(f"{line}\n" for line in job_lines)
+        eta_error = self.durations.mean_abs_error
+        if eta_error is not None:
+            job_msg += f"预计耗时平均误差: {eta_error:.0f}s（{self.durations.samples} 个样本）\n"
+
+        # 各提供商的并发占用与利用率
+        provider_msg = "".join(
+            f"【{api_name}】{provider_config.pool.describe()}\n"
+            for api_name, provider_config in self.providers_config.items()
+        )
+
+        # 准入控制拒绝统计
+        shed = self.scheduler.shed
+        shed_msg = ""
+        if shed:
+            shed_msg = (
+                f"已拒绝: 队列已满 {shed[SHED_QUEUE_FULL]}，个人排队上限 {shed[SHED_USER_LIMIT]}，"
+                f"预计等待过长 {shed[SHED_WAIT_TOO_LONG]}，排队超时 {shed[SHED_WAIT_TIMEOUT]}\n"
+            )
+        if self.scheduler.cancelled:
+            shed_msg += f"用户取消: {self.scheduler.cancelled} 个任务\n"
+
+        coalesce_msg = ""
+        if self.common_config.coalesce_enabled:
+            coalesce_msg = (
+                f"请求合并率: {self.singleflight.coalesce_rate:.1%}"
+                f"（合并 {self.singleflight.coalesced}/{self.singleflight.requests} 次）\n"
+            )
 
         yield event.plain_result(
             f"🎨 画图队列状态\n"
             f"━━━━━━━━━━━━━━━\n"
             f"最大并发数: {max_concurrent}\n"
-            f"正在生成: {running_count} 个任务\n"
-            f"排队等待: {waiting_count} 个任务\n"
+            f"工作协程: {self.worker_pool.busy}/{self.worker_pool.size} 忙碌"
+            f"{'' if self.worker_pool.accepting else '（排空中，暂停受理）'}\n"
+            f"正在生成: {running_count} 个任务（占用 {self.scheduler.used} 个名额）\n"
+            f"{llm_msg}"
+            f"排队等待: {waiting_count} 个任务（{waiting_users} 位用户）\n"
+            f"{job_msg}"
+            f"{shed_msg}"
+            f"{provider_msg}"
+            f"{hedge_msg}"
+            f"{coalesce_msg}"
             f"━━━━━━━━━━━━━━━"
         )
 
+    @filter.command("画图密钥", alias={"lmkeys"})
+    async def key_pool_status(self, event: AstrMessageEvent):
+        """查看各提供商 API Key 健康状态（管理员）"""
+        if not self.is_global_admin(event):
+            logger.info(
+                f"用户 {event.get_sender_id()} 试图执行管理员命令 画图密钥，权限不足"
+            )
+            return
+
+        lines = ["🔑 API Key 状态", "━━━━━━━━━━━━━━━"]
+        for api_name, provider_config in self.providers_config.items():
+            lines.append(
+                f"【{api_name}】熔断器: {provider_config.circuit_breaker.describe()}"
+            )
+            lines.extend(provider_config.key_pool.snapshot() or ["未配置 Key"])
+        lines.append("━━━━━━━━━━━━━━━")
+        yield event.plain_result("\n".join(lines))
+
+    @filter.command("画图排空", alias={"lmdrain"})
+    async def drain_workers(self, event: AstrMessageEvent):
+        """暂停受理新任务，等待已受理的任务全部完成（管理员）"""
+        if not self.is_global_admin(event):
+            logger.info(
+                f"用户 {event.get_sender_id()} 试图执行管理员命令 画图排空，权限不足"
+            )
+            return
+
+        pending = self.worker_pool.pending
+        yield event.plain_result(
+            f"🚧 已暂停受理新任务，等待 {pending} 个已受理的任务完成..."
+        )
+        await self.worker_pool.drain()
+        yield event.plain_result("✅ 已受理的任务已全部完成，可以安全重启。使用 /画图恢复 重新受理任务")
+
+    @filter.command("画图恢复", alias={"lmresume"})
+    async def resume_workers(self, event: AstrMessageEvent):
+        """重新受理新任务（管理员）"""
+        if not self.is_global_admin(event):
+            logger.info(
+                f"用户 {event.get_sender_id()} 试图执行管理员命令 画图恢复，权限不足"
+            )
+            return
+
+        self.worker_pool.start()
+        yield event.plain_result("✅ 已恢复受理画图任务")
+
     # ========== 线稿绘画功能 ==========
 
     @filter.command("线稿转绘", alias={"xgzh", "lineart2draw"})
@@ -1619,6 +2501,26 @@ class BananaSign(Star):
         # 线稿转绘消耗2倍积分（两次生成）
         total_cost = self.cost_per_draw * 2
 
+        # 排空期间暂停受理新任务
+        if not self.worker_pool.accepting:
+            yield event.plain_result(DRAINING_MSG)
+            return
+
+        # 准入控制：队列过载时在预扣之前直接拒绝
+        shed_reason = self.scheduler.admit(
+            user_id,
+            event.get_group_id(),
+            priority=is_admin,
+            source=SOURCE_LINEART,
+            # 两个阶段连续占用同一个名额
+            expected=2
+            * self.estimate_duration({"image_size": self.prompt_config.image_size}),
+        )
+        if shed_reason:
+            logger.info(f"[BananaSign] 用户 {user_id} 的线稿转绘被准入控制拒绝: {shed_reason}")
+            yield event.plain_result(f"🚦 {self.shed_message(shed_reason)}")
+            return
+
         # 每日次数限制检查（独立于consume_enabled）
         if not is_admin and self.max_daily_draws > 0:
             user_lock = self._get_user_lock(user_id)
@@ -1675,28 +2577,102 @@ class BananaSign(Star):
                 await self._save_sign_data_async()
                 logger.info(f"[BananaSign] 用户 {user_id} 线稿转绘计数+2（无积分消耗模式）")
 
-        # 确定模式
-        single_image_mode = len(image_urls) == 1
+        # 写入任务日志：线稿转绘不支持恢复，重启后直接退款
+        refund_user = None if is_admin else user_id
+        entry = await self._journal_add(
+            event,
+            {"clothing_desc": clothing_desc},
+            image_urls,
+            refund_user,
+            2,
+            kind=KIND_LINEART,
+        )
+
+        # 两张参考图在受理时同时开始下载，排队和生成线稿期间即可就绪（单图模式共用一次下载）
         action_ref_url = image_urls[0]
         char_ref_url = image_urls[1] if len(image_urls) >= 2 else image_urls[0]
+        action_download = asyncio.create_task(
+            self.downloader.fetch_images([action_ref_url])
+        )
+        references = {
+            "动作参考图": action_download,
+            "角色参考图": (
+                action_download
+                if char_ref_url == action_ref_url
+                else asyncio.create_task(self.downloader.fetch_images([char_ref_url]))
+            ),
+        }
 
-        # 服装描述处理
-        clothing_desc = clothing_desc.strip()
-        display_clothing = clothing_desc if clothing_desc else "保留原图服装"
-
-        # 记录开始时间
-        start_time = datetime.now()
+        # ========== 交给工作池 ==========
+        # 两个阶段作为一个任务排队，获得名额后由工作协程执行，处理器立即返回
+        ticket = self.scheduler.submit(
+            user_id,
+            event.get_group_id(),
+            priority=is_admin,
+            source=SOURCE_LINEART,
+            expected=2
+            * self.estimate_duration({"image_size": self.prompt_config.image_size}),
+        )
+        self.worker_pool.submit(
+            ticket,
+            run=functools.partial(
+                self._run_lineart,
+                event,
+                ticket,
+                is_admin,
+                user_id,
+                clothing_desc,
+                references,
+                entry,
+            ),
+            abort=functools.partial(
+                self._abort_draw,
+                event,
+                refund_user,
+                2,
+                list(references.values()),
+                entry,
+            ),
+            # 超过最长排队时间则移出队列并退还预扣费用
+            timeout=None if is_admin else self.scheduler.max_wait or None,
+        )
 
+        display_clothing = clothing_desc.strip() or "保留原图服装"
+        queue_msg = ""
+        if not ticket.running:
+            start_in, _ = self.scheduler.forecast()[ticket.job_id]
+            queue_msg = (
+                f"排队: 第 {self.scheduler.position(ticket)} 位，"
+                f"预计{self._format_eta(start_in)}后开始\n"
+            )
         yield event.plain_result(
             f"🎨 线稿转绘开始...\n"
             f"━━━━━━━━━━━━━━━\n"
-            f"模式: {'单图' if single_image_mode else '双图'}\n"
+            f"模式: {'单图' if len(image_urls) == 1 else '双图'}\n"
             f"服装: {display_clothing[:30]}{'...' if len(display_clothing) > 30 else ''}\n"
+            f"{queue_msg}"
             f"━━━━━━━━━━━━━━━\n"
             f"第1步：生成动作线稿中..."
         )
 
-        # ========== 第一步：生成线稿 ==========
+    async def _run_lineart(
+        self,
+        event: AstrMessageEvent,
+        ticket: Job,
+        is_admin: bool,
+        user_id: str,
+        clothing_desc: str,
+        references: dict[str, asyncio.Task],
+        entry: JournalEntry | None,
+    ) -> None:
+        """工作协程执行的线稿转绘任务（已完成积分预扣）：结果通过 event.send 发送"""
+        # 服装描述处理
+        clothing_desc = clothing_desc.strip()
+
+        # 记录开始时间
+        start_time = datetime.now()
+
+        # ========== 第一步：线稿参数 ==========
         lineart_prompt = (
             "将这张角色图转换成简洁的动画人物线稿，去除角色的具体特征，只保留人物的基本姿势和动作。"
             "线条应简洁流畅，强调人体的结构和动态，避免过多的细节，像是绘画练习时的参考图一样。"
@@ -1710,31 +2686,6 @@ class BananaSign(Star):
             "image_size": self.prompt_config.image_size,
         }
 
-        # 下载动作参考图
-        action_images = await self.downloader.fetch_images([action_ref_url])
-        if not action_images:
-            yield event.plain_result("❌ 动作参考图下载失败")
-            return
-
-        # 生成线稿
-        async with self._semaphore:
-            lineart_result, lineart_err = await self._dispatch(
-                params=lineart_params,
-                image_b64_list=action_images,
-            )
-
-        if not lineart_result or lineart_err:
-            yield event.plain_result(f"❌ 线稿生成失败: {lineart_err or '未知错误'}")
-            return
-
-        # 线稿生成完成，继续第二步
-        yield event.plain_result("✅ 第1步完成：线稿已生成\n第2步：使用线稿绘制中...")
-
-        # 检查事件是否已被停止（用户可能已撤回消息）
-        if getattr(event, '_event_has_stopped', False):
-            logger.info(f"[BananaSign] 线稿转绘被中断（用户撤回）")
-            return
-
         # ========== 第二步：用线稿+角色图生成最终图片 ==========
         # 构建服装提示词部分
         clothing_prompt = f"贴身衣物：{clothing_desc}" if clothing_desc else "贴身衣物：保留原图服装"
@@ -1759,52 +2710,83 @@ class BananaSign(Star):
             "image_size": self.prompt_config.image_size,
         }
 
-        # 准备图片：线稿（图1）+ 角色参考（图2）
-        char_images = await self.downloader.fetch_images([char_ref_url])
-        if not char_images:
-            yield event.plain_result("❌ 角色参考图下载失败")
-            return
-
-        # 组合图片列表：线稿在前，角色图在后
-        combined_images = lineart_result + char_images
+        # 两阶段流水线：线稿只用动作参考图，最终图片使用线稿（图1）+ 角色参考（图2）
+        pipeline = Pipeline(
+            [
+                Stage("线稿", lineart_params, ["动作参考图"]),
+                Stage("最终图片", final_params, ["线稿", "角色参考图"]),
+            ]
+        )
 
-        # 生成最终图片
-        async with self._semaphore:
-            final_result, final_err = await self._dispatch(
-                params=final_params,
-                image_b64_list=combined_images,
-            )
+        async def on_stage(stage: Stage, index: int) -> bool:
+            if index == 0:
+                # 线稿生成完成，继续第二步
+                await event.send(
+                    event.plain_result("✅ 第1步完成：线稿已生成\n第2步：使用线稿绘制中...")
+                )
+                # 任务可能已被 /取消画图 取消，不再继续第二步
+                if ticket.cancelled:
+                    logger.info(f"[BananaSign] 线稿转绘任务 #{ticket.job_id} 已取消，停止第2步")
+                    return False
+            return True
 
-        if not final_result or final_err:
-            yield event.plain_result(f"❌ 最终图片生成失败: {final_err or '未知错误'}")
-            return
+        try:
+            result = await self._run_pipeline(pipeline, references, on_stage=on_stage)
+            # 生成已结束，此后的发送不可再被 /取消画图 打断
+            ticket.sending = True
+            if result.stopped:
+                return
+            if result.err:
+                await event.send(event.plain_result(f"❌ {result.err}"))
+                return
+            final_result = result.images
 
-        # 保存图片
-        if self.save_images:
-            save_images(final_result, self.save_dir)
+            # 保存图片
+            if self.save_images:
+                save_images(final_result, self.save_dir)
 
-        # 计算剩余香蕉
-        if self.consume_enabled:
-            remaining = "∞" if is_admin else self._get_user(user_id)["bananas"]
-        else:
-            remaining = None
+            # 计算剩余香蕉
+            if self.consume_enabled:
+                remaining = "∞" if is_admin else self._get_user(user_id)["bananas"]
+            else:
+                remaining = None
 
-        # 计算耗时
-        elapsed = datetime.now() - start_time
-        elapsed_str = f"{int(elapsed.total_seconds() // 60):02d}:{int(elapsed.total_seconds() % 60):02d}"
+            # 计算耗时
+            elapsed = datetime.now() - start_time
+            elapsed_str = f"{int(elapsed.total_seconds() // 60):02d}:{int(elapsed.total_seconds() % 60):02d}"
 
-        # 再次检查事件是否已被停止
-        if getattr(event, '_event_has_stopped', False):
-            logger.info(f"[BananaSign] 线稿转绘被中断（用户撤回）")
-            return
+            # 发送前再次检查任务是否已被取消
+            if ticket.cancelled:
+                logger.info(f"[BananaSign] 线稿转绘任务 #{ticket.job_id} 已取消，不再发送结果")
+                return
 
-        # 发送最终结果
-        yield event.chain_result(
-            self.build_message_chain(
-                event,
-                final_result,
-                remaining_bananas=remaining,
-                elapsed_time=elapsed_str,
-                prefix_text="✅ 线稿转绘完成！\n",
+            # 发送最终结果
+            await event.send(
+                event.chain_result(
+                    self.build_message_chain(
+                        event,
+                        final_result,
+                        remaining_bananas=remaining,
+                        elapsed_time=elapsed_str,
+                        prefix_text="✅ 线稿转绘完成！\n",
+                    )
+                )
             )
-        )
+        except asyncio.CancelledError:
+            logger.info(f"[BananaSign] 线稿转绘任务 #{ticket.job_id} 被取消")
+            if not ticket.cancelled:
+                raise
+            # 被 /取消画图 取消
+            await event.send(
+                event.chain_result(
+                    await self._on_job_cancelled(
+                        event, None if is_admin else user_id, 2
+                    )
+                )
+            )
+        finally:
+            # 未用到的参考图片下载随之停止
+            for reference in references.values():
+                if not reference.done():
+                    reference.cancel()
+            await self._journal_remove(entry)
@@ -0,0 +1,132 @@
+"""测试公共配置
+
+插件运行在 AstrBot 内部，单独跑测试时没有 astrbot 包。这里在导入失败时
+注册最小桩模块（日志器、配置类型、消息组件、指令装饰器等），使 core 下的模块
+可以直接按 ``core.xxx`` 导入，main.py 也可以作为插件包导入。
+"""
+
+import importlib
+import logging
+import sys
+import types
+from dataclasses import field
+from pathlib import Path
+from typing import Generic, TypeVar
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+PLUGIN_PACKAGE = "astrbot_plugin_banana_sign"
+
+
+class _Anything:
+    """消息组件、事件等的占位类型，接受任意构造参数"""
+
+    def __init__(self, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+
+    def __class_getitem__(cls, item):
+        return cls
+
+    @classmethod
+    def fromBase64(cls, *args, **kwargs):
+        return cls(*args, **kwargs)
+
+    fromFileSystem = fromURL = fromBase64
+
+
+class _DecoratorFactory:
+    """filter.command(...) 等装饰器工厂，原样返回被装饰的函数"""
+
+    class EventMessageType:
+        ALL = "all"
+
+    def __getattr__(self, name):
+        def factory(*args, **kwargs):
+            return lambda func: func
+
+        return factory
+
+
+def _install_astrbot_stub():
+    try:
+        import astrbot.api  # noqa: F401
+    except ImportError:
+        pass
+    else:
+        return
+
+    from pydantic.dataclasses import dataclass
+
+    def module(name: str, **attrs) -> types.ModuleType:
+        mod = types.ModuleType(name)
+        mod.__dict__.update(attrs)
+        sys.modules[name] = mod
+        return mod
+
+    T = TypeVar("T")
+
+    @dataclass
+    class FunctionTool(Generic[T]):
+        name: str = ""
+        description: str = ""
+        parameters: dict = field(default_factory=dict)
+
+    class Star:
+        def __init__(self, context=None):
+            self.context = context
+
+    class StarTools:
+        @staticmethod
+        def get_data_dir(name: str) -> Path:
+            raise RuntimeError("测试中不应创建插件数据目录")
+
+    def session_waiter(*args, **kwargs):
+        return lambda func: func
+
+    components = module(
+        "astrbot.api.message_components", __getattr__=lambda name: _Anything
+    )
+    module("astrbot")
+    module("astrbot.api", logger=logging.getLogger("astrbot"), message_components=components)
+    module("astrbot.api.event", AstrMessageEvent=_Anything, filter=_DecoratorFactory())
+    module("astrbot.api.star", Context=_Anything, Star=Star, StarTools=StarTools)
+    module("astrbot.core", AstrBotConfig=dict)
+    module("astrbot.core.config")
+    module("astrbot.core.config.astrbot_config", AstrBotConfig=dict)
+    module("astrbot.core.message")
+    module(
+        "astrbot.core.message.components",
+        BaseMessageComponent=_Anything,
+        Plain=_Anything,
+    )
+    module("astrbot.core.message.message_event_result", MessageChain=_Anything)
+    module("astrbot.core.utils")
+    module(
+        "astrbot.core.utils.session_waiter",
+        SessionController=_Anything,
+        session_waiter=session_waiter,
+    )
+    module("astrbot.core.agent")
+    module("astrbot.core.agent.run_context", ContextWrapper=_Anything)
+    module("astrbot.core.agent.tool", FunctionTool=FunctionTool, ToolExecResult=str)
+    module("astrbot.core.astr_agent_context", AstrAgentContext=_Anything)
+    module("astrbot.core.platform")
+    module("astrbot.core.platform.astr_message_event", AstrMessageEvent=_Anything)
+
+
+_install_astrbot_stub()
+
+
+@pytest.fixture(scope="session")
+def plugin_main() -> types.ModuleType:
+    """以插件包的形式导入 main.py（相对导入需要包上下文）"""
+    if PLUGIN_PACKAGE not in sys.modules:
+        package = types.ModuleType(PLUGIN_PACKAGE)
+        package.__path__ = [str(ROOT)]
+        sys.modules[PLUGIN_PACKAGE] = package
+    return importlib.import_module(f"{PLUGIN_PACKAGE}.main")
@@ -0,0 +1,58 @@
+import asyncio
+
+import pytest
+
+from core.base import BaseProvider
+from core.data import CommonConfig, PromptConfig, ProviderConfig
+from core.deadline import Deadline
+
+
+class ScriptedProvider(BaseProvider):
+    api_type = ""
+
+    def __init__(self, call):
+        super().__init__({}, CommonConfig(max_retry=1), PromptConfig(), None, None)
+        self.call = call
+
+    def _build_request_body(self, provider_config, image_list, params):
+        return b"{}"
+
+    async def _call_api(self, provider_config, **kwargs):
+        return await self.call()
+
+    _call_stream_api = _call_api
+
+
+def _provider_config() -> ProviderConfig:
+    return ProviderConfig(
+        api_name="mock", enabled=True, api_type="Mock", keys=["key"], api_url="", max_concurrent=1
+    )
+
+
+def test_slot_wait_over_budget_is_deadline_exceeded():
+    async def main():
+        provider_config = _provider_config()
+        provider = ScriptedProvider(lambda: asyncio.sleep(0, ([], 200, None)))
+        async with provider_config.pool.slot():
+            return await provider.generate_images(
+                provider_config, {"prompt": "cat"}, deadline=Deadline(0.05)
+            )
+
+    assert asyncio.run(main()) == (None, BaseProvider.DEADLINE_EXCEEDED_MSG)
+
+
+def test_timeout_inside_call_is_not_reported_as_slot_timeout():
+    """请求内部抛出的 TimeoutError 不应被当作等待名额超时吞掉，名额照常归还"""
+    provider_config = _provider_config()
+
+    async def call():
+        raise TimeoutError("upstream")
+
+    async def main():
+        return await ScriptedProvider(call).generate_images(
+            provider_config, {"prompt": "cat"}, deadline=Deadline(10)
+        )
+
+    with pytest.raises(TimeoutError, match="upstream"):
+        asyncio.run(main())
+    assert provider_config.pool.in_use == 0
@@ -0,0 +1,98 @@
+import types
+
+import pytest
+
+import core.circuit_breaker
+from core.circuit_breaker import (
+    STATE_CLOSED,
+    STATE_HALF_OPEN,
+    STATE_OPEN,
+    CircuitBreaker,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> FakeClock:
+    clock = FakeClock()
+    monkeypatch.setattr(
+        core.circuit_breaker, "time", types.SimpleNamespace(monotonic=clock.monotonic)
+    )
+    return clock
+
+
+def test_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker(consecutive_failures=3)
+    for _ in range(2):
+        breaker.record_status(503)
+    assert breaker.state == STATE_CLOSED
+    breaker.record_status(None)
+    assert breaker.state == STATE_OPEN
+    assert not breaker.allow_request()
+    assert breaker.skipped == 1
+
+
+def test_opens_after_consecutive_timeouts(clock):
+    breaker = CircuitBreaker(consecutive_timeouts=2)
+    breaker.record_status(408)
+    breaker.record_status(408)
+    assert breaker.state == STATE_OPEN
+
+
+def test_opens_on_failure_rate(clock):
+    breaker = CircuitBreaker(
+        window=10, min_requests=4, failure_rate=0.5, consecutive_failures=10
+    )
+    for status in (200, 200, 503, 200, 503, 200, 503):
+        breaker.record_status(status)
+    assert breaker.state == STATE_CLOSED
+    breaker.record_status(503)
+    # 近 8 次中 4 次失败，达到 50%
+    assert breaker.state == STATE_OPEN
+
+
+def test_client_errors_do_not_count(clock):
+    breaker = CircuitBreaker(consecutive_failures=2)
+    for _ in range(5):
+        breaker.record_status(401)
+        breaker.record_status(422)
+    assert breaker.state == STATE_CLOSED
+
+
+def test_half_open_allows_single_trial_and_backs_off(clock):
+    breaker = CircuitBreaker(consecutive_failures=1, open_duration=60)
+    breaker.record_status(503)
+    clock.now += 60
+    assert breaker.state == STATE_HALF_OPEN
+    assert breaker.allow_request()
+    # 试探请求进行中，其余请求继续跳过
+    assert not breaker.allow_request()
+
+    breaker.record_status(503)
+    assert breaker.state == STATE_OPEN
+    clock.now += 60
+    # 试探失败后冷却时间翻倍
+    assert breaker.state == STATE_OPEN
+    clock.now += 60
+    assert breaker.allow_request()
+    breaker.record_status(200)
+    assert breaker.state == STATE_CLOSED
+
+
+def test_unreported_trial_is_retried_after_cooldown(clock):
+    breaker = CircuitBreaker(consecutive_failures=1, open_duration=30)
+    breaker.record_status(503)
+    clock.now += 30
+    assert breaker.allow_request()
+    # 试探请求被取消、没有回报结果
+    clock.now += 29
+    assert not breaker.allow_request()
+    clock.now += 1
+    assert breaker.allow_request()
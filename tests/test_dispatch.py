@@ -0,0 +1,244 @@
+import asyncio
+import importlib
+import time
+
+import pytest
+
+PACKAGE = "astrbot_plugin_banana_sign.core"
+
+
+@pytest.fixture
+def plugin_core(plugin_main):
+    """main.py 使用的 core 模块（插件包内的那一份）"""
+    return {
+        name: importlib.import_module(f"{PACKAGE}.{name}")
+        for name in ("base", "data", "circuit_breaker", "eta", "stats")
+    }
+
+
+def make_plugin(plugin_main, plugin_core, scripts: dict, **common):
+    """构造只包含调度所需属性的插件实例，提供商行为由 scripts 按名称指定
+
+    scripts: {api_name: async (call_index) -> (images, status, err)}
+    """
+    base, data = plugin_core["base"], plugin_core["data"]
+    calls: dict[str, int] = {name: 0 for name in scripts}
+
+    class MockProvider(base.BaseProvider):
+        api_type = ""
+
+        def _build_request_body(self, provider_config, image_list, params):
+            return b"{}"
+
+        async def _call_api(self, provider_config, **kwargs):
+            name = provider_config.api_name
+            calls[name] += 1
+            return await scripts[name](calls[name])
+
+        _call_stream_api = _call_api
+
+    common.setdefault("max_retry", 1)
+    common_config = data.CommonConfig(**common)
+    prompt_config = data.PromptConfig()
+    plugin = object.__new__(plugin_main.BananaSign)
+    plugin.common_config = common_config
+    plugin.prompt_config = prompt_config
+    plugin.providers_config = {
+        name: data.ProviderConfig(
+            api_name=name, enabled=True, api_type="Mock", keys=["key"], api_url=""
+        )
+        for name in scripts
+    }
+    plugin.def_enabled_providers = list(scripts)
+    plugin.provider_map = {
+        "Mock": MockProvider({}, common_config, prompt_config, None, None)
+    }
+    plugin.hedge_stats = plugin_core["stats"].HedgeStats()
+    plugin.durations = plugin_core["eta"].DurationModel()
+    plugin.calls = calls
+    return plugin
+
+
+def respond(delay: float, status: int = 200):
+    async def script(call_index: int):
+        await asyncio.sleep(delay)
+        if status == 200:
+            return ["image"], 200, None
+        return None, status, f"状态码 {status}"
+
+    return script
+
+
+def test_failover_to_backup_provider(plugin_main, plugin_core):
+    plugin = make_plugin(
+        plugin_main,
+        plugin_core,
+        {"main": respond(0.01, 503), "backup": respond(0.01)},
+    )
+    images, err = asyncio.run(plugin._dispatch({}))
+    assert images == ["image"] and err is None
+    assert plugin.calls == {"main": 1, "backup": 1}
+
+
+def test_failover_latency_with_circuit_breaker(plugin_main, plugin_core):
+    """主提供商持续 503：熔断后直接跳过，降级延迟从“失败耗时+备用耗时”降为“备用耗时”"""
+    requests = 20
+
+    def measure(breaker_factory):
+        plugin = make_plugin(
+            plugin_main,
+            plugin_core,
+            {"main": respond(0.1, 503), "backup": respond(0.02)},
+        )
+        plugin.providers_config["main"].circuit_breaker = breaker_factory()
+
+        async def run():
+            latencies = []
+            for _ in range(requests):
+                start = time.monotonic()
+                images, _ = await plugin._dispatch({})
+                assert images
+                latencies.append(time.monotonic() - start)
+            return latencies
+
+        return asyncio.run(run()), plugin.calls
+
+    CircuitBreaker = plugin_core["circuit_breaker"].CircuitBreaker
+    never_open, legacy_calls = measure(
+        lambda: CircuitBreaker(consecutive_failures=10**6, min_requests=10**6)
+    )
+    default, current_calls = measure(CircuitBreaker)
+
+    legacy_mean = sum(never_open) / requests
+    current_mean = sum(default) / requests
+    print(
+        f"\nfailover: without breaker mean={legacy_mean * 1000:.0f}ms "
+        f"main calls={legacy_calls['main']}, with breaker mean={current_mean * 1000:.0f}ms "
+        f"main calls={current_calls['main']}, after open p50="
+        f"{sorted(default[3:])[len(default[3:]) // 2] * 1000:.0f}ms"
+    )
+    assert legacy_calls["main"] == requests
+    # 连续 3 次失败后断开，之后的请求不再打到主提供商
+    assert current_calls["main"] == 3
+    assert max(default[3:]) < 0.1
+    assert current_mean < legacy_mean / 2
+
+
+def test_half_open_trial_returns_traffic_to_recovered_provider(
+    plugin_main, plugin_core
+):
+    healthy = {"main": False}
+
+    async def main_script(call_index):
+        await asyncio.sleep(0.01)
+        if healthy["main"]:
+            return ["main-image"], 200, None
+        return None, 503, "状态码 503"
+
+    plugin = make_plugin(
+        plugin_main,
+        plugin_core,
+        {"main": main_script, "backup": respond(0.01)},
+    )
+    CircuitBreaker = plugin_core["circuit_breaker"].CircuitBreaker
+    plugin.providers_config["main"].circuit_breaker = CircuitBreaker(
+        consecutive_failures=1, open_duration=0.2
+    )
+
+    async def run():
+        first, _ = await plugin._dispatch({})
+        skipped, _ = await plugin._dispatch({})
+        healthy["main"] = True
+        await asyncio.sleep(0.2)
+        recovered, _ = await plugin._dispatch({})
+        return first, skipped, recovered
+
+    first, skipped, recovered = asyncio.run(run())
+    assert first == ["image"] and skipped == ["image"]
+    assert recovered == ["main-image"]
+    assert plugin.calls["main"] == 2
+
+
+def test_hedge_fires_after_threshold_and_cancels_loser(plugin_main, plugin_core):
+    cancelled = []
+
+    async def slow_main(call_index):
+        try:
+            await asyncio.sleep(1.0)
+        except asyncio.CancelledError:
+            cancelled.append(call_index)
+            raise
+        return ["main-image"], 200, None
+
+    plugin = make_plugin(
+        plugin_main,
+        plugin_core,
+        {"main": slow_main, "backup": respond(0.02)},
+        hedge_enabled=True,
+        hedge_min_delay=0.1,
+    )
+    start = time.monotonic()
+    images, err = asyncio.run(plugin._dispatch({}))
+    elapsed = time.monotonic() - start
+
+    assert images == ["image"] and err is None
+    assert elapsed < 0.5
+    assert cancelled == [1]
+    assert plugin.hedge_stats.hedged == 1 and plugin.hedge_stats.hedge_wins == 1
+    # 被取消的一方已归还并发名额
+    assert all(cfg.pool.in_use == 0 for cfg in plugin.providers_config.values())
+
+
+def test_no_hedge_when_primary_is_fast(plugin_main, plugin_core):
+    plugin = make_plugin(
+        plugin_main,
+        plugin_core,
+        {"main": respond(0.02), "backup": respond(0.02)},
+        hedge_enabled=True,
+        hedge_min_delay=0.2,
+    )
+    images, _ = asyncio.run(plugin._dispatch({}))
+    assert images == ["image"]
+    assert plugin.calls == {"main": 1, "backup": 0}
+    assert plugin.hedge_stats.hedged == 0
+
+
+def test_hedging_cuts_tail_latency(plugin_main, plugin_core):
+    """主提供商每 5 次有 1 次慢请求（长尾），对比关闭和开启对冲时的延迟"""
+    requests = 20
+
+    async def tail_main(call_index):
+        await asyncio.sleep(0.4 if call_index % 5 == 0 else 0.02)
+        return ["main-image"], 200, None
+
+    def measure(hedge_enabled: bool):
+        plugin = make_plugin(
+            plugin_main,
+            plugin_core,
+            {"main": tail_main, "backup": respond(0.02)},
+            hedge_enabled=hedge_enabled,
+            hedge_min_delay=0.1,
+        )
+
+        async def run():
+            latencies = []
+            for _ in range(requests):
+                start = time.monotonic()
+                images, _ = await plugin._dispatch({})
+                assert images
+                latencies.append(time.monotonic() - start)
+            return sorted(latencies)
+
+        return asyncio.run(run()), plugin
+
+    plain, _ = measure(False)
+    hedged, plugin = measure(True)
+    print(
+        f"\nhedging: off max={plain[-1] * 1000:.0f}ms mean={sum(plain) / requests * 1000:.0f}ms, "
+        f"on max={hedged[-1] * 1000:.0f}ms mean={sum(hedged) / requests * 1000:.0f}ms, "
+        f"hedged {plugin.hedge_stats.hedged}/{requests}"
+    )
+    assert plain[-1] >= 0.4
+    assert hedged[-1] < 0.3
+    # 只有慢请求触发对冲，额外请求数与长尾比例相当
+    assert plugin.hedge_stats.hedged == requests // 5
@@ -0,0 +1,196 @@
+import asyncio
+import shutil
+import ssl
+import subprocess
+import time
+from collections import Counter
+from io import BytesIO
+
+import pytest
+from aiohttp import web
+from curl_cffi import AsyncSession
+from PIL import Image
+
+import core.downloader
+from core.data import CommonConfig
+from core.downloader import Downloader, DownloadRetryPolicy
+
+
+def _png() -> bytes:
+    buf = BytesIO()
+    Image.new("RGB", (8, 8), "red").save(buf, format="PNG")
+    return buf.getvalue()
+
+
+PNG = _png()
+
+
+class FlakyServer:
+    """本地不稳定图床：按路径模拟永久失败、暂时失败、限流与慢响应"""
+
+    def __init__(self):
+        self.hits: Counter[str] = Counter()
+        self.app = web.Application()
+        self.app.router.add_get("/{name}", self.handle)
+        self.runner: web.AppRunner | None = None
+        self.base = ""
+
+    async def handle(self, request: web.Request) -> web.Response:
+        name = request.match_info["name"]
+        self.hits[name] += 1
+        hit = self.hits[name]
+        if name == "missing":
+            return web.Response(status=404)
+        if name == "flaky" and hit <= 2:
+            return web.Response(status=503)
+        if name == "limited" and hit == 1:
+            return web.Response(status=429, headers={"Retry-After": "1"})
+        if name == "limited-long":
+            return web.Response(status=429, headers={"Retry-After": "30"})
+        if name == "slow":
+            await asyncio.sleep(3)
+        return web.Response(body=PNG, content_type="image/png")
+
+    async def __aenter__(self) -> "FlakyServer":
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base = f"http://127.0.0.1:{port}"
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.runner.cleanup()
+
+
+@pytest.fixture(autouse=True)
+def allow_loopback(monkeypatch):
+    # 本地测试服务器位于回环地址，跳过 SSRF 检查
+    monkeypatch.setattr(core.downloader, "is_safe_url", lambda url: True)
+
+
+def _run(scenario):
+    async def main():
+        async with FlakyServer() as server, AsyncSession() as session:
+            downloader = Downloader(session, CommonConfig())
+            # 缩短退避，让测试聚焦在分类与预算上
+            downloader.retry_policy = DownloadRetryPolicy(
+                base_delay=0.05, max_delay=0.2, request_timeout=10, job_budget=10
+            )
+            return await scenario(server, downloader)
+
+    return asyncio.run(main())
+
+
+def test_permanent_failure_is_not_retried():
+    async def scenario(server, downloader):
+        result = await downloader.fetch_images([f"{server.base}/missing"])
+        return result, server.hits["missing"]
+
+    result, hits = _run(scenario)
+    assert result == []
+    assert hits == 1
+
+
+def test_transient_failure_is_retried_until_success():
+    async def scenario(server, downloader):
+        result = await downloader.fetch_images([f"{server.base}/flaky"])
+        return result, server.hits["flaky"]
+
+    result, hits = _run(scenario)
+    assert len(result) == 1 and result[0].data == PNG
+    assert hits == 3
+
+
+def test_rate_limited_waits_full_retry_after():
+    async def scenario(server, downloader):
+        start = time.monotonic()
+        result = await downloader.fetch_images([f"{server.base}/limited"])
+        return result, time.monotonic() - start, server.hits["limited"]
+
+    result, elapsed, hits = _run(scenario)
+    assert len(result) == 1
+    assert hits == 2
+    # Retry-After 为 1s，超过 max_delay(0.2s) 也要等满
+    assert elapsed >= 1.0
+
+
+def test_rate_limited_beyond_budget_gives_up_immediately():
+    async def scenario(server, downloader):
+        start = time.monotonic()
+        result = await downloader.fetch_images(
+            [f"{server.base}/limited-long"], budget=2
+        )
+        return result, time.monotonic() - start, server.hits["limited-long"]
+
+    result, elapsed, hits = _run(scenario)
+    assert result == []
+    assert hits == 1
+    assert elapsed < 1.0
+
+
+def test_total_budget_bounds_slow_downloads():
+    async def scenario(server, downloader):
+        start = time.monotonic()
+        result = await downloader.fetch_images(
+            [f"{server.base}/slow", f"{server.base}/ok"], budget=1.5
+        )
+        return result, time.monotonic() - start
+
+    result, elapsed = _run(scenario)
+    # 慢图超时放弃，快图正常返回，整体不超过预算太多
+    assert len(result) == 1
+    assert elapsed < 3.0
+
+
+def _self_signed_cert(tmp_path) -> ssl.SSLContext:
+    if shutil.which("openssl") is None:
+        pytest.skip("需要 openssl 生成自签名证书")
+    cert, key = tmp_path / "cert.pem", tmp_path / "key.pem"
+    subprocess.run(
+        [
+            "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes",
+            "-keyout", str(key), "-out", str(cert), "-days", "1",
+            "-subj", "/CN=localhost",
+        ],
+        check=True,
+        capture_output=True,
+    )
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(cert, key)
+    return context
+
+
+def test_ssl_fallback_is_per_request(tmp_path, monkeypatch):
+    context = _self_signed_cert(tmp_path)
+    verify_flags: list[bool] = []
+
+    async def main():
+        server = FlakyServer()
+        runner = web.AppRunner(server.app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0, ssl_context=context)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        try:
+            async with AsyncSession() as session:
+                original_get = session.get
+
+                async def recording_get(url, **kwargs):
+                    verify_flags.append(kwargs.get("verify", True))
+                    return await original_get(url, **kwargs)
+
+                monkeypatch.setattr(session, "get", recording_get)
+                downloader = Downloader(session, CommonConfig())
+                url = f"https://127.0.0.1:{port}/ok"
+                first = await downloader.fetch_images([url])
+                second = await downloader.fetch_images([url])
+                return first, second
+        finally:
+            await runner.cleanup()
+
+    first, second = asyncio.run(main())
+    assert len(first) == 1 and len(second) == 1
+    # 每次请求都先校验证书，失败后才对该次请求关闭校验
+    assert verify_flags == [True, False, True, False]
@@ -0,0 +1,149 @@
+import asyncio
+import random
+import statistics
+import types
+
+import pytest
+
+import core.scheduler
+from core.eta import DurationModel
+from core.scheduler import FairScheduler
+
+# (提供商, 分辨率) -> 平均耗时, 单位: 秒
+MEANS = {("fast", "1K"): 20.0, ("fast", "4K"): 45.0, ("slow", "1K"): 60.0, ("slow", "4K"): 120.0}
+
+
+def trace(rng: random.Random, n: int, shift_at: int | None = None):
+    """合成耗时轨迹：对数正态噪声；shift_at 之后 fast 提供商整体变慢 1.5 倍"""
+    keys = list(MEANS)
+    for i in range(n):
+        provider, resolution = rng.choice(keys)
+        mean = MEANS[(provider, resolution)]
+        if shift_at is not None and i >= shift_at and provider == "fast":
+            mean *= 1.5
+        yield provider, resolution, mean * rng.lognormvariate(0, 0.2)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> FakeClock:
+    clock = FakeClock()
+    monkeypatch.setattr(
+        core.scheduler, "time", types.SimpleNamespace(monotonic=clock.monotonic)
+    )
+    return clock
+
+
+def test_duration_model_tracks_per_key_means_and_shifts():
+    rng = random.Random(7)
+    model = DurationModel()
+    samples = list(trace(rng, 400, shift_at=200))
+    # 对照：不区分提供商和分辨率的全局平均
+    baseline_error, history = [], []
+    for provider, resolution, seconds in samples:
+        if history:
+            baseline_error.append(abs(statistics.fmean(history) - seconds))
+        history.append(seconds)
+        model.record(provider, resolution, seconds)
+    baseline = statistics.fmean(baseline_error)
+    mean_seconds = statistics.fmean(history)
+    print(
+        f"\nDurationModel MAE {model.mean_abs_error:.1f}s vs global mean {baseline:.1f}s "
+        f"(mean duration {mean_seconds:.1f}s, {model.samples} samples)"
+    )
+    assert model.mean_abs_error < baseline * 0.5
+    assert model.mean_abs_error < mean_seconds * 0.25
+    # 变慢之后重新收敛到新的平均耗时附近
+    assert model.estimate(["fast"], "1k") == pytest.approx(30.0, rel=0.2)
+    assert model.estimate(["slow"], "4K") == pytest.approx(120.0, rel=0.2)
+
+
+def test_duration_model_fallbacks():
+    model = DurationModel(default=60.0)
+    assert model.estimate(["fast"], "1K") == 60.0
+    model.record("fast", "1K", 20.0)
+    model.record("slow", "4K", 100.0)
+    # 无该分辨率样本时回退到提供商，再回退到全局
+    assert model.estimate(["fast"], "4K") == pytest.approx(model._provider["fast"])
+    assert model.estimate(["other"], "2K") == pytest.approx(model._global)
+    assert model.estimate(["other", "slow"], "4K") == 100.0
+
+
+def _simulate_queue(clock: FakeClock, model: DurationModel, rng: random.Random, noisy: bool):
+    """并发上限 3，24 个任务同时提交后按实际耗时执行
+
+    每个任务结束时（即用户可能查看队列的时刻）对所有排队和运行中的任务做一次 forecast，
+    返回 [(预测剩余完成时间, 实际剩余完成时间)]，以及提交时预测的开始时间与实际开始时间。
+    """
+
+    async def main():
+        scheduler = FairScheduler(3)
+        keys = list(MEANS)
+        actual: dict[int, float] = {}
+        jobs = []
+        for i in range(24):
+            provider, resolution = keys[rng.randrange(len(keys))]
+            mean = MEANS[(provider, resolution)]
+            job = scheduler.submit(
+                f"u{i % 5}", f"g{i % 2}", expected=model.estimate([provider], resolution)
+            )
+            actual[job.job_id] = mean * rng.lognormvariate(0, 0.2) if noisy else job.expected
+            jobs.append(job)
+
+        submitted_at = clock.now
+        snapshots: list[tuple[float, dict[int, tuple[float, float]]]] = []
+        finished: dict[int, float] = {}
+        while scheduler.running:
+            snapshots.append((clock.now, scheduler.forecast()))
+            job = min(
+                scheduler.running_jobs(), key=lambda job: job.started_at + actual[job.job_id]
+            )
+            clock.now = job.started_at + actual[job.job_id]
+            finished[job.job_id] = clock.now
+            scheduler.release(job)
+
+        pairs = [
+            (eta[1], finished[job_id] - at)
+            for at, forecast in snapshots
+            for job_id, eta in forecast.items()
+        ]
+        starts = [
+            (snapshots[0][1][job.job_id][0], job.started_at - submitted_at) for job in jobs
+        ]
+        return pairs, starts
+
+    return asyncio.run(main())
+
+
+def test_forecast_is_exact_when_durations_match(clock):
+    rng = random.Random(3)
+    model = DurationModel()
+    for provider, resolution, seconds in trace(rng, 200):
+        model.record(provider, resolution, seconds)
+    pairs, starts = _simulate_queue(clock, model, rng, noisy=False)
+    assert all(predicted == pytest.approx(real) for predicted, real in starts)
+    assert all(predicted == pytest.approx(real) for predicted, real in pairs)
+
+
+def test_forecast_accuracy_on_noisy_trace(clock):
+    rng = random.Random(11)
+    model = DurationModel()
+    for provider, resolution, seconds in trace(rng, 200):
+        model.record(provider, resolution, seconds)
+    pairs, _ = _simulate_queue(clock, model, rng, noisy=True)
+    relative = sorted(abs(predicted - real) / real for predicted, real in pairs if real > 0)
+    median = relative[len(relative) // 2]
+    p90 = relative[int(len(relative) * 0.9)]
+    print(
+        f"\nforecast finish ETA over {len(relative)} snapshots: "
+        f"median error {median:.0%}, p90 {p90:.0%}"
+    )
+    assert median < 0.15
+    assert p90 < 0.4
@@ -0,0 +1,95 @@
+import base64
+import os
+import time
+import tracemalloc
+import types
+
+import core.data
+from core.data import ImageData
+
+MB = 1024 * 1024
+
+
+def _counting_base64(counter: dict) -> types.SimpleNamespace:
+    def b64encode(data):
+        counter["encode"] += 1
+        return base64.b64encode(data)
+
+    def b64decode(data):
+        counter["decode"] += 1
+        return base64.b64decode(data)
+
+    return types.SimpleNamespace(b64encode=b64encode, b64decode=b64decode)
+
+
+def test_b64_is_encoded_once_and_cached():
+    image = ImageData("image/png", b"\x89PNG" + bytes(64))
+    assert image.size == 68
+    first = image.b64
+    assert image.b64 is first
+    assert base64.b64decode(first) == image.data
+
+
+def test_from_b64_keeps_source_string():
+    raw = os.urandom(1024)
+    b64 = base64.b64encode(raw).decode()
+    image = ImageData.from_b64("image/jpeg", b64)
+    assert image.b64 is b64
+    assert image.data == raw
+
+
+def test_bench_4k_result_with_six_references(monkeypatch):
+    """4K 结果图 + 6 张参考图走完一次请求链路（含一次故障转移重建请求体）
+
+    旧链路以 (mime, base64) 元组传递：下载时编码，尺寸检查和保存时各解码一次；
+    新链路每张图最多编码或解码一次，其余环节复用原始字节或缓存
+    """
+    result_bytes = os.urandom(12 * MB)
+    references = [os.urandom(3 * MB) for _ in range(6)]
+    response_b64 = base64.b64encode(result_bytes).decode()
+
+    def legacy(b64mod):
+        ref_list = [("image/png", b64mod.b64encode(r).decode()) for r in references]
+        for _ in range(2):  # 主提供商 + 故障转移
+            body = [b64 for _, b64 in ref_list]
+        mime, b64 = "image/png", response_b64
+        size = len(b64mod.b64decode(b64))  # 发送前的尺寸检查
+        saved = b64mod.b64decode(b64)  # 保存到本地
+        sent = b64  # 发送
+        return body, size, saved, sent
+
+    def current():
+        ref_list = [ImageData("image/png", r) for r in references]
+        for _ in range(2):
+            body = [image.b64 for image in ref_list]
+        result = ImageData.from_b64("image/png", response_b64)
+        return body, result.size, result.data, result.b64
+
+    legacy_counter = {"encode": 0, "decode": 0}
+    current_counter = {"encode": 0, "decode": 0}
+    monkeypatch.setattr(core.data, "base64", _counting_base64(current_counter))
+
+    measurements = {}
+    for name, run in (
+        ("legacy", lambda: legacy(_counting_base64(legacy_counter))),
+        ("current", current),
+    ):
+        tracemalloc.start()
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        measurements[name] = (peak / MB, elapsed * 1000)
+
+    print(
+        "\n4K+6 refs: "
+        + ", ".join(
+            f"{name} peak={peak:.1f}MiB time={ms:.0f}ms"
+            for name, (peak, ms) in measurements.items()
+        )
+    )
+    assert legacy_counter == {"encode": 6, "decode": 2}
+    assert current_counter == {"encode": 6, "decode": 1}
+    # 峰值内存不应高于旧链路（允许少量测量误差）
+    assert measurements["current"][0] <= measurements["legacy"][0] * 1.05
@@ -0,0 +1,123 @@
+import random
+import types
+
+import pytest
+
+import core.key_pool
+from core.key_pool import KeyPool
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> FakeClock:
+    clock = FakeClock()
+    monkeypatch.setattr(
+        core.key_pool, "time", types.SimpleNamespace(monotonic=clock.monotonic)
+    )
+    return clock
+
+
+class SimulatedProvider:
+    """模拟提供商：一个失效 Key、一个每分钟只放行一次的 Key、一个慢 Key、一个快 Key"""
+
+    FAIL_COST = 0.3
+
+    def __init__(self, clock: FakeClock):
+        self.clock = clock
+        self.limited_window: list[float] = []
+
+    def call(self, key: str) -> tuple[int, float]:
+        """返回 (状态码, 耗时)"""
+        now = self.clock.now
+        if key == "bad":
+            return 401, self.FAIL_COST
+        if key == "limited":
+            self.limited_window = [t for t in self.limited_window if now - t < 60]
+            if self.limited_window:
+                return 429, self.FAIL_COST
+            self.limited_window.append(now)
+            return 200, 1.0
+        if key == "slow":
+            return 200, 4.0
+        return 200, 1.0
+
+
+KEYS = ["bad", "limited", "slow", "fast"]
+
+
+def _simulate(clock: FakeClock, choose_order, report, requests: int = 300):
+    provider = SimulatedProvider(clock)
+    failed_attempts = 0
+    latencies = []
+    for i in range(requests):
+        clock.now = i * 5.0
+        start = clock.now
+        for key in choose_order():
+            status, cost = provider.call(key)
+            clock.now += cost
+            report(key, status, cost)
+            if status == 200:
+                break
+            failed_attempts += 1
+        latencies.append(clock.now - start)
+    return failed_attempts / requests, sum(latencies) / len(latencies)
+
+
+def test_key_pool_beats_round_robin_on_simulated_provider(clock):
+    random.seed(0)
+
+    def round_robin():
+        # 旧实现：随机起点后依次轮询
+        start = random.randrange(len(KEYS))
+        return KEYS[start:] + KEYS[:start]
+
+    legacy = _simulate(clock, round_robin, lambda *args: None)
+
+    pool = KeyPool(KEYS)
+
+    def report(key, status, cost):
+        if status == 200:
+            pool.report_success(key, cost)
+        else:
+            pool.report_failure(key, status)
+
+    current = _simulate(clock, pool.select, report)
+
+    print(
+        f"\nkey pool: round-robin wasted={legacy[0]:.2f}/req latency={legacy[1]:.2f}s, "
+        f"KeyPool wasted={current[0]:.2f}/req latency={current[1]:.2f}s"
+    )
+    assert current[0] < legacy[0] / 4
+    assert current[1] < legacy[1]
+
+
+def test_invalid_key_is_quarantined_and_probed(clock):
+    pool = KeyPool(["bad", "good"])
+    pool.report_failure("bad", 401)
+    assert pool.select() == ["good"]
+
+    clock.now += pool.base_quarantine + 1
+    order = pool.select()
+    assert order[0] == "bad"
+    # 探测期间不会再被其他请求选中
+    assert pool.select() == ["good"]
+
+    pool.report_failure("bad", 401)
+    clock.now += pool.base_quarantine + 1
+    # 第二次硬失败后隔离时间翻倍
+    assert pool.select() == ["good"]
+
+
+def test_retry_after_sets_cooldown(clock):
+    pool = KeyPool(["a", "b"])
+    pool.set_cooldown("a", 10)
+    assert pool.select() == ["b"]
+    clock.now += 11
+    assert sorted(pool.select()) == ["a", "b"]
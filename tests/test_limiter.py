@@ -0,0 +1,121 @@
+import heapq
+import itertools
+import types
+
+import pytest
+
+import core.limiter
+from core.limiter import AIMDLimiter
+
+
+class FakeClock:
+    def __init__(self):
+        # 从较大的时刻开始，避免首次降低落在初始冷却期内
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> FakeClock:
+    clock = FakeClock()
+    monkeypatch.setattr(
+        core.limiter, "time", types.SimpleNamespace(monotonic=clock.monotonic)
+    )
+    return clock
+
+
+def simulate(clock: FakeClock, limit_of, record, duration: float = 3600.0):
+    """离散事件模拟：任务队列始终积压，在途请求数随并发上限补满
+
+    提供商容量为 4 个并发，每个请求耗时 10s；超出容量的请求 0.5s 后返回 429。
+    返回 (每秒成功数, 429 比例)。
+    """
+    capacity, service, reject = 4, 10.0, 0.5
+    events: list[tuple[float, int, int]] = []
+    seq = itertools.count()
+    in_flight = served = 0
+    successes = rejected = 0
+
+    def launch():
+        nonlocal in_flight, served
+        in_flight += 1
+        if served < capacity:
+            served += 1
+            heapq.heappush(events, (clock.now + service, next(seq), 200))
+        else:
+            heapq.heappush(events, (clock.now + reject, next(seq), 429))
+
+    start = clock.now
+    duration += start
+    while in_flight < limit_of():
+        launch()
+    while events:
+        at, _, status = heapq.heappop(events)
+        if at > duration:
+            break
+        clock.now = at
+        in_flight -= 1
+        if status == 200:
+            served -= 1
+            successes += 1
+            record(status, service)
+        else:
+            rejected += 1
+            record(status, reject)
+        while in_flight < limit_of():
+            launch()
+    total = successes + rejected
+    return successes / (duration - start), rejected / total if total else 0.0
+
+
+def test_aimd_converges_near_provider_capacity(clock):
+    ideal = 4 / 10.0
+    results = {}
+    for name, limit in (("fixed-2", 2), ("fixed-8", 8)):
+        results[name] = simulate(clock, lambda limit=limit: limit, lambda *args: None)
+
+    limiter = AIMDLimiter(initial=2, min_limit=1, max_limit=8)
+    limits = []
+
+    def record(status, latency):
+        limiter.record(status, latency)
+        limits.append(limiter.limit)
+
+    results["aimd"] = simulate(clock, lambda: limiter.limit, record)
+
+    print(
+        "\nAIMD vs fixed (capacity 4, 10s/request, 1h): "
+        + ", ".join(
+            f"{name} goodput={rate / ideal:.0%} 429={rejected:.0%}"
+            for name, (rate, rejected) in results.items()
+        )
+        + f", aimd mean limit={sum(limits) / len(limits):.1f}"
+    )
+    fixed2, fixed8, aimd = results["fixed-2"], results["fixed-8"], results["aimd"]
+    # 比保守的固定上限吞吐更高，又比过高的固定上限少得多的 429
+    assert aimd[0] > fixed2[0] * 1.3
+    assert aimd[1] < fixed8[1] / 3
+    assert min(limits) >= 1 and max(limits) <= 8
+
+
+def test_decrease_once_per_cooldown(clock):
+    limiter = AIMDLimiter(initial=8, cooldown=10)
+    for _ in range(5):
+        limiter.record(429, 0.1)
+    assert limiter.limit == 4 and limiter.decreases == 1
+    clock.now += 10
+    limiter.record(503, 0.1)
+    assert limiter.limit == 2
+
+
+def test_slow_success_does_not_increase(clock):
+    limiter = AIMDLimiter(initial=2, latency_tolerance=3.0)
+    limiter.record(200, 1.0)
+    before = limiter._limit
+    limiter.record(200, 10.0)
+    assert limiter._limit == before
+    # Key 无效等客户端错误与容量无关
+    limiter.record(401, 0.1)
+    assert limiter.decreases == 0
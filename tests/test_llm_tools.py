@@ -0,0 +1,135 @@
+import asyncio
+import importlib
+import random
+import types
+
+PACKAGE = "astrbot_plugin_banana_sign.core"
+
+
+class FakeEvent:
+    def __init__(self, user_id: str, group_id: str = "g1"):
+        self.user_id = user_id
+        self.group_id = group_id
+        self.platform_meta = types.SimpleNamespace(name="aiocqhttp")
+        self.sent: list = []
+
+    def get_sender_id(self) -> str:
+        return self.user_id
+
+    def get_group_id(self) -> str:
+        return self.group_id
+
+    async def send(self, message) -> None:
+        self.sent.append(message)
+
+
+class MockProvider:
+    """记录同时在途的生成调用数"""
+
+    def __init__(self):
+        self.in_flight = 0
+        self.peak = 0
+        self.calls = 0
+
+    async def generate(self) -> str:
+        self.calls += 1
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        try:
+            await asyncio.sleep(random.uniform(0.005, 0.03))
+            return "image"
+        finally:
+            self.in_flight -= 1
+
+
+def make_plugin(plugin_main, limit: int, prompt_dict: dict | None = None):
+    scheduler_mod = importlib.import_module(f"{PACKAGE}.scheduler")
+    worker_pool_mod = importlib.import_module(f"{PACKAGE}.worker_pool")
+    provider = MockProvider()
+    scheduler = scheduler_mod.FairScheduler(limit)
+    plugin = types.SimpleNamespace(
+        prompt_dict=prompt_dict or {},
+        scheduler=scheduler,
+        worker_pool=worker_pool_mod.WorkerPool(scheduler, limit),
+        provider=provider,
+        temp_dir=None,
+        is_global_admin=lambda event: False,
+        estimate_duration=lambda params: 1.0,
+        shed_message=lambda reason: reason,
+        _normalize_count=plugin_main.BananaSign._normalize_count,
+        build_message_chain=lambda event, results: results,
+    )
+
+    async def job(event, params, **kwargs):
+        # 与 generate_images 一致：count 张候选图片并发请求
+        results = await asyncio.gather(
+            *(provider.generate() for _ in range(params.get("count", 1)))
+        )
+        return results, None
+
+    plugin.job = job
+    return plugin
+
+
+def _call_tool(plugin_main, plugin, event, **kwargs):
+    llm_tools = importlib.import_module(f"{PACKAGE}.llm_tools")
+    tool = llm_tools.BigBananaTool(plugin=plugin)
+    context = types.SimpleNamespace(context=types.SimpleNamespace(event=event))
+    return tool.call(context, **kwargs)
+
+
+def test_preset_is_copied_and_count_sets_weight(plugin_main):
+    preset = {"prompt": "preset prompt", "count": "9", "aspect_ratio": "16:9"}
+    plugin = make_plugin(plugin_main, limit=8, prompt_dict={"cat": preset})
+
+    async def main():
+        plugin.worker_pool.start()
+        message = await _call_tool(
+            plugin_main, plugin, FakeEvent("u1"), prompt="a cat", preset_name="cat"
+        )
+        (job,) = plugin.scheduler.running_jobs() + plugin.scheduler.ordered()
+        assert await plugin.worker_pool.drain(timeout=2)
+        await plugin.worker_pool.stop()
+        return message, job
+
+    message, job = asyncio.run(main())
+    assert "已提交" in message
+    # 预设本身不被修改
+    assert preset == {"prompt": "preset prompt", "count": "9", "aspect_ratio": "16:9"}
+    # count 被规范化为上限 4，并作为任务占用的名额数
+    assert job.weight == 4
+    assert plugin.provider.calls == 4
+
+
+def test_in_flight_calls_never_exceed_limit(plugin_main):
+    """30 次函数工具调用，候选数量 1~4 随机：所有任务同时在途的提供商调用数不超过并发上限"""
+    random.seed(1)
+    limit = 4
+    presets = {f"p{count}": {"count": count} for count in range(1, 5)}
+    plugin = make_plugin(plugin_main, limit=limit, prompt_dict=presets)
+
+    async def main():
+        plugin.worker_pool.start()
+        events = []
+        for i in range(30):
+            event = FakeEvent(f"u{i % 7}", f"g{i % 3}")
+            events.append(event)
+            await _call_tool(
+                plugin_main,
+                plugin,
+                event,
+                prompt=f"prompt {i}",
+                preset_name=f"p{random.randint(1, 4)}",
+            )
+        assert await plugin.worker_pool.drain(timeout=10)
+        await plugin.worker_pool.stop()
+        return events
+
+    events = asyncio.run(main())
+    assert all(event.sent for event in events)
+    print(
+        f"\nllm tool: {plugin.provider.calls} provider calls, "
+        f"peak in-flight {plugin.provider.peak}/{limit}"
+    )
+    assert plugin.provider.peak <= limit
+    assert plugin.scheduler.used == 0
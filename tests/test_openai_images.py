@@ -0,0 +1,163 @@
+import asyncio
+import base64
+import json
+from io import BytesIO
+
+import pytest
+from aiohttp import web
+from curl_cffi import AsyncSession
+from PIL import Image
+
+import core.downloader
+from core.data import CommonConfig, ImageData, PromptConfig, ProviderConfig
+from core.downloader import Downloader
+from core.openai_images import OpenAIImagesProvider
+
+
+def _png(color: str) -> bytes:
+    buf = BytesIO()
+    Image.new("RGB", (8, 8), color).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+RED, BLUE = _png("red"), _png("blue")
+
+
+class ImagesServer:
+    """本地 OpenAI Images 替身：记录收到的请求，按 mode 返回不同格式的响应"""
+
+    def __init__(self, mode: str = "b64"):
+        self.mode = mode
+        self.requests: list[dict] = []
+        self.app = web.Application()
+        self.app.router.add_post("/v1/images/generations", self.generations)
+        self.app.router.add_post("/v1/images/edits", self.edits)
+        self.app.router.add_get("/files/blue.png", self.file)
+        self.base = ""
+
+    async def _respond(self, request: web.Request, stream: bool):
+        if stream:
+            response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+            await response.prepare(request)
+            events = [
+                {"type": "image_generation.partial_image", "b64_json": base64.b64encode(BLUE).decode()},
+                {
+                    "type": "image_generation.completed",
+                    "b64_json": base64.b64encode(RED).decode(),
+                    "output_format": "png",
+                },
+            ]
+            for event in events:
+                data = f"event: {event['type']}\ndata: {json.dumps(event)}\n\n".encode()
+                # 拆成小块发送，覆盖跨块解析
+                for i in range(0, len(data), 37):
+                    await response.write(data[i : i + 37])
+            await response.write_eof()
+            return response
+        if self.mode == "url":
+            return web.json_response({"data": [{"url": f"{self.base}/files/blue.png"}]})
+        return web.json_response(
+            {"data": [{"b64_json": base64.b64encode(RED).decode()}], "output_format": "png"}
+        )
+
+    async def generations(self, request: web.Request):
+        body = await request.json()
+        self.requests.append({"path": request.path, "json": body})
+        return await self._respond(request, bool(body.get("stream")))
+
+    async def edits(self, request: web.Request):
+        form = await request.post()
+        fields = {k: v for k, v in form.items() if isinstance(v, str)}
+        files = [(k, v.filename, v.content_type, v.file.read()) for k, v in form.items() if not isinstance(v, str)]
+        self.requests.append({"path": request.path, "fields": fields, "files": files})
+        return await self._respond(request, fields.get("stream") == "true")
+
+    async def file(self, request: web.Request):
+        return web.Response(body=BLUE, content_type="image/png")
+
+    async def __aenter__(self) -> "ImagesServer":
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        self.base = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.runner.cleanup()
+
+
+def _generate(server: ImagesServer, params: dict, image_list=None, stream=False, model="gpt-image-1"):
+    async def main():
+        async with server, AsyncSession() as session:
+            common_config = CommonConfig(max_retry=1)
+            downloader = Downloader(session, common_config)
+            provider = OpenAIImagesProvider({}, common_config, PromptConfig(), session, downloader)
+            provider_config = ProviderConfig(
+                api_name="images",
+                enabled=True,
+                api_type="OpenAI_Images",
+                keys=["sk-test"],
+                api_url=f"{server.base}/v1/images",
+                model=model,
+                stream=stream,
+            )
+            return await provider.generate_images(provider_config, params, image_list)
+
+    return asyncio.run(main())
+
+
+def test_generations_json_path():
+    server = ImagesServer()
+    images, err = _generate(server, {"prompt": "cat", "aspect_ratio": "16:9", "count": 2})
+    assert err is None and images[0].data == RED and images[0].mime == "image/png"
+    (request,) = server.requests
+    assert request["path"] == "/v1/images/generations"
+    assert request["json"] == {"model": "gpt-image-1", "prompt": "cat", "n": 2, "size": "1536x1024"}
+
+
+def test_edits_multipart_path():
+    server = ImagesServer()
+    refs = [ImageData("image/png", BLUE), ImageData("image/jpeg", b"\xff\xd8jpeg")]
+    images, err = _generate(server, {"prompt": "猫", "aspect_ratio": "9:16"}, refs)
+    assert err is None and images[0].data == RED
+    (request,) = server.requests
+    assert request["path"] == "/v1/images/edits"
+    assert request["fields"] == {"model": "gpt-image-1", "prompt": "猫", "n": "1", "size": "1024x1536"}
+    assert [(name, ctype, data) for name, _, ctype, data in request["files"]] == [
+        ("image[]", "image/png", BLUE),
+        ("image[]", "image/jpeg", b"\xff\xd8jpeg"),
+    ]
+
+
+def test_url_response_falls_back_to_download(monkeypatch):
+    monkeypatch.setattr(core.downloader, "is_safe_url", lambda url: True)
+    server = ImagesServer(mode="url")
+    images, err = _generate(server, {"prompt": "cat"}, model="dall-e-3")
+    assert err is None and images[0].data == BLUE
+    assert server.requests[0]["json"]["response_format"] == "b64_json"
+
+
+def test_stream_uses_completed_event_only():
+    server = ImagesServer()
+    images, err = _generate(server, {"prompt": "cat"}, stream=True)
+    assert err is None
+    assert [image.data for image in images] == [RED]
+    assert server.requests[0]["json"]["stream"] is True
+
+
+@pytest.mark.parametrize(
+    ("model", "aspect_ratio", "size"),
+    [
+        ("gpt-image-1", "16:9", "1536x1024"),
+        ("gpt-image-1-mini", "3:4", "1024x1536"),
+        ("dall-e-3", "16:9", "1792x1024"),
+        ("DALL-E-3", "9:16", "1024x1792"),
+        ("dall-e-3", "1:1", "1024x1024"),
+        ("dall-e-2", "16:9", None),
+        ("flux-kontext", "16:9", None),
+        ("gpt-image-1", "default", None),
+    ],
+)
+def test_size_per_model_family(model, aspect_ratio, size):
+    assert OpenAIImagesProvider._size_from_aspect_ratio(model, aspect_ratio) == size
@@ -0,0 +1,94 @@
+import json
+import os
+import tracemalloc
+from email import message_from_bytes
+
+from core.data import ImageData
+from core.request_body import JsonBodyBuilder, build_multipart_body
+
+MB = 1024 * 1024
+
+
+def _context(images: list[ImageData], embed) -> dict:
+    return {
+        "contents": [
+            {
+                "parts": [
+                    {"text": "画一只猫 <not-a-marker:0> \"quoted\""},
+                    *(
+                        {"inlineData": {"mimeType": image.mime, "data": embed(image)}}
+                        for image in images
+                    ),
+                ]
+            }
+        ],
+        "generationConfig": {"responseModalities": ["IMAGE"]},
+    }
+
+
+def test_json_body_matches_plain_serialization():
+    images = [ImageData("image/png", os.urandom(1000 + i)) for i in range(3)]
+    builder = JsonBodyBuilder()
+    body = builder.build(_context(images, builder.image))
+    assert json.loads(body) == _context(images, lambda image: image.b64)
+
+
+def test_multipart_body_round_trips():
+    images = [ImageData("image/png", os.urandom(512)), ImageData("image/jpeg", b"\xff\xd8")]
+    body = build_multipart_body(
+        "XBOUNDARYX",
+        {"model": "gpt-image-1", "prompt": "中文提示词"},
+        [("image[]", f"{i}.png", image) for i, image in enumerate(images)],
+    )
+    message = message_from_bytes(
+        b"Content-Type: multipart/form-data; boundary=XBOUNDARYX\r\n\r\n" + body
+    )
+    parts = message.get_payload()
+    assert [part.get_param("name", header="content-disposition") for part in parts] == [
+        "model",
+        "prompt",
+        "image[]",
+        "image[]",
+    ]
+    assert parts[1].get_payload(decode=True).decode("utf-8") == "中文提示词"
+    assert parts[2].get_payload(decode=True) == images[0].data
+    assert parts[3].get_content_type() == "image/jpeg"
+
+
+def _peak(run) -> float:
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / MB
+
+
+def test_bench_six_image_request_body():
+    """6 张 3 MiB 参考图，一次请求 + 两次重试
+
+    旧实现每次尝试都把含 Base64 的上下文交给 json.dumps 再编码；
+    新实现只序列化骨架，并在重试间复用同一份请求体
+    """
+    images = [ImageData("image/png", os.urandom(3 * MB)) for _ in range(6)]
+    for image in images:
+        image.b64  # 两种实现都复用 ImageData 的 Base64 缓存，不计入对比
+    attempts = 3
+
+    def legacy():
+        for _ in range(attempts):
+            body = json.dumps(_context(images, lambda image: image.b64)).encode()
+            del body
+
+    def current():
+        builder = JsonBodyBuilder()
+        body = builder.build(_context(images, builder.image))
+        for _ in range(attempts):
+            assert body
+
+    legacy_peak = _peak(legacy)
+    current_peak = _peak(current)
+    print(
+        f"\n6 refs request body: legacy peak={legacy_peak:.1f}MiB, "
+        f"current peak={current_peak:.1f}MiB"
+    )
+    assert current_peak < legacy_peak * 0.75
@@ -0,0 +1,69 @@
+import base64
+import json
+import os
+import tracemalloc
+
+from curl_cffi.requests import Response
+
+from core.base import BaseProvider
+
+MB = 1024 * 1024
+
+
+def test_preview_is_bounded_and_tolerates_split_characters():
+    content = ("中" * 1000).encode("utf-8")
+    preview = BaseProvider._preview(content, limit=1024)
+    # 1024 字节截断在一个三字节汉字中间，尾部替换为占位符而不是抛异常
+    assert len(preview.encode("utf-8")) <= 1024 + 3
+    assert preview.startswith("中" * 341)
+
+
+def test_bench_4k_response_parse():
+    """4K 结果图（12 MiB PNG，约 16 MiB 响应）被判定为审查拦截并记录日志
+
+    旧实现用 response.text[:1024] 记录日志，完整解码的文本缓存在 response 上；
+    新实现只解码前 1 KiB 原始字节
+    """
+    b64 = base64.b64encode(os.urandom(12 * MB)).decode()
+    content = json.dumps(
+        {
+            "candidates": [
+                {
+                    "finishReason": "SAFETY",
+                    "content": {
+                        "parts": [{"inlineData": {"mimeType": "image/png", "data": b64}}]
+                    },
+                }
+            ]
+        }
+    ).encode()
+    del b64
+
+    def legacy(response):
+        return response.json(), response.text[:1024]
+
+    def current(response):
+        return json.loads(response.content), BaseProvider._preview(response.content)
+
+    measurements = {}
+    for name, parse in (("legacy", legacy), ("current", current)):
+        response = Response()
+        response.content = content
+        tracemalloc.start()
+        result = parse(response)
+        retained, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        measurements[name] = (retained / MB, peak / MB)
+        assert result[0]["candidates"][0]["finishReason"] == "SAFETY"
+        del result, response
+
+    print(
+        "\n4K response parse: "
+        + ", ".join(
+            f"{name} retained={retained:.1f}MiB peak={peak:.1f}MiB"
+            for name, (retained, peak) in measurements.items()
+        )
+    )
+    # 不再缓存完整的响应文本
+    assert measurements["current"][0] < measurements["legacy"][0] * 0.6
+    assert measurements["current"][1] <= measurements["legacy"][1] * 1.05
@@ -0,0 +1,71 @@
+import base64
+import json
+import os
+import random
+
+import pytest
+
+from core.sse import SSEParser
+
+
+def _reference_payloads(stream: bytes) -> list[bytes]:
+    """整体解码后逐行解析，作为分块解析的对照结果"""
+    payloads = []
+    for line in stream.decode("utf-8").splitlines():
+        if line.startswith("data:"):
+            payload = line[5:].removeprefix(" ").strip()
+            if payload:
+                payloads.append(payload.encode("utf-8"))
+    return payloads
+
+
+def _build_stream(rng: random.Random, newline: bytes) -> bytes:
+    image = base64.b64encode(os.urandom(rng.randint(1, 256 * 1024))).decode()
+    events = [
+        b": keep-alive",
+        b"event: response.output_text.delta",
+        b"data: " + json.dumps({"delta": "中文增量 ☃"}).encode(),
+        b"",
+        b"data:" + json.dumps({"type": "partial", "n": 1}).encode(),
+        b"id: 42",
+        b"",
+        b"data: " + json.dumps({"inlineData": {"data": image}}).encode(),
+        b"data: ",
+        b"",
+        b"data: [DONE]",
+    ]
+    return newline.join(events) + rng.choice([newline, b""])
+
+
+def _split(stream: bytes, rng: random.Random) -> list[bytes]:
+    chunks, pos = [], 0
+    while pos < len(stream):
+        size = rng.choice([1, 2, 3, 7, 64, 1024, 16 * 1024])
+        chunks.append(stream[pos : pos + size])
+        pos += size
+    return chunks
+
+
+@pytest.mark.parametrize("newline", [b"\n", b"\r\n"])
+@pytest.mark.parametrize("seed", range(20))
+def test_random_chunk_splits_match_whole_stream(seed, newline):
+    rng = random.Random(seed)
+    stream = _build_stream(rng, newline)
+    parser = SSEParser()
+    payloads = []
+    for chunk in _split(stream, rng):
+        payloads.extend(parser.feed(chunk))
+    payloads.extend(parser.flush())
+
+    assert payloads == _reference_payloads(stream)
+    assert parser.received_bytes == len(stream)
+    assert payloads[-1] == b"[DONE]"
+    assert json.loads(payloads[0]) == {"delta": "中文增量 ☃"}
+
+
+def test_crlf_split_between_cr_and_lf():
+    parser = SSEParser()
+    assert parser.feed(b'data: {"a": 1}\r') == []
+    assert parser.feed(b'\ndata: {"b"') == [b'{"a": 1}']
+    assert parser.feed(b": 2}") == []
+    assert parser.flush() == [b'{"b": 2}']
@@ -0,0 +1,105 @@
+import asyncio
+import time
+
+from core.scheduler import FairScheduler
+from core.singleflight import SingleFlight
+from core.worker_pool import WorkerPool
+
+
+async def _noop_abort(reason: str) -> None:
+    pass
+
+
+def test_coalesced_follower_yields_slot_and_worker():
+    """并发上限 2：首个请求与合并请求运行中，第三个任务应在合并发生后立即开始，而非等首个请求结束"""
+
+    async def main():
+        scheduler = FairScheduler(2)
+        pool = WorkerPool(scheduler, 2)
+        pool.start()
+        flight = SingleFlight()
+        started: dict[str, float] = {}
+        results: dict[str, str] = {}
+        t0 = time.monotonic()
+
+        async def generate():
+            await asyncio.sleep(0.3)
+            return "image"
+
+        def coalesced_run(name, job):
+            async def run():
+                started[name] = time.monotonic() - t0
+                results[name], _ = await flight.do(
+                    "same", generate, on_join=lambda: scheduler.detach(job)
+                )
+
+            return run
+
+        leader = scheduler.submit("u1")
+        pool.submit(leader, coalesced_run("leader", leader), _noop_abort)
+        follower = scheduler.submit("u2")
+        pool.submit(follower, coalesced_run("follower", follower), _noop_abort)
+
+        async def other():
+            started["other"] = time.monotonic() - t0
+            assert scheduler.used <= scheduler.limit
+            await asyncio.sleep(0.05)
+
+        third = scheduler.submit("u3")
+        pool.submit(third, other, _noop_abort)
+
+        assert await pool.drain(timeout=2)
+        await pool.stop()
+        return scheduler, pool, started, results, follower
+
+    scheduler, pool, started, results, follower = asyncio.run(main())
+    assert results == {"leader": "image", "follower": "image"}
+    assert follower.detached
+    # 第三个任务不必等首个请求的 0.3s
+    assert started["other"] < 0.1
+    assert pool.completed == 3
+    assert scheduler.running == 0 and scheduler.used == 0
+
+
+def test_detached_follower_can_still_be_cancelled():
+    async def main():
+        scheduler = FairScheduler(2)
+        pool = WorkerPool(scheduler, 2)
+        pool.start()
+        flight = SingleFlight()
+        gate = asyncio.Event()
+        outcome: dict[str, object] = {}
+
+        async def generate():
+            await gate.wait()
+            return "image"
+
+        leader = scheduler.submit("u1")
+        follower = scheduler.submit("u2")
+
+        async def run_leader():
+            outcome["leader"], _ = await flight.do("same", generate)
+
+        async def run_follower():
+            try:
+                await flight.do("same", generate, on_join=lambda: scheduler.detach(follower))
+            except asyncio.CancelledError:
+                outcome["follower"] = "cancelled"
+                raise
+
+        pool.submit(leader, run_leader, _noop_abort)
+        pool.submit(follower, run_follower, _noop_abort)
+        while not follower.detached:
+            await asyncio.sleep(0.01)
+
+        assert [job.job_id for job in scheduler.jobs_of("u2")] == [follower.job_id]
+        assert scheduler.cancel(follower)
+        await asyncio.sleep(0.01)
+        gate.set()
+        assert await pool.drain(timeout=2)
+        await pool.stop()
+        return scheduler, outcome
+
+    scheduler, outcome = asyncio.run(main())
+    assert outcome == {"follower": "cancelled", "leader": "image"}
+    assert scheduler.running == 0